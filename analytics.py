@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TenderFinder Commercial - Аналитика цен по лотам (lot_analytics)
+
+Для каждого лота: лучшая цена по странам, разброс цен, оценка стоимости
+закупки и маржи на количество лота, медиана и среднее без выбросов.
+Таблицу создает migrations/011_lot_analytics.sql. Все цены - в тенге, как
+и цена тендера: цены магазинов пересчитываются по currency_rates
+(012_currency_rates.sql), товары в валюте без курса не учитываются.
+
+Пересчитываются только лоты, у которых с прошлого прогона сменилась
+lot_summaries.version (ее увеличивают триггеры при изменении товаров лота,
+его цены или количества; migrations/015). Страницы пересчитанных лотов
+сбрасываются через NOTIFY lot_changed.
+
+    python analytics.py run [--batch-size 500]    # изменившиеся лоты
+    python analytics.py run --full                # все лоты заново
+    python analytics.py run --follow              # и дальше следить за изменениями
+    python analytics.py show LOT-123              # посчитать лот, ничего не записывая
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from decimal import Decimal
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+COUNTRIES = ['KZ', 'RU', 'CN']
+
+# Выбросы - цены за пределами [Q1 - k * IQR, Q3 + k * IQR] (границы Тьюки).
+# На малой выборке квартили ничего не говорят, поэтому там берутся все цены
+OUTLIER_K = Decimal('1.5')
+OUTLIER_MIN_PRICES = 4
+
+COLUMNS = ['prices_count', 'outliers_count',
+           'kz_best_price', 'ru_best_price', 'cn_best_price', 'best_price', 'best_country',
+           'median_price', 'mean_price', 'max_price', 'price_spread', 'country_spread',
+           'est_cost', 'est_margin', 'margin_pct']
+
+CENTS = Decimal('0.01')
+
+
+# ============================================================================
+# РАСЧЕТ
+# ============================================================================
+
+def fences(values):
+    """Границы цен без выбросов: (low, high) или (None, None) на малой выборке"""
+    if len(values) < OUTLIER_MIN_PRICES:
+        return None, None
+    q1, _, q3 = statistics.quantiles(values, n=4, method='inclusive')
+    iqr = q3 - q1
+    return q1 - OUTLIER_K * iqr, q3 + OUTLIER_K * iqr
+
+
+def _round(value):
+    return value.quantize(CENTS) if value is not None else None
+
+
+def analyze(lot, prices):
+    """
+    Аналитика одного лота: dict по COLUMNS.
+
+    lot - dict с tender_price и quantity (None, если лота нет в lots),
+    prices - [(country, price)] его товаров в тенге; товары без цены не
+    учитываются. Лучшие цены, разброс и маржа считаются по ценам без
+    выбросов. best_country - None, если лучшая цена у товара площадки
+    неизвестной страны.
+    """
+    priced = [(country, price) for country, price in prices if price is not None and price > 0]
+    low, high = fences([price for _, price in priced])
+    kept = [(country, price) for country, price in priced
+            if low is None or low <= price <= high]
+
+    result = dict.fromkeys(COLUMNS)
+    result['prices_count'] = len(priced)
+    result['outliers_count'] = len(priced) - len(kept)
+    if not kept:
+        return result
+
+    values = sorted(price for _, price in kept)
+    best = {}
+    for country, price in kept:
+        if country in COUNTRIES and (country not in best or price < best[country]):
+            best[country] = price
+    for country in COUNTRIES:
+        result[f'{country.lower()}_best_price'] = best.get(country)
+
+    best_country, best_price = min(kept, key=lambda item: item[1])
+    result.update({
+        'best_price': best_price,
+        'best_country': best_country if best_country in COUNTRIES else None,
+        'median_price': _round(statistics.median(values)),
+        'mean_price': _round(statistics.mean(values)),
+        'max_price': values[-1],
+        'price_spread': values[-1] - best_price,
+    })
+    if len(best) > 1:
+        result['country_spread'] = max(best.values()) - min(best.values())
+
+    quantity = lot['quantity'] if lot else None
+    tender_price = lot['tender_price'] if lot else None
+    if quantity is not None:
+        result['est_cost'] = best_price * quantity
+        if tender_price is not None:
+            result['est_margin'] = tender_price - result['est_cost']
+            if tender_price:
+                result['margin_pct'] = _round(result['est_margin'] * 100 / tender_price)
+    return result
+
+
+# ============================================================================
+# ЗАДАНИЕ
+# ============================================================================
+
+def load(cursor, lot_numbers):
+    """{lot_number: (lot, [(country, цена в тенге)])} для указанных лотов"""
+    cursor.execute("""
+        SELECT lot_number, tender_price, quantity FROM lots
+        WHERE lot_number = ANY(%s)
+    """, [list(lot_numbers)])
+    lots = {row[0]: {'tender_price': row[1], 'quantity': row[2]} for row in cursor.fetchall()}
+
+    cursor.execute("""
+        SELECT sr.lot_number, sr.country, round(sr.price * r.kzt_rate, 2)
+        FROM search_results sr
+        JOIN currency_rates r ON r.currency = sr.currency
+        WHERE sr.lot_number = ANY(%s) AND sr.price IS NOT NULL
+    """, [list(lot_numbers)])
+    prices = {lot_number: [] for lot_number in lot_numbers}
+    for lot_number, country, price in cursor.fetchall():
+        prices[lot_number].append((country, price))
+
+    return {lot_number: (lots.get(lot_number), prices[lot_number]) for lot_number in lot_numbers}
+
+
+def refresh_batch(conn, after='', batch_size=500, full=False):
+    """
+    Пересчитать следующую пачку лотов после after (по lot_number).
+
+    Возвращает (число лотов, последний lot_number). Пачка - отдельная
+    транзакция. Версия читается раньше товаров: если лот изменится
+    посередине, строка получит старую версию и пересчитается в следующий раз.
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT s.lot_number, s.version
+        FROM lot_summaries s
+        LEFT JOIN lot_analytics a ON a.lot_number = s.lot_number
+        WHERE s.lot_number > %s
+          {'' if full else 'AND (a.lot_number IS NULL OR a.source_version < s.version)'}
+        ORDER BY s.lot_number
+        LIMIT %s
+    """, [after, batch_size])
+    versions = dict(cursor.fetchall())
+    if not versions:
+        conn.rollback()
+        cursor.close()
+        return 0, None
+
+    values = []
+    for lot_number, (lot, prices) in load(cursor, versions).items():
+        result = analyze(lot, prices)
+        values.append((lot_number, versions[lot_number]) + tuple(result[c] for c in COLUMNS))
+
+    # Параллельный прогон с более новой версией не перезаписывается
+    execute_values(cursor, f"""
+        INSERT INTO lot_analytics (lot_number, source_version, {', '.join(COLUMNS)})
+        VALUES %s
+        ON CONFLICT (lot_number) DO UPDATE SET
+            source_version = EXCLUDED.source_version,
+            {', '.join(f'{c} = EXCLUDED.{c}' for c in COLUMNS)},
+            computed_at = now()
+        WHERE lot_analytics.source_version <= EXCLUDED.source_version
+    """, values, page_size=len(values))
+    cursor.execute("SELECT notify_lot_changed(%s::text[])", [list(versions)])
+    conn.commit()
+    cursor.close()
+    return len(versions), list(versions)[-1]
+
+
+def delete_orphans(conn):
+    """Удалить аналитику лотов, у которых больше нет товаров"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        DELETE FROM lot_analytics a
+        WHERE NOT EXISTS (SELECT 1 FROM lot_summaries s WHERE s.lot_number = a.lot_number)
+        RETURNING a.lot_number
+    """)
+    deleted = [row[0] for row in cursor.fetchall()]
+    cursor.execute("SELECT notify_lot_changed(%s::text[])", [deleted])
+    conn.commit()
+    cursor.close()
+    return len(deleted)
+
+
+def refresh(conn, batch_size=500, full=False, progress=None):
+    """Один проход по лотам: пересчитать изменившиеся (full - все), удалить лишние"""
+    after = ''
+    done = 0
+    started = time.monotonic()
+    while True:
+        count, after = refresh_batch(conn, after, batch_size, full)
+        done += count
+        if count and progress:
+            elapsed = time.monotonic() - started
+            progress(f'{done} лотов, {done / elapsed if elapsed else 0:.0f} лотов/с')
+        if count < batch_size:
+            break
+    delete_orphans(conn)
+    return done
+
+
+def run(conn, batch_size=500, full=False, follow=False, poll_interval=30.0, progress=None):
+    """
+    Пересчитать аналитику изменившихся лотов.
+
+    follow=True - не останавливаться, а проверять изменения каждые
+    poll_interval секунд (фоновый процесс).
+    """
+    done = refresh(conn, batch_size, full, progress)
+    while follow:
+        time.sleep(poll_interval)
+        done += refresh(conn, batch_size, progress=progress)
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Аналитика цен по лотам (lot_analytics)')
+    parser.add_argument('--dsn', default=os.getenv('DATABASE_URL'))
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_run = sub.add_parser('run', help='пересчитать изменившиеся лоты')
+    p_run.add_argument('--batch-size', type=int, default=500)
+    p_run.add_argument('--full', action='store_true', help='пересчитать все лоты')
+    p_run.add_argument('--follow', action='store_true', help='следить за изменениями')
+    p_run.add_argument('--poll-interval', type=float, default=30.0)
+
+    p_show = sub.add_parser('show', help='посчитать один лот без записи')
+    p_show.add_argument('lot_number')
+
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error('укажите --dsn или DATABASE_URL')
+
+    conn = psycopg2.connect(args.dsn)
+    try:
+        if args.command == 'show':
+            lot, prices = load(conn.cursor(), [args.lot_number])[args.lot_number]
+            if lot is None and not prices:
+                print(f'Лот {args.lot_number} не найден')
+                return 1
+            for column, value in analyze(lot, prices).items():
+                print(f'{column}\t{value}')
+            return 0
+
+        started = time.monotonic()
+        total = run(conn, args.batch_size, args.full, args.follow, args.poll_interval, progress=print)
+        print(f'Готово: {total} лотов за {time.monotonic() - started:.1f} с')
+        return 0
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
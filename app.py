@@ -1,90 +1,356 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-TenderFinder Commercial - Используем SQLite для users (как в старом проекте)
+TenderFinder Commercial - Веб-приложение (пользователи - users.py: SQLite или PostgreSQL)
 """
 
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, g, make_response, Response, has_request_context
 from flask_cors import CORS
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from decimal import Decimal
 import psycopg2
+from psycopg2.extensions import QueryCanceledError
 from psycopg2.extras import RealDictCursor
 import os
-import sqlite3
+import select
+import socket
+import threading
+import time
+from contextlib import contextmanager, nullcontext
 from functools import wraps
 
+import cache
+import catalog_query
+import db
+import export
+import ingest
+import instrumentation
+import marketplaces
+import migrate
+import users
+
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY', 'tenderfinder-secret-key-2025')
-CORS(app, supports_credentials=True)
+# Сайты, которым разрешены запросы к API с cookie сессии (через запятую);
+# по умолчанию - никому, кроме самого приложения
+CORS_ORIGINS = [origin.strip() for origin in os.getenv('CORS_ORIGINS', '').split(',')
+                if origin.strip()]
+CORS(app, origins=CORS_ORIGINS, supports_credentials=True)
+instrumentation.init_app(app)
 
 # PostgreSQL для данных тендеров
 DATABASE_URL = os.getenv('DATABASE_URL')
 
-# SQLite для пользователей (как в старом проекте!)
-USERS_DB = 'users.db'
+# Пользователи: sqlite - файл USERS_DB (разработка), postgres - общая база
+# тендеров (migrations/010_users.sql, перенос - python users.py copy)
+USERS_BACKEND = os.getenv('USERS_BACKEND', 'sqlite')
 
-# ============================================================================
-# DATABASE - SQLite для пользователей
-# ============================================================================
+# Сколько секунд считать свежей общую статистику (/api/stats, /admin)
+STATS_CACHE_TTL = float(os.getenv('STATS_CACHE_TTL', 60))
+
+# Кеш страниц лотов, секунд; сбрасывается раньше по NOTIFY lot_changed
+LOT_CACHE_TTL = float(os.getenv('LOT_CACHE_TTL', 300))
+
+# Проверка схемы при старте воркера: непримененные миграции и seq scan
+# в планах горячих запросов пишутся в журнал tenderfinder.schema
+SCHEMA_CHECK = os.getenv('SCHEMA_CHECK', '1') == '1'
+
+# Кеш пользователей между запросами, секунд (0 - выключен). Сброс при
+# изменении доступа виден только в этом воркере, в остальных - через TTL
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 0))
 
-def init_users_db():
-    """Инициализация SQLite базы для пользователей"""
-    conn = sqlite3.connect(USERS_DB)
-    c = conn.cursor()
-    
-    # Таблица пользователей
-    c.execute('''CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        email TEXT UNIQUE NOT NULL,
-        password_hash TEXT NOT NULL,
-        is_admin INTEGER DEFAULT 0,
-        has_access INTEGER DEFAULT 0,
-        access_until TEXT,
-        created_at TEXT DEFAULT CURRENT_TIMESTAMP
-    )''')
-    
-    # Создать админа если нет
-    c.execute('SELECT * FROM users WHERE email = ?', ('admin@tenderfinder.com',))
-    if not c.fetchone():
-        c.execute('''INSERT INTO users (email, password_hash, is_admin, has_access) 
-                     VALUES (?, ?, ?, ?)''',
-                  ('admin@tenderfinder.com', generate_password_hash('admin123'), 1, 1))
-    
-    conn.commit()
-    conn.close()
-
-# Инициализация при старте
-init_users_db()
+# Предел времени одной SQL-команды, мс (0 - без предела): тяжелый запрос
+# прерывает сам PostgreSQL, а не HTTP-таймаут воркера. У каталога - свой,
+# короче: там есть запасной ответ
+STATEMENT_TIMEOUT_MS = int(os.getenv('STATEMENT_TIMEOUT_MS', 10000))
+CATALOG_STATEMENT_TIMEOUT_MS = int(os.getenv('CATALOG_STATEMENT_TIMEOUT_MS', 3000))
+ROUTE_STATEMENT_TIMEOUTS = {
+    'catalog': CATALOG_STATEMENT_TIMEOUT_MS,
+    'api_lots': CATALOG_STATEMENT_TIMEOUT_MS,
+}
+
+# Отменять команду запроса, если клиент закрыл соединение
+CANCEL_ON_DISCONNECT = os.getenv('CANCEL_ON_DISCONNECT', '1') == '1'
+
+# Сколько секунд хранить последние удачные страницы каталога - их отдают,
+# когда база медленная или недоступна (в памяти воркера)
+CATALOG_FALLBACK_TTL = float(os.getenv('CATALOG_FALLBACK_TTL', 3600))
 
 # ============================================================================
 # DATABASE - PostgreSQL для тендеров
 # ============================================================================
 
 def get_db_connection():
-    """Получить подключение к PostgreSQL"""
-    if DATABASE_URL:
-        return psycopg2.connect(DATABASE_URL)
-    return None
+    """
+    Получить подключение к PostgreSQL из пула.
+
+    Подключение привязано к запросу: повторные вызовы возвращают его же,
+    а в пул оно возвращается в teardown - в том числе после исключения.
+    """
+    if not DATABASE_URL:
+        return None
+    if 'db_conn' not in g:
+        g.db_conn = db.get_pool().getconn(statement_timeout=route_statement_timeout())
+        sock = client_socket()
+        if sock is not None:
+            g.db_watch = db.get_watchdog().watch(g.db_conn, lambda: client_gone(sock))
+    return g.db_conn
+
+@app.teardown_appcontext
+def release_db_connection(exc):
+    """Вернуть подключение запроса в пул"""
+    watch = g.pop('db_watch', None)
+    if watch is not None:
+        db.get_watchdog().unwatch(watch)
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        db.get_pool().putconn(conn, discard=bool(conn.closed))
+
+def route_statement_timeout():
+    """statement_timeout для текущего маршрута (вне запроса - общий)"""
+    if has_request_context():
+        return ROUTE_STATEMENT_TIMEOUTS.get(request.endpoint, STATEMENT_TIMEOUT_MS)
+    return STATEMENT_TIMEOUT_MS
+
+def client_socket():
+    """Сокет клиента текущего запроса (gunicorn, сервер разработки) или None"""
+    if not CANCEL_ON_DISCONNECT or not has_request_context():
+        return None
+    return request.environ.get('gunicorn.socket') or request.environ.get('werkzeug.socket')
+
+def client_gone(sock):
+    """Клиент закрыл соединение: сокет читается без ожидания, но данных нет (EOF)"""
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b''
+    except ValueError:
+        # Сокет уже закрыт сервером или TLS (MSG_PEEK не поддерживается)
+        return False
+    except OSError:
+        return True
+
+if DATABASE_URL and SCHEMA_CHECK:
+    migrate.check_in_background(db.get_pool)
+
+# ============================================================================
+# DATABASE - сбои и запасные ответы
+# ============================================================================
+
+# Ошибки, при которых у маршрутов есть запасной ответ
+DB_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError, db.PoolTimeout, db.CircuitOpen)
+
+def db_failure_message(e):
+    """Сообщение пользователю об ошибке из DB_ERRORS"""
+    if isinstance(e, QueryCanceledError):
+        return 'Запрос выполнялся слишком долго и был остановлен. Уточните поиск или фильтры.'
+    return 'База тендеров временно недоступна. Попробуйте обновить страницу через минуту.'
+
+class ClientDisconnected(Exception):
+    """Клиент закрыл соединение - его команда отменена, ответ читать некому"""
+
+@app.errorhandler(ClientDisconnected)
+def client_disconnected(e):
+    return '', 499
+
+def route_name():
+    """Маршрут для меток метрик (вне запроса - фоновое обновление кеша)"""
+    if has_request_context() and request.url_rule:
+        return request.url_rule.rule
+    return '<background>'
+
+@contextmanager
+def heavy_query():
+    """
+    Запросы к базе тендеров под предохранителем (db.CircuitBreaker).
+
+    Контекстный менеджер или декоратор (@heavy_query() - на каждый вызов).
+    Пока предохранитель разомкнут - сразу db.CircuitOpen, без похода в базу.
+    Потеря подключения и пустой пул - сбои базы (метрика и предохранитель).
+    Таймаут - только метрика: база ответила, медленным был сам запрос, и
+    одна тяжелая выборка не должна отключать сайт всем. Подключение запроса
+    откатывается, чтобы им можно было пользоваться дальше. Отмена после
+    отключения клиента - ClientDisconnected.
+    """
+    breaker = db.get_breaker()
+    if not breaker.allow():
+        raise db.CircuitOpen('База тендеров временно недоступна')
+    try:
+        yield
+    except DB_ERRORS as e:
+        watch = g.get('db_watch')
+        if isinstance(e, QueryCanceledError):
+            kind = 'cancelled' if watch is not None and watch.cancelled else 'timeout'
+        elif isinstance(e, db.PoolTimeout):
+            kind = 'pool_timeout'
+        else:
+            kind = 'connection'
+        instrumentation.DB_FAILURES.inc(route_name(), kind)
+        
+        conn = g.get('db_conn')
+        if conn is not None and not conn.closed:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+        
+        if kind in ('timeout', 'cancelled'):
+            breaker.success()
+        else:
+            breaker.failure()
+        if kind == 'cancelled':
+            raise ClientDisconnected() from e
+        raise
+    breaker.success()
+
+_catalog_fallbacks = cache.LocalCache(int(os.getenv('CATALOG_FALLBACK_ENTRIES', 256)))
+
+def _fallback_get(key):
+    entry = _catalog_fallbacks.get(key)
+    return entry if entry is not None and entry['until'] > time.time() else None
+
+def _fallback_put(key, value, ttl):
+    _catalog_fallbacks.set(key, {'value': value, 'created': time.time(), 'until': time.time() + ttl}, ttl)
+
+def load_catalog_page(filters, after=None, before=None, per_page=catalog_query.PER_PAGE, count_mode=None):
+    """
+    Страница каталога для /catalog и /api/lots с запасными путями.
+
+    dict как у fetch_page плюс total, total_is_estimate и stale (время
+    сохраненной копии; None - страница свежая). Не посчиталось общее
+    количество - страница без него (total None), и для этих фильтров оно
+    не считается COUNT_TTL секунд. Не удалась сама страница - последняя
+    удачная копия с теми же параметрами, без нее - исключение из DB_ERRORS.
+    """
+    key = repr((sorted(filters.items()), after, before, per_page))
+    try:
+        with heavy_query():
+            cursor = get_db_connection().cursor(cursor_factory=RealDictCursor)
+            page = catalog_query.fetch_page(cursor, filters, after=after, before=before, per_page=per_page)
+            cursor.close()
+    except DB_ERRORS:
+        fallback = _fallback_get('page:' + key)
+        if fallback is None:
+            instrumentation.DEGRADED_RESPONSES.inc(route_name(), 'unavailable')
+            raise
+        instrumentation.DEGRADED_RESPONSES.inc(route_name(), 'stale')
+        return dict(fallback['value'], stale=datetime.fromtimestamp(fallback['created']))
+    
+    # Общее количество необязательно: без него страница все равно полезна
+    count_key = 'no-count:' + repr(sorted(filters.items()))
+    total, total_is_estimate = None, False
+    if count_mode == 'none':
+        pass
+    elif _fallback_get(count_key):
+        instrumentation.DEGRADED_RESPONSES.inc(route_name(), 'no_count')
+    else:
+        try:
+            with heavy_query():
+                cursor = get_db_connection().cursor(cursor_factory=RealDictCursor)
+                total, total_is_estimate = catalog_query.count_lots(cursor, filters, mode=count_mode)
+                cursor.close()
+        except DB_ERRORS:
+            instrumentation.DEGRADED_RESPONSES.inc(route_name(), 'no_count')
+            _fallback_put(count_key, True, catalog_query.COUNT_TTL)
+    
+    page.update(total=total, total_is_estimate=total_is_estimate)
+    _fallback_put('page:' + key, page, CATALOG_FALLBACK_TTL)
+    return dict(page, stale=None)
+
+# ============================================================================
+# DATABASE - пользователи (users.py: SQLite или PostgreSQL)
+# ============================================================================
+
+@contextmanager
+def request_connection():
+    """Подключение PostgreSQL текущего запроса - пользователи не занимают второе из пула"""
+    yield get_db_connection()
+
+users.set_store(users.create_store(USERS_BACKEND, connection=request_connection))
+
+@app.teardown_appcontext
+def release_users_db(exc):
+    """Не оставлять незавершенную транзакцию в хранилище пользователей"""
+    users.get_store().release()
+
+def in_app_context(func):
+    """
+    Обертка для вычислений кеша: свой app context, а значит и свое
+    подключение из пула - в том числе при обновлении в фоновом потоке.
+    """
+    def run():
+        with app.app_context():
+            return func()
+    return run
 
 # ============================================================================
 # AUTH HELPERS
 # ============================================================================
 
+_user_cache = {}
+_user_cache_lock = threading.Lock()
+
+def _load_user(user_id):
+    """
+    Пользователь из хранилища (через кеш, если USER_CACHE_TTL > 0).
+
+    Пользователи в PostgreSQL читаются под предохранителем базы тендеров.
+    Если база недоступна - последняя прочитанная в этом воркере запись
+    пользователя (даже устаревшая), без нее - исключение из DB_ERRORS.
+    """
+    with _user_cache_lock:
+        hit = _user_cache.get(user_id)
+    if hit and hit[1] > time.monotonic():
+        return hit[0]
+    
+    try:
+        with heavy_query() if USERS_BACKEND == 'postgres' else nullcontext():
+            user = users.get_store().get(user_id)
+    except DB_ERRORS:
+        if hit is None:
+            raise
+        instrumentation.DEGRADED_RESPONSES.inc(route_name(), 'stale_user')
+        return hit[0]
+    
+    with _user_cache_lock:
+        _user_cache[user_id] = (user, time.monotonic() + USER_CACHE_TTL)
+    return user
+
+def invalidate_user(user_id):
+    """Сбросить закешированного пользователя после изменения его записи"""
+    with _user_cache_lock:
+        _user_cache.pop(user_id, None)
+    if g.get('current_user', (None,))[0] == user_id:
+        g.pop('current_user')
+
 def get_current_user():
-    """Получить текущего пользователя из сессии"""
+    """
+    Получить текущего пользователя из сессии.
+
+    Запоминается на время запроса: декораторы, view и context processor
+    делят одно обращение к хранилищу. Хранилище недоступно и пользователя
+    нет в кеше воркера - None (страница как для гостя), ошибка остается в
+    g.users_error.
+    """
     user_id = session.get('user_id')
     if not user_id:
         return None
     
-    conn = sqlite3.connect(USERS_DB)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute('SELECT * FROM users WHERE id = ?', (user_id,))
-    user = c.fetchone()
-    conn.close()
-    
-    return dict(user) if user else None
+    cached = g.get('current_user')
+    if cached is None or cached[0] != user_id:
+        try:
+            user = _load_user(user_id)
+        except DB_ERRORS as e:
+            instrumentation.DEGRADED_RESPONSES.inc(route_name(), 'anonymous')
+            g.users_error = e
+            user = None
+        cached = g.current_user = (user_id, user)
+    return dict(cached[1]) if cached[1] else None
+
+def users_unavailable():
+    """Ответ защищенной страницы, когда пользователя не удалось прочитать"""
+    flash(db_failure_message(g.users_error), 'warning')
+    return redirect(url_for('index'))
 
 def login_required(f):
     @wraps(f)
@@ -99,6 +365,8 @@ def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         user = get_current_user()
+        if g.get('users_error') is not None:
+            return users_unavailable()
         if not user or not user['is_admin']:
             flash('Доступ запрещен. Требуются права администратора.', 'danger')
             return redirect(url_for('index'))
@@ -109,6 +377,8 @@ def access_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         user = get_current_user()
+        if g.get('users_error') is not None:
+            return users_unavailable()
         if not user:
             flash('Пожалуйста, войдите в систему.', 'warning')
             return redirect(url_for('login'))
@@ -119,8 +389,7 @@ def access_required(f):
         
         # Проверка срока доступа
         if user['access_until']:
-            access_until = datetime.fromisoformat(user['access_until'])
-            if access_until < datetime.now():
+            if user['access_until'] < datetime.now():
                 flash('Срок вашего доступа истек. Обратитесь к администратору.', 'warning')
                 return redirect(url_for('index'))
         
@@ -153,22 +422,16 @@ def register():
             flash('Пароли не совпадают', 'danger')
             return redirect(url_for('register'))
         
-        # Проверка существующего пользователя
-        conn = sqlite3.connect(USERS_DB)
-        c = conn.cursor()
-        c.execute('SELECT * FROM users WHERE email = ?', (email,))
-        if c.fetchone():
-            conn.close()
+        # Создание пользователя (None - email уже занят)
+        try:
+            user_id = users.get_store().create(email, generate_password_hash(password))
+        except DB_ERRORS as e:
+            flash(db_failure_message(e), 'warning')
+            return redirect(url_for('register'))
+        if user_id is None:
             flash('Пользователь с таким email уже существует', 'danger')
             return redirect(url_for('register'))
         
-        # Создание пользователя
-        c.execute('''INSERT INTO users (email, password_hash, is_admin, has_access) 
-                     VALUES (?, ?, ?, ?)''',
-                  (email, generate_password_hash(password), 0, 0))
-        conn.commit()
-        conn.close()
-        
         flash('Регистрация успешна! Дождитесь активации администратором.', 'success')
         return redirect(url_for('login'))
     
@@ -181,12 +444,11 @@ def login():
         email = request.form.get('email')
         password = request.form.get('password')
         
-        conn = sqlite3.connect(USERS_DB)
-        conn.row_factory = sqlite3.Row
-        c = conn.cursor()
-        c.execute('SELECT * FROM users WHERE email = ?', (email,))
-        user = c.fetchone()
-        conn.close()
+        try:
+            user = users.get_store().find_by_email(email)
+        except DB_ERRORS as e:
+            flash(db_failure_message(e), 'warning')
+            return render_template('login.html')
         
         if user and check_password_hash(user['password_hash'], password):
             session['user_id'] = user['id']
@@ -221,113 +483,127 @@ def catalog():
         return redirect(url_for('index'))
     
     # Получение параметров фильтрации
-    country_kz = request.args.get('country_kz', '1') == '1'
-    country_ru = request.args.get('country_ru', '1') == '1'
-    country_cn = request.args.get('country_cn', '1') == '1'
+    filters = catalog_query.parse_filters(request.args)
+    after = request.args.get('after')
+    before = request.args.get('before')
+    status, db_error = 200, None
     
-    deposit = request.args.get('deposit', type=float)
-    margin = request.args.get('margin', type=float)
+    try:
+        try:
+            page = load_catalog_page(filters, after=after, before=before)
+        except catalog_query.InvalidCursor:
+            # Устаревшая или испорченная ссылка - показываем начало
+            page = load_catalog_page(filters)
+    except DB_ERRORS as e:
+        # Ни страницы, ни сохраненной копии - фильтры остаются, результатов нет
+        page = {'lots': [], 'next_cursor': None, 'prev_cursor': None,
+                'total': None, 'total_is_estimate': False, 'stale': None}
+        db_error = db_failure_message(e)
+        status = 503
     
-    search = request.args.get('search', '').strip()
-    page = request.args.get('page', 1, type=int)
-    per_page = 20
+    return render_template('catalog.html',
+        lots=page['lots'],
+        next_cursor=page['next_cursor'],
+        prev_cursor=page['prev_cursor'],
+        total_count=page['total'],
+        total_is_estimate=page['total_is_estimate'],
+        stale=page['stale'],
+        db_error=db_error,
+        current_user=get_current_user(),
+        **filters
+    ), status
+
+@app.route('/catalog/export')
+@access_required
+def catalog_export():
+    """Выгрузка всех лотов под фильтрами каталога (CSV / JSONL / XLSX)"""
+    if not DATABASE_URL:
+        flash('База данных тендеров не настроена', 'danger')
+        return redirect(url_for('index'))
     
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # Базовый запрос - показываем все лоты
-        where_clauses = []
-        params = []
-        
-        # Фильтр по поиску
-        if search:
-            where_clauses.append("(l.original_name ILIKE %s OR l.simplified_name ILIKE %s)")
-            params.extend([f'%{search}%', f'%{search}%'])
-        
-        where_sql = " AND ".join(where_clauses) if where_clauses else "1=1"
-        
-        # Подсчет общего количества
-        cursor.execute(f"SELECT COUNT(*) as total FROM lots l WHERE {where_sql}", params)
-        total_count = cursor.fetchone()['total']
-        
-        # Получение лотов с пагинацией
-        offset = (page - 1) * per_page
-        cursor.execute(f"""
-            SELECT l.*, 
-                   COUNT(DISTINCT sr.id) as products_count,
-                   MIN(CASE 
-                       WHEN sr.product_price ~ '^[0-9]+\.?[0-9]*$' 
-                       THEN CAST(sr.product_price AS DECIMAL)
-                       ELSE NULL 
-                   END) as min_price
-            FROM lots l
-            LEFT JOIN search_results sr ON l.lot_number = sr.lot_number
-            WHERE {where_sql}
-            GROUP BY l.id
-            ORDER BY l.created_at DESC
-            LIMIT %s OFFSET %s
-        """, params + [per_page, offset])
-        
-        lots = cursor.fetchall()
-        
-        # Фильтрация по странам в Python (после получения данных)
-        if not (country_kz and country_ru and country_cn):
-            filtered_lots = []
-            for lot in lots:
-                # Получаем товары этого лота
-                cursor.execute("""
-                    SELECT marketplace FROM search_results 
-                    WHERE lot_number = %s
-                """, [lot['lot_number']])
-                products = cursor.fetchall()
-                
-                has_matching_country = False
-                for product in products:
-                    marketplace = product['marketplace'].lower() if product['marketplace'] else ''
-                    
-                    # Проверяем соответствие выбранным странам
-                    is_cn = any(x in marketplace for x in ['1688', 'taobao', 'temu', 'aliexpress', 'pinduoduo'])
-                    is_kz = any(x in marketplace for x in ['kaspi', 'satu', 'ozon.kz', 'otevertka'])
-                    is_ru = any(x in marketplace for x in ['wildberries', 'wb.ru', 'chipdip']) or ('ozon' in marketplace and 'ozon.kz' not in marketplace)
-                    
-                    if (country_cn and is_cn) or (country_kz and is_kz) or (country_ru and is_ru):
-                        has_matching_country = True
-                        break
-                
-                if has_matching_country:
-                    filtered_lots.append(lot)
-            
-            lots = filtered_lots
-            total_count = len(lots)
-            total_pages = (total_count + per_page - 1) // per_page
-            
-            # Применяем пагинацию к отфильтрованным результатам
-            start = (page - 1) * per_page
-            end = start + per_page
-            lots = lots[start:end]
-        else:
-            total_pages = (total_count + per_page - 1) // per_page
-        
+    fmt = request.args.get('format', 'csv')
+    if fmt not in export.FORMATS:
+        flash('Неизвестный формат выгрузки', 'danger')
+        return redirect(url_for('catalog'))
+    if fmt == 'xlsx' and not export.xlsx_available():
+        flash('Выгрузка в XLSX недоступна: не установлен пакет xlsxwriter', 'danger')
+        return redirect(url_for('catalog'))
+    
+    filters = catalog_query.parse_filters(request.args)
+    content_type, extension = export.FORMATS[fmt]
+    filename = f'lots-{datetime.now():%Y%m%d-%H%M}.{extension}'
+    
+    return Response(export.stream(db.get_pool(), filters, fmt), content_type=content_type, headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        # Не копить ответ в nginx - отдавать клиенту по мере чтения
+        'X-Accel-Buffering': 'no',
+    })
+
+@heavy_query()
+def load_lot(lot_number):
+    """Лот и его товары по странам для страницы лота (None, если лота нет)"""
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    
+    # Получение информации о лоте
+    cursor.execute("SELECT * FROM lots WHERE lot_number = %s", [lot_number])
+    lot = cursor.fetchone()
+    
+    if not lot:
         cursor.close()
-        conn.close()
-        
-        return render_template('catalog.html',
-            lots=lots,
-            total_count=total_count,
-            page=page,
-            total_pages=total_pages,
-            country_kz=country_kz,
-            country_ru=country_ru,
-            country_cn=country_cn,
-            deposit=deposit,
-            margin=margin,
-            search=search,
-            current_user=get_current_user()
-        )
-    except Exception as e:
-        flash(f'Ошибка загрузки каталога: {str(e)}', 'danger')
-        return redirect(url_for('index'))
+        return None
+    
+    # Получение товаров
+    cursor.execute("""
+        SELECT * FROM search_results 
+        WHERE lot_number = %s 
+        ORDER BY marketplace, price NULLS LAST, product_price
+    """, [lot_number])
+    products = [dict(product) for product in cursor.fetchall()]
+    
+    # Версия данных - время последнего пересчета агрегатов лота
+    cursor.execute("SELECT refreshed_at FROM lot_summaries WHERE lot_number = %s", [lot_number])
+    summary = cursor.fetchone()
+    
+    # Аналитика цен (analytics.py); None, пока задание не посчитало лот
+    cursor.execute("SELECT * FROM lot_analytics WHERE lot_number = %s", [lot_number])
+    analytics = cursor.fetchone()
+    
+    cursor.close()
+    
+    # Группировка товаров по странам (неизвестные маркетплейсы - отдельно)
+    products_by_country = marketplaces.group_by_country(products)
+    
+    return {
+        'lot': dict(lot),
+        'products_by_country': products_by_country,
+        'total_products': len(products),
+        'analytics': dict(analytics) if analytics else None,
+        'version': summary['refreshed_at'] if summary else None
+    }
+
+def lot_cache_key(lot_number):
+    return f'lot:{lot_number}'
+
+def invalidate_lot(lot_number):
+    """Сбросить кеш страницы лота (после перезаписи его товаров)"""
+    cache.get_cache().invalidate(lot_cache_key(lot_number))
+
+def on_lot_changed(payload):
+    """NOTIFY lot_changed: номера лотов через запятую или '*'"""
+    if payload == '*':
+        cache.get_cache().invalidate_prefix('lot:')
+        return
+    for lot_number in payload.split(','):
+        invalidate_lot(lot_number)
+
+def listen_lot_changes():
+    """
+    Изменения лотов приходят через NOTIFY (migrations/007); уведомления,
+    пропущенные за время разрыва, закрываются полным сбросом
+    """
+    db.listen('lot_changed', on_lot_changed,
+              on_reconnect=lambda: cache.get_cache().invalidate_prefix('lot:'))
 
 @app.route('/lot/<lot_number>')
 @access_required
@@ -337,62 +613,37 @@ def lot_detail(lot_number):
         flash('База данных тендеров не настроена', 'danger')
         return redirect(url_for('index'))
     
+    listen_lot_changes()
+    
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # Получение информации о лоте
-        cursor.execute("SELECT * FROM lots WHERE lot_number = %s", [lot_number])
-        lot = cursor.fetchone()
+        entry = cache.get_cache().get_entry(lot_cache_key(lot_number),
+            in_app_context(lambda: load_lot(lot_number)), ttl=LOT_CACHE_TTL)
+        data = entry['value']
         
-        if not lot:
-            cursor.close()
-            conn.close()
+        if not data:
+            invalidate_lot(lot_number)
             flash('Лот не найден', 'danger')
             return redirect(url_for('catalog'))
         
-        # Получение товаров
-        cursor.execute("""
-            SELECT * FROM search_results 
-            WHERE lot_number = %s 
-            ORDER BY marketplace, product_price
-        """, [lot_number])
-        products = cursor.fetchall()
-        
-        cursor.close()
-        conn.close()
-        
-        # Группировка товаров по странам
-        products_by_country = {
-            'KZ': [],
-            'RU': [],
-            'CN': []
-        }
-        
-        for product in products:
-            marketplace = product.get('marketplace', '').lower()
-            
-            # Китай: 1688, TaoBao, Temu, AliExpress, Pinduoduo
-            if any(x in marketplace for x in ['1688', 'taobao', 'temu', 'aliexpress', 'pinduoduo']):
-                products_by_country['CN'].append(product)
-            # Казахстан: Satu.kz, Kaspi.kz, Ozon.kz
-            elif any(x in marketplace for x in ['kaspi', 'satu', 'ozon.kz', 'otevertka']):
-                products_by_country['KZ'].append(product)
-            # Россия: Wildberries, Ozon, Chipdip
-            elif any(x in marketplace for x in ['wildberries', 'ozon.ru', 'ozon', 'chipdip', 'wb.ru']):
-                products_by_country['RU'].append(product)
-            else:
-                # По умолчанию - Россия
-                products_by_country['RU'].append(product)
-        
-        return render_template('lot_detail.html',
-            lot=lot,
-            products_by_country=products_by_country,
-            total_products=len(products),
-            current_user=get_current_user()
-        )
-    except Exception as e:
-        flash(f'Ошибка загрузки лота: {str(e)}', 'danger')
+        # Страница зависит от данных лота и от пользователя (шапка)
+        etag = f"{entry['etag']}-{session.get('user_id')}"
+        if '_flashes' not in session and request.if_none_match.contains_weak(etag):
+            response = make_response('', 304)
+        else:
+            response = make_response(render_template('lot_detail.html',
+                lot=data['lot'],
+                products_by_country=data['products_by_country'],
+                total_products=data['total_products'],
+                analytics=data['analytics'],
+                current_user=get_current_user()
+            ))
+        response.set_etag(etag, weak=True)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+    except DB_ERRORS as e:
+        # Устаревшую копию страницы отдал бы кеш (stale-while-revalidate)
+        flash(db_failure_message(e), 'warning')
         return redirect(url_for('catalog'))
 
 # ============================================================================
@@ -404,13 +655,11 @@ def lot_detail(lot_number):
 def admin_dashboard():
     """Панель администратора"""
     # Статистика пользователей
-    conn = sqlite3.connect(USERS_DB)
-    c = conn.cursor()
-    c.execute("SELECT COUNT(*) as total FROM users WHERE is_admin = 0")
-    users_count = c.fetchone()[0]
-    c.execute("SELECT COUNT(*) as total FROM users WHERE has_access = 1 AND is_admin = 0")
-    active_users = c.fetchone()[0]
-    conn.close()
+    try:
+        users_count, active_users = users.get_store().count_users()
+    except DB_ERRORS as e:
+        flash(db_failure_message(e), 'warning')
+        users_count = active_users = '—'
     
     # Статистика тендеров
     lots_count = 0
@@ -418,14 +667,10 @@ def admin_dashboard():
     
     if DATABASE_URL:
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM lots")
-            lots_count = cursor.fetchone()[0]
-            cursor.execute("SELECT COUNT(*) FROM search_results")
-            products_count = cursor.fetchone()[0]
-            cursor.close()
-            conn.close()
+            stats = cache.get_cache().get_or_compute('stats:tenders',
+                in_app_context(get_tender_stats), ttl=STATS_CACHE_TTL)
+            lots_count = stats['lots']
+            products_count = stats['products']
         except:
             pass
     
@@ -441,20 +686,13 @@ def admin_dashboard():
 @admin_required
 def admin_users():
     """Управление пользователями"""
-    conn = sqlite3.connect(USERS_DB)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("""
-        SELECT id, email, has_access, access_until, created_at
-        FROM users 
-        WHERE is_admin = 0
-        ORDER BY created_at DESC
-    """)
-    users = [dict(row) for row in c.fetchall()]
-    conn.close()
-    
+    try:
+        user_list = users.get_store().list_users()
+    except DB_ERRORS as e:
+        flash(db_failure_message(e), 'warning')
+        user_list = []
     return render_template('admin/users.html', 
-        users=users, 
+        users=user_list, 
         now=datetime.now(),
         current_user=get_current_user()
     )
@@ -465,23 +703,20 @@ def admin_toggle_access(user_id):
     """Включить/выключить доступ пользователя"""
     days = request.form.get('days', type=int)
     
-    conn = sqlite3.connect(USERS_DB)
-    c = conn.cursor()
-    
-    if days and days > 0:
-        # Открыть доступ на N дней
-        access_until = (datetime.now() + timedelta(days=days)).isoformat()
-        c.execute("UPDATE users SET has_access = 1, access_until = ? WHERE id = ?",
-                  (access_until, user_id))
-        flash(f'Доступ открыт на {days} дней', 'success')
-    else:
-        # Закрыть доступ
-        c.execute("UPDATE users SET has_access = 0, access_until = NULL WHERE id = ?",
-                  (user_id,))
-        flash('Доступ закрыт', 'success')
+    try:
+        if days and days > 0:
+            # Открыть доступ на N дней
+            users.get_store().grant_access(user_id, datetime.now() + timedelta(days=days))
+            flash(f'Доступ открыт на {days} дней', 'success')
+        else:
+            # Закрыть доступ
+            users.get_store().revoke_access(user_id)
+            flash('Доступ закрыт', 'success')
+    except DB_ERRORS as e:
+        flash(db_failure_message(e), 'warning')
+        return redirect(url_for('admin_users'))
     
-    conn.commit()
-    conn.close()
+    invalidate_user(user_id)
     
     return redirect(url_for('admin_users'))
 
@@ -489,41 +724,209 @@ def admin_toggle_access(user_id):
 # API ENDPOINTS
 # ============================================================================
 
+@heavy_query()
+def get_tender_stats():
+    """Количество лотов и товаров по маркетплейсам (полные COUNT - только через кеш)"""
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    
+    cursor.execute("SELECT COUNT(*) as total FROM lots")
+    lots_count = cursor.fetchone()['total']
+    
+    cursor.execute("SELECT COUNT(*) as total FROM search_results")
+    products_count = cursor.fetchone()['total']
+    
+    cursor.execute("""
+        SELECT marketplace, COUNT(*) as count 
+        FROM search_results 
+        GROUP BY marketplace
+    """)
+    by_marketplace = {row['marketplace']: row['count'] for row in cursor.fetchall()}
+    
+    cursor.close()
+    
+    return {
+        'lots': lots_count,
+        'products': products_count,
+        'by_marketplace': by_marketplace
+    }
+
 @app.route('/api/stats')
 def api_stats():
     """API для получения статистики"""
-    lots_count = 0
-    products_count = 0
-    by_marketplace = {}
-    
     if DATABASE_URL:
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            
-            cursor.execute("SELECT COUNT(*) as total FROM lots")
-            lots_count = cursor.fetchone()['total']
-            
-            cursor.execute("SELECT COUNT(*) as total FROM search_results")
-            products_count = cursor.fetchone()['total']
-            
-            cursor.execute("""
-                SELECT marketplace, COUNT(*) as count 
-                FROM search_results 
-                GROUP BY marketplace
-            """)
-            by_marketplace = {row['marketplace']: row['count'] for row in cursor.fetchall()}
-            
-            cursor.close()
-            conn.close()
+            entry = cache.get_cache().get_entry('stats:tenders',
+                in_app_context(get_tender_stats), ttl=STATS_CACHE_TTL)
+            return cache.conditional(jsonify(entry['value']), entry, public=True)
         except:
             pass
     
     return jsonify({
-        'lots': lots_count,
-        'products': products_count,
-        'by_marketplace': by_marketplace
+        'lots': 0,
+        'products': 0,
+        'by_marketplace': {}
+    })
+
+def _jsonable(row):
+    """Строка БД -> dict для jsonify (Decimal и даты в JSON-типы)"""
+    result = {}
+    for key, value in row.items():
+        if isinstance(value, Decimal):
+            value = float(value)
+        elif isinstance(value, (datetime, date)):
+            value = value.isoformat()
+        result[key] = value
+    return result
+
+@app.route('/api/lots')
+@access_required
+def api_lots():
+    """
+    Лоты каталога в JSON - те же фильтры и строки, что и /catalog.
+
+    Пагинация курсорами: next_cursor передается в ?after=, prev_cursor в ?before=.
+    ?count=exact|cached|estimate|none управляет подсчетом total. Если база не
+    успела ответить - сохраненная копия (stale) или 503.
+    """
+    if not DATABASE_URL:
+        return jsonify({'error': 'База данных тендеров не настроена'}), 503
+    
+    filters = catalog_query.parse_filters(request.args)
+    per_page = min(max(request.args.get('per_page', catalog_query.PER_PAGE, type=int), 1),
+                   catalog_query.MAX_PER_PAGE)
+    count_mode = request.args.get('count')
+    if count_mode not in (None, 'exact', 'cached', 'estimate', 'none'):
+        return jsonify({'error': f'Неизвестный режим count: {count_mode}'}), 400
+    
+    try:
+        page = load_catalog_page(filters,
+            after=request.args.get('after'),
+            before=request.args.get('before'),
+            per_page=per_page,
+            count_mode=count_mode
+        )
+    except catalog_query.InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    except DB_ERRORS as e:
+        response = jsonify({'error': db_failure_message(e)})
+        response.headers['Retry-After'] = str(int(db.get_breaker().cooldown))
+        return response, 503
+    
+    return jsonify({
+        'lots': [_jsonable(lot) for lot in page['lots']],
+        'next_cursor': page['next_cursor'],
+        'prev_cursor': page['prev_cursor'],
+        'total': page['total'],
+        'total_is_estimate': page['total_is_estimate'],
+        # Сохраненная копия: время, когда она была свежей
+        'stale': page['stale'].isoformat() if page['stale'] else None
+    })
+
+# Поля товара в превью карточки каталога
+PREVIEW_FIELDS = ['marketplace', 'product_title', 'product_price', 'product_url', 'price', 'currency']
+
+@app.route('/api/lots/<lot_number>/preview')
+@access_required
+def api_lot_preview(lot_number):
+    """
+    Самые дешевые товары лота по странам для карточки каталога.
+
+    Берутся из кеша страницы лота (тот же сброс по NOTIFY и тот же ETag),
+    limit - товаров на страну (до 10).
+    """
+    if not DATABASE_URL:
+        return jsonify({'error': 'База данных тендеров не настроена'}), 503
+    limit = min(max(request.args.get('limit', 3, type=int), 1), 10)
+    
+    listen_lot_changes()
+    try:
+        entry = cache.get_cache().get_entry(lot_cache_key(lot_number),
+            in_app_context(lambda: load_lot(lot_number)), ttl=LOT_CACHE_TTL)
+    except DB_ERRORS as e:
+        return jsonify({'error': db_failure_message(e)}), 503
+    data = entry['value']
+    if not data:
+        invalidate_lot(lot_number)
+        return jsonify({'error': 'Лот не найден'}), 404
+    
+    preview = {}
+    for country, products in data['products_by_country'].items():
+        cheapest = sorted(products, key=lambda p: (p['price'] is None, p['price'] or 0))[:limit]
+        preview[country] = {
+            'count': len(products),
+            'products': [_jsonable({key: p.get(key) for key in PREVIEW_FIELDS}) for p in cheapest],
+        }
+    
+    response = jsonify({
+        'lot_number': lot_number,
+        'total_products': data['total_products'],
+        'countries': preview
     })
+    response.set_etag(f"{entry['etag']}-{limit}", weak=True)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@app.route('/api/import/<kind>', methods=['POST'])
+@admin_required
+def api_import(kind):
+    """
+    Загрузка лотов (kind=lots) или товаров (kind=results) из CSV / JSONL.
+
+    Файл - в поле file формы или телом запроса; формат - по расширению
+    или параметру format. Нужен заголовок X-Requested-With: его не
+    отправит форма с чужого сайта, а запрос с ним оттуда не пропустит CORS.
+    """
+    if not request.headers.get('X-Requested-With'):
+        return jsonify({'error': 'Нужен заголовок X-Requested-With'}), 403
+    if not DATABASE_URL:
+        return jsonify({'error': 'База данных тендеров не настроена'}), 503
+    if kind not in ingest.KINDS:
+        return jsonify({'error': f'Неизвестный вид данных: {kind}'}), 404
+    
+    upload = request.files.get('file')
+    stream = upload.stream if upload else request.stream
+    fmt = request.args.get('format') or ingest.detect_format(upload.filename if upload else '')
+    batch_size = min(request.args.get('batch_size', 10000, type=int), 100000)
+    
+    try:
+        with heavy_query(), db.get_pool().connection() as conn:
+            stats = ingest.ingest(conn, kind, ingest.read_records(stream, fmt), batch_size)
+    except ingest.IngestError as e:
+        return jsonify({'error': str(e)}), 400
+    except DB_ERRORS as e:
+        response = jsonify({'error': db_failure_message(e)})
+        response.headers['Retry-After'] = str(int(db.get_breaker().cooldown))
+        return response, 503
+    
+    # Страницы лотов сбрасывают триггеры (NOTIFY lot_changed), статистику - здесь
+    cache.get_cache().invalidate('stats:tenders')
+    return jsonify(stats)
+
+@app.route('/api/pool')
+@admin_required
+def api_pool():
+    """Метрики пула подключений PostgreSQL (для подбора DB_POOL_MIN/MAX)"""
+    pool = db.get_pool()
+    if pool is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(pool.stats(), enabled=True, breaker=db.get_breaker().stats()))
+
+@app.route('/api/cache')
+@admin_required
+def api_cache():
+    """Метрики кеша по ключам"""
+    return jsonify(cache.get_cache().stats())
+
+@app.route('/api/profile')
+@admin_required
+def api_profile():
+    """Последние профили запросов воркера: фазы и SQL (PROFILING=1)"""
+    if not instrumentation.ENABLED:
+        return jsonify({'enabled': False})
+    limit = min(request.args.get('limit', 20, type=int), instrumentation.PROFILE_KEEP)
+    return jsonify({'enabled': True, 'profiles': instrumentation.recent_profiles(limit)})
 
 # ============================================================================
 # TEMPLATE CONTEXT
@@ -0,0 +1,10 @@
+"""
+TenderFinder Commercial - Бенчмарки
+
+Скрипты запускаются как модули из корня проекта, например:
+
+    DATABASE_URL=postgresql://localhost/bench python -m benchmarks.country_filter
+
+Все данные создаются в отдельной схеме (по умолчанию bench) и не трогают
+рабочие таблицы public.
+"""
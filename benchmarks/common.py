@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""Общие помощники бенчмарков"""
+
+import http.client
+import os
+import statistics
+import time
+import urllib.parse
+
+from migrate import split_sql
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MIGRATIONS_DIR = os.path.join(ROOT, 'migrations')
+
+
+def run_sql_file(conn, path):
+    """Выполнить SQL-файл по одной команде (для CREATE INDEX CONCURRENTLY)"""
+    with open(path, encoding='utf-8') as f:
+        statements = split_sql(f.read())
+    cursor = conn.cursor()
+    for statement in statements:
+        cursor.execute(statement)
+    cursor.close()
+
+
+def migration(name):
+    """Путь к файлу миграции по имени"""
+    return os.path.join(MIGRATIONS_DIR, name)
+
+
+def measure(fn, *args, repeat=5):
+    """Медиана времени вызова в мс и результат последнего вызова"""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn(*args)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), result
+
+
+def percentile(values, p):
+    """Перцентиль p (0-100) отсортированного списка"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+# ============================================================================
+# HTTP
+# ============================================================================
+
+def http_request(host, port, method, path, cookie=None, body=None, timeout=30):
+    """(статус, заголовки, тело) одного запроса по новому подключению"""
+    conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    headers = {'Cookie': cookie} if cookie else {}
+    if body is not None:
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        body = urllib.parse.urlencode(body)
+    try:
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        return response.status, response.getheaders(), response.read()
+    finally:
+        conn.close()
+
+
+def login(host, port, email, password):
+    """Cookie сессии пользователя"""
+    status, headers, _ = http_request(host, port, 'POST', '/login',
+                                      body={'email': email, 'password': password})
+    cookies = [value.split(';', 1)[0] for name, value in headers if name.lower() == 'set-cookie']
+    if status != 302 or not cookies:
+        raise RuntimeError('не удалось войти: проверьте --email/--password')
+    return '; '.join(cookies)
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк фильтра по странам в /catalog: старый путь (N+1 запросов и
+классификация в Python по уже выбранной странице) против нового
+(EXISTS по search_results.country в одном запросе с COUNT и LIMIT/OFFSET).
+
+    DATABASE_URL=postgresql://localhost/bench \\
+        python -m benchmarks.country_filter --lots 100000 --products 5000000
+"""
+
+import argparse
+import os
+import time
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from benchmarks.common import measure, migration, run_sql_file
+
+# Маркетплейсы и их доли: китайских мало, поэтому фильтр "только Китай"
+# отсекает заметную часть лотов
+MARKETPLACES = [
+    ('kaspi.kz', 30), ('satu.kz', 10), ('ozon.kz', 5), ('otevertka.kz', 2),
+    ('wildberries.ru', 25), ('ozon.ru', 15), ('chipdip.ru', 5),
+    ('aliexpress', 4), ('1688', 2), ('taobao', 1), ('pinduoduo', 0.5), ('temu', 0.5),
+]
+
+PER_PAGE = 20
+
+
+def generate(conn, schema, lots, products):
+    """Сгенерировать синтетические lots/search_results в схеме schema"""
+    weights = []
+    for name, share in MARKETPLACES:
+        weights.extend([name] * int(share * 2))
+
+    cursor = conn.cursor()
+    cursor.execute(f'DROP SCHEMA IF EXISTS {schema} CASCADE')
+    cursor.execute(f'CREATE SCHEMA {schema}')
+    cursor.execute(f'SET search_path = {schema}, public')
+    cursor.execute("""
+        CREATE TABLE lots (
+            id SERIAL PRIMARY KEY,
+            lot_number TEXT UNIQUE NOT NULL,
+            original_name TEXT,
+            simplified_name TEXT,
+            tender_price NUMERIC(14, 2),
+            quantity INTEGER,
+            unit TEXT,
+            customer TEXT,
+            category TEXT,
+            created_at TIMESTAMP DEFAULT now()
+        )
+    """)
+    cursor.execute("""
+        INSERT INTO lots (lot_number, original_name, simplified_name,
+                          tender_price, quantity, unit, created_at)
+        SELECT 'LOT-' || g, 'Товар номер ' || g, 'товар ' || (g % 1000),
+               round((random() * 1000000)::numeric, 2), 1 + (random() * 100)::int,
+               'шт', now() - g * interval '1 minute'
+        FROM generate_series(1, %s) g
+    """, [lots])
+    cursor.execute('CREATE INDEX ON lots (created_at DESC)')
+
+    cursor.execute("""
+        CREATE TABLE search_results (
+            id SERIAL PRIMARY KEY,
+            lot_number TEXT NOT NULL,
+            marketplace TEXT,
+            product_title TEXT,
+            product_price TEXT,
+            product_url TEXT
+        )
+    """)
+    cursor.execute("""
+        INSERT INTO search_results (lot_number, marketplace, product_title,
+                                    product_price, product_url)
+        SELECT 'LOT-' || (1 + floor(random() * %s)::int),
+               (%s::text[])[1 + floor(random() * %s)::int],
+               'Товар ' || g,
+               round((random() * 100000)::numeric, 2)::text,
+               'https://example.com/p/' || g
+        FROM generate_series(1, %s) g
+    """, [lots, weights, len(weights), products])
+    cursor.execute('CREATE INDEX ON search_results (lot_number)')
+    cursor.close()
+
+    run_sql_file(conn, migration('001_search_results_country.sql'))
+    cursor = conn.cursor()
+    cursor.execute('ANALYZE lots')
+    cursor.execute('ANALYZE search_results')
+    cursor.close()
+
+
+PAGE_SQL = """
+    SELECT l.*,
+           COUNT(DISTINCT sr.id) as products_count,
+           MIN(CASE
+               WHEN sr.product_price ~ '^[0-9]+\\.?[0-9]*$'
+               THEN CAST(sr.product_price AS DECIMAL)
+               ELSE NULL
+           END) as min_price
+    FROM lots l
+    LEFT JOIN search_results sr ON l.lot_number = sr.lot_number
+    WHERE {where}
+    GROUP BY l.id
+    ORDER BY l.created_at DESC
+    LIMIT %s OFFSET %s
+"""
+
+
+def old_path(cursor, countries, page):
+    """Как было: COUNT без фильтра, страница, затем запрос на каждый лот"""
+    cursor.execute('SELECT COUNT(*) as total FROM lots l WHERE 1=1')
+    cursor.fetchone()
+    cursor.execute(PAGE_SQL.format(where='1=1'), [PER_PAGE, (page - 1) * PER_PAGE])
+    lots = cursor.fetchall()
+
+    matched = []
+    for lot in lots:
+        cursor.execute('SELECT marketplace FROM search_results WHERE lot_number = %s',
+                       [lot['lot_number']])
+        for product in cursor.fetchall():
+            marketplace = (product['marketplace'] or '').lower()
+            is_cn = any(x in marketplace for x in ['1688', 'taobao', 'temu', 'aliexpress', 'pinduoduo'])
+            is_kz = any(x in marketplace for x in ['kaspi', 'satu', 'ozon.kz', 'otevertka'])
+            is_ru = (any(x in marketplace for x in ['wildberries', 'wb.ru', 'chipdip'])
+                     or ('ozon' in marketplace and 'ozon.kz' not in marketplace))
+            if ('CN' in countries and is_cn) or ('KZ' in countries and is_kz) \
+                    or ('RU' in countries and is_ru):
+                matched.append(lot)
+                break
+    return len(matched)
+
+
+def new_path(cursor, countries, page):
+    """Как стало: фильтр, COUNT и пагинация в SQL"""
+    where = """EXISTS (
+        SELECT 1 FROM search_results sc
+        WHERE sc.lot_number = l.lot_number AND sc.country = ANY(%s)
+    )"""
+    cursor.execute(f'SELECT COUNT(*) as total FROM lots l WHERE {where}', [countries])
+    total = cursor.fetchone()['total']
+    cursor.execute(PAGE_SQL.format(where=where), [countries, PER_PAGE, (page - 1) * PER_PAGE])
+    cursor.fetchall()
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dsn', default=os.getenv('DATABASE_URL'))
+    parser.add_argument('--schema', default='bench')
+    parser.add_argument('--lots', type=int, default=100000)
+    parser.add_argument('--products', type=int, default=5000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--skip-generate', action='store_true',
+                        help='использовать уже сгенерированную схему')
+    args = parser.parse_args()
+
+    if not args.dsn:
+        parser.error('укажите --dsn или DATABASE_URL')
+
+    conn = psycopg2.connect(args.dsn)
+    conn.autocommit = True
+
+    if not args.skip_generate:
+        started = time.perf_counter()
+        generate(conn, args.schema, args.lots, args.products)
+        print(f'Данные: {args.lots} лотов, {args.products} товаров '
+              f'за {time.perf_counter() - started:.1f} с')
+
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    cursor.execute(f'SET search_path = {args.schema}, public')
+
+    print(f'{"фильтр":<10}{"стр.":>6}{"старый, мс":>14}{"новый, мс":>14}'
+          f'{"старый total*":>16}{"новый total":>14}')
+    for countries in (['CN'], ['KZ'], ['RU', 'CN']):
+        for page in (1, 10, 100):
+            old_ms, old_total = measure(old_path, cursor, countries, page, repeat=args.repeat)
+            new_ms, new_total = measure(new_path, cursor, countries, page, repeat=args.repeat)
+            print(f'{",".join(countries):<10}{page:>6}{old_ms:>14.1f}{new_ms:>14.1f}'
+                  f'{old_total:>16}{new_total:>14}')
+    print('* старый путь считал total только по лотам текущей страницы')
+
+    cursor.close()
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
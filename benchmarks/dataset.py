@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Синтетический набор данных для бенчмарков и нагрузочных тестов: lots и
+search_results с перекосами как в жизни. Схема - только из migrations/
+(с 000), большая часть миграций применяется поверх данных.
+
+    DATABASE_URL=postgresql://localhost/bench \\
+        python -m benchmarks.dataset --products 1000000 --schema bench_data
+
+- товары распределены по лотам неравномерно (у части лотов товаров нет);
+- маркетплейсы - с весами, казахстанских и российских больше всего;
+- цены логнормальные вокруг цены единицы лота, в Китае заметно дешевле;
+- цены товаров - текстом в формате магазинов и уже разобранные (как после
+  prices.py), агрегаты lot_summaries и аналитика lot_analytics пересчитаны.
+
+Генерация воспроизводима (--seed). В конце печатается DATABASE_URL, с
+которым приложение увидит схему.
+"""
+
+import argparse
+import os
+import time
+
+import psycopg2
+
+import analytics
+import migrate
+import summaries
+from benchmarks.search import ATTRIBUTES, WORDS
+from marketplaces import classify
+
+# Маркетплейсы и их доли (в процентах); неизвестные площадки - без страны
+MARKETPLACES = [
+    ('kaspi.kz', 28), ('satu.kz', 9), ('ozon.kz', 5), ('otevertka.kz', 2),
+    ('wildberries.ru', 22), ('ozon.ru', 14), ('chipdip.ru', 5),
+    ('aliexpress', 5), ('1688', 3), ('taobao', 2), ('pinduoduo', 1), ('temu', 1),
+    ('shop.example.kz', 3),
+]
+
+# Цена товара относительно цены единицы лота и валюта текста цены
+COUNTRY_PRICES = {'KZ': (1.0, 'KZT'), 'RU': (0.9, 'RUB'), 'CN': (0.35, 'CNY'), None: (1.1, 'KZT')}
+
+CATEGORIES = ['Компьютерная техника', 'Канцелярия', 'Медицина', 'Мебель', 'Хозтовары',
+              'Электротехника', 'Стройматериалы', 'Спецодежда']
+UNITS = ['шт', 'шт', 'шт', 'упак', 'компл', 'м', 'кг', 'л']
+
+# Нормальное распределение из двух random() (Бокс - Мюллер)
+NORMAL = "sqrt(-2 * ln(1 - random())) * cos(2 * pi() * random())"
+
+CHUNK = 1000000
+
+
+# Миграции до загрузки лотов (исходные таблицы) и до загрузки товаров
+# (колонки разобранной цены). Остальные применяются поверх данных, как на
+# рабочей базе
+LOTS_SCHEMA = 0
+PRODUCTS_SCHEMA = 5
+
+
+def generate(conn, schema, lots, products, seed=1, progress=print):
+    """Сгенерировать данные в схеме schema, применяя миграции (migrate.py) по ходу"""
+    names, factors, currencies = [], [], []
+    for name, share in MARKETPLACES:
+        factor, currency = COUNTRY_PRICES[classify(name)]
+        for _ in range(share):
+            names.append(name)
+            factors.append(factor)
+            currencies.append(currency)
+
+    cursor = conn.cursor()
+    cursor.execute(f'DROP SCHEMA IF EXISTS {schema} CASCADE')
+    cursor.execute(f'CREATE SCHEMA {schema}')
+    cursor.execute(f'SET search_path = {schema}, public')
+    migrate.migrate(conn, target=LOTS_SCHEMA, progress=progress)
+
+    started = time.monotonic()
+    cursor.execute('SELECT setseed(%s)', [1 / (abs(seed) + 1)])
+    # Цена единицы - логнормальная с медианой 5000, количество - с перекосом к малым
+    cursor.execute(f"""
+        INSERT INTO lots (lot_number, original_name, simplified_name, customer, category,
+                          tender_price, quantity, unit, created_at)
+        SELECT 'LOT-' || lpad(g::text, 9, '0'),
+               initcap(w1) || ' ' || a1 || ' ' || a2 || ' для нужд учреждения №' || (g % 500),
+               w1 || ' ' || a1,
+               'Заказчик №' || (1 + floor(power(random(), 3) * 2000)::int),
+               (%(categories)s::text[])[1 + floor(random() * %(ncategories)s)::int],
+               round((unit_price * quantity * (0.8 + random() * 1.7))::numeric, 2),
+               quantity,
+               (%(units)s::text[])[1 + floor(random() * %(nunits)s)::int],
+               now() - random() * interval '365 days'
+        FROM (
+            SELECT g,
+                   (%(words)s::text[])[1 + floor(random() * %(nwords)s)::int] as w1,
+                   (%(attrs)s::text[])[1 + floor(random() * %(nattrs)s)::int] as a1,
+                   (%(attrs)s::text[])[1 + floor(random() * %(nattrs)s)::int] as a2,
+                   exp(ln(5000) + 1.2 * {NORMAL}) as unit_price,
+                   1 + floor(power(random(), 4) * 500)::int as quantity
+            FROM generate_series(1, %(lots)s) g
+        ) s
+    """, {'categories': CATEGORIES, 'ncategories': len(CATEGORIES), 'units': UNITS,
+          'nunits': len(UNITS), 'words': WORDS, 'nwords': len(WORDS), 'attrs': ATTRIBUTES,
+          'nattrs': len(ATTRIBUTES), 'lots': lots})
+    progress(f'lots: {lots} за {time.monotonic() - started:.1f} с')
+    migrate.migrate(conn, target=PRODUCTS_SCHEMA, progress=progress)
+
+    # Товары: лот выбирается со смещением к началу (power), цена - от цены
+    # единицы лота с множителем страны и логнормальным шумом
+    for first in range(1, products + 1, CHUNK):
+        last = min(first + CHUNK - 1, products)
+        cursor.execute(f"""
+            INSERT INTO search_results (lot_number, marketplace, product_title, product_price,
+                                        product_url, price, currency, price_normalized_at)
+            SELECT lot_number, marketplace, title,
+                   CASE currency
+                       WHEN 'KZT' THEN to_char(price, 'FM999G999G999G990') || ' ₸'
+                       WHEN 'RUB' THEN to_char(price, 'FM999999999990D00') || ' руб.'
+                       ELSE '¥' || to_char(price, 'FM999999999990D00')
+                   END,
+                   url, price, currency, now()
+            FROM (
+                SELECT l.lot_number, c.marketplace, c.currency,
+                       initcap(l.simplified_name) || ' ' || c.g as title,
+                       'https://example.com/p/' || c.g as url,
+                       round((l.tender_price / l.quantity / 1.5 * c.factor)::numeric, 2) as price
+                FROM (
+                    SELECT g, 1 + floor(power(random(), 2) * %(lots)s)::int as lot_id,
+                           (%(names)s::text[])[m] as marketplace,
+                           (%(currencies)s::text[])[m] as currency,
+                           (%(factors)s::float8[])[m] * exp(0.5 * {NORMAL}) as factor
+                    FROM (
+                        SELECT g, 1 + floor(random() * %(nnames)s)::int as m
+                        FROM generate_series(%(first)s, %(last)s) g
+                    ) choice
+                ) c
+                JOIN lots l ON l.id = c.lot_id
+            ) p
+        """, {'lots': lots, 'names': names, 'currencies': currencies, 'factors': factors,
+              'nnames': len(names), 'first': first, 'last': last})
+        progress(f'search_results: {last} из {products}, {time.monotonic() - started:.1f} с')
+
+    migrate.migrate(conn, progress=progress)
+
+    cursor.execute('ANALYZE')
+    cursor.close()
+    summaries.rebuild(conn, batch_size=5000)
+    analytics.run(conn, batch_size=5000, full=True)
+    progress(f'Готово за {time.monotonic() - started:.1f} с')
+
+
+def app_dsn(dsn, schema):
+    """DATABASE_URL, с которым приложение видит схему schema"""
+    separator = '&' if '?' in dsn else '?'
+    return f'{dsn}{separator}options=-csearch_path%3D{schema},public'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dsn', default=os.getenv('DATABASE_URL'))
+    parser.add_argument('--schema', default='bench_data')
+    parser.add_argument('--products', type=int, default=1000000,
+                        help='товаров (от 10 тыс. до 10 млн)')
+    parser.add_argument('--lots', type=int, help='лотов (по умолчанию товаров / 20)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if not args.dsn:
+        parser.error('укажите --dsn или DATABASE_URL')
+
+    conn = psycopg2.connect(args.dsn)
+    conn.autocommit = True
+    try:
+        generate(conn, args.schema, args.lots or max(args.products // 20, 1), args.products, args.seed)
+    finally:
+        conn.close()
+    print(f"DATABASE_URL='{app_dsn(args.dsn, args.schema)}'")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк выгрузки каталога: export.py (лоты именованным курсором по
+индексу, товары запросом на пачку, фрагменты по мере чтения) против
+одного JOIN лотов с товарами, выбранного в память, и сборки файла целиком.
+
+    DATABASE_URL=postgresql://localhost/bench \\
+        python -m benchmarks.export --lots 100000 --products 1000000 [--countries KZ,RU]
+
+Пиковая память процесса (ru_maxrss) только растет, поэтому потоковые
+режимы меряются первыми, а выборка в память - последней.
+"""
+
+import argparse
+import csv
+import io
+import os
+import resource
+import time
+
+import psycopg2
+
+import export
+from benchmarks.common import migration, run_sql_file
+from benchmarks.country_filter import generate
+
+FILTERS = {
+    'country_kz': True, 'country_ru': True, 'country_cn': True,
+    'deposit': None, 'margin': None, 'search': '', 'sort': 'newest',
+}
+
+# Выгрузка до export.iter_rows: JOIN целиком сортируется до первой строки
+JOIN_SQL = """
+    SELECT l.lot_number, l.original_name, l.simplified_name, l.customer, l.category,
+           l.quantity, l.unit, l.tender_price, l.created_at,
+           sr.marketplace, sr.country, sr.product_title, sr.product_price,
+           sr.price, sr.currency, sr.product_url
+    FROM lots l
+    LEFT JOIN lot_summaries s ON s.lot_number = l.lot_number
+    LEFT JOIN lot_analytics a ON a.lot_number = l.lot_number
+    LEFT JOIN search_results sr ON sr.lot_number = l.lot_number
+    WHERE {where}
+    ORDER BY l.created_at DESC, l.id DESC, sr.id
+"""
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def streamed(conn, filters, fmt):
+    """(байт, строк, время до первого фрагмента) потоковой выгрузки"""
+    started = time.perf_counter()
+    first = None
+    size = 0
+    rows = [0]
+
+    def counted(iterator):
+        for row in iterator:
+            rows[0] += 1
+            yield row
+
+    for chunk in export.WRITERS[fmt](counted(export.iter_rows(conn, filters))):
+        if first is None:
+            first = time.perf_counter() - started
+        size += len(chunk)
+    return size, rows[0], first
+
+
+def in_memory(conn, filters):
+    """Как без export.py: один JOIN, fetchall и весь CSV в одной строке"""
+    started = time.perf_counter()
+    cursor = conn.cursor()
+    where_sql, params = export.catalog_query.build_where(filters)
+    cursor.execute(JOIN_SQL.format(where=where_sql), params)
+    rows = cursor.fetchall()
+    cursor.close()
+    conn.rollback()
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([title for _, title in export.COLUMNS])
+    writer.writerows(rows)
+    data = buffer.getvalue().encode('utf-8')
+    return len(data), len(rows), time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dsn', default=os.getenv('DATABASE_URL'))
+    parser.add_argument('--lots', type=int, default=100000)
+    parser.add_argument('--products', type=int, default=1000000)
+    parser.add_argument('--countries', default='KZ,RU,CN', help='страны фильтра через запятую')
+    parser.add_argument('--schema', default='bench_export')
+    parser.add_argument('--skip-generate', action='store_true')
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error('укажите --dsn или DATABASE_URL')
+
+    conn = psycopg2.connect(args.dsn)
+    conn.autocommit = True
+    if not args.skip_generate:
+        print(f'Генерация: {args.lots} лотов, {args.products} товаров...')
+        generate(conn, args.schema, args.lots, args.products)
+        cursor = conn.cursor()
+        cursor.execute('ALTER TABLE search_results ADD COLUMN price NUMERIC(14, 2), ADD COLUMN currency CHAR(3)')
+        # Фильтры по депозиту и марже здесь не меряются - агрегаты не нужны
+        cursor.execute('CREATE TABLE lot_summaries (lot_number TEXT PRIMARY KEY)')
+        cursor.execute('CREATE TABLE lot_analytics (lot_number TEXT PRIMARY KEY)')
+        cursor.close()
+        run_sql_file(conn, migration('002_lots_created_at_id.sql'))
+    cursor = conn.cursor()
+    cursor.execute(f'SET search_path = {args.schema}, public')
+    cursor.close()
+    conn.autocommit = False
+    countries = {code.strip().upper() for code in args.countries.split(',')}
+    filters = dict(FILTERS, **{f'country_{code.lower()}': code in countries
+                               for code in ('KZ', 'RU', 'CN')})
+
+    baseline = peak_rss_mb()
+    print(f'{"режим":<16}{"строк":>10}{"МБ":>8}{"строк/с":>12}{"1-й байт, с":>13}{"пик RSS, МБ":>13}')
+    scenarios = [('поток csv', 'csv'), ('поток jsonl', 'jsonl')]
+    if export.xlsx_available():
+        scenarios.append(('поток xlsx', 'xlsx'))
+    for name, fmt in scenarios:
+        started = time.perf_counter()
+        size, rows, first = streamed(conn, filters, fmt)
+        elapsed = time.perf_counter() - started
+        print(f'{name:<16}{rows:>10}{size / 2**20:>8.1f}{rows / elapsed:>12,.0f}'
+              f'{first:>13.3f}{peak_rss_mb() - baseline:>+13.1f}')
+
+    started = time.perf_counter()
+    size, rows, first = in_memory(conn, filters)
+    elapsed = time.perf_counter() - started
+    print(f'{"JOIN в память":<16}{rows:>10}{size / 2**20:>8.1f}{rows / elapsed:>12,.0f}'
+          f'{first:>13.3f}{peak_rss_mb() - baseline:>+13.1f}')
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
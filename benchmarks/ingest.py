@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк загрузки товаров (ingest.py): разбор записей (JSONL, страна
+маркетплейса, цена) и, если указана база, полная загрузка - новые строки,
+повторная загрузка того же файла, измененные цены и файл с повторами
+ключей внутри пачки.
+
+    python -m benchmarks.ingest --rows 200000
+    DATABASE_URL=postgresql://localhost/bench \\
+        python -m benchmarks.ingest --rows 200000 --products 1000000
+
+Без базы меряется только разбор - часть загрузки, которая идет в Python.
+С базой сначала генерируется набор benchmarks.dataset (со всеми
+миграциями и триггерами), загрузка идет в его лоты.
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import time
+from datetime import datetime, timezone
+
+import psycopg2
+
+import ingest
+from benchmarks.dataset import MARKETPLACES, generate
+
+# Текст цены по валюте - как в выдаче магазинов
+PRICE_FORMATS = {
+    'KZT': lambda value: f'{value:,.0f} ₸'.replace(',', ' '),
+    'RUB': lambda value: f'{value:.2f}'.replace('.', ',') + ' руб.',
+    'CNY': lambda value: f'¥{value:.2f}',
+}
+CURRENCIES = {'kz': 'KZT', 'ru': 'RUB'}
+
+
+def records(rows, lots, run, duplicates=0.0, price_factor=1.0, seed=1):
+    """
+    Записи товаров для lots лотов; доля duplicates - повторы уже выданных
+    ключей (lot_number, product_url) с другой ценой. run входит в адреса
+    товаров: повторный запуск на той же схеме загружает новые строки
+    """
+    rnd = random.Random(seed)
+    names = [name for name, share in MARKETPLACES for _ in range(share)]
+    issued = []
+    for number in range(rows):
+        if issued and rnd.random() < duplicates:
+            record = dict(rnd.choice(issued))
+            record['product_price'] = PRICE_FORMATS['KZT'](rnd.uniform(100, 100000))
+            yield record
+            continue
+        marketplace = rnd.choice(names)
+        currency = CURRENCIES.get(marketplace.rsplit('.', 1)[-1], 'CNY')
+        record = {
+            'lot_number': f'LOT-{1 + rnd.randrange(lots):09d}',
+            'marketplace': marketplace,
+            'product_title': f'Товар {number}',
+            'product_price': PRICE_FORMATS[currency](
+                round(rnd.uniform(100, 100000) * price_factor, 2)),
+            'product_url': f'https://bench.example/{run}/{seed}/{number}',
+        }
+        issued.append(record)
+        yield record
+
+
+def jsonl(items):
+    """Файл JSONL в памяти - как его прочитает ingest.read_records"""
+    data = ''.join(json.dumps(item, ensure_ascii=False) + '\n' for item in items)
+    return data.encode('utf-8')
+
+
+def parse_only(data):
+    """Строк в файле: чтение JSONL и разбор без обращения к базе"""
+    columns = ingest.KINDS['results'][1]
+    key_positions = [columns.index('lot_number'), columns.index('product_url')]
+    normalized_at = datetime.now(timezone.utc).isoformat()
+    rows = 0
+    for record in ingest.read_records(io.BytesIO(data), 'jsonl'):
+        ingest.prepare('results', record, columns, key_positions, normalized_at)
+        rows += 1
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dsn', default=os.getenv('DATABASE_URL'))
+    parser.add_argument('--rows', type=int, default=200000, help='строк в загружаемом файле')
+    parser.add_argument('--lots', type=int, default=50000)
+    parser.add_argument('--products', type=int, default=1000000, help='товаров в базе до загрузки')
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--duplicates', type=float, default=0.2,
+                        help='доля повторов ключей в последнем файле')
+    parser.add_argument('--schema', default='bench_ingest')
+    parser.add_argument('--skip-generate', action='store_true')
+    args = parser.parse_args()
+
+    run = int(time.time())
+    fresh = jsonl(records(args.rows, args.lots, run))
+    changed = jsonl(records(args.rows, args.lots, run, price_factor=1.1))
+    repeated = jsonl(records(args.rows, args.lots, run, duplicates=args.duplicates, seed=2))
+
+    print(f'{"режим":<22}{"строк/с":>12}{"с":>8}  счетчики')
+    started = time.perf_counter()
+    rows = parse_only(fresh)
+    elapsed = time.perf_counter() - started
+    print(f'{"разбор (без базы)":<22}{rows / elapsed:>12,.0f}{elapsed:>8.2f}')
+
+    if not args.dsn:
+        print('DATABASE_URL не задан - загрузка в базу не мерялась')
+        return
+
+    conn = psycopg2.connect(args.dsn)
+    if not args.skip_generate:
+        conn.autocommit = True
+        generate(conn, args.schema, args.lots, args.products, progress=lambda message: None)
+        conn.autocommit = False
+    cursor = conn.cursor()
+    cursor.execute(f'SET search_path = {args.schema}, public')
+    conn.commit()
+    cursor.close()
+
+    scenarios = [
+        ('новые строки', fresh, {'inserted': args.rows}),
+        ('тот же файл', fresh, {'unchanged': args.rows}),
+        ('новые цены', changed, {'updated': args.rows}),
+        ('повторы в пачке', repeated, {}),
+    ]
+    try:
+        for name, data, expected in scenarios:
+            stats = ingest.ingest(conn, 'results', ingest.read_records(io.BytesIO(data), 'jsonl'),
+                                  args.batch_size)
+            elapsed = stats['elapsed']
+            counters = ', '.join(f'{key} {stats[key]}' for key in
+                                 ('inserted', 'updated', 'unchanged', 'duplicates') if stats[key])
+            print(f'{name:<22}{stats["rows"] / elapsed if elapsed else 0:>12,.0f}'
+                  f'{elapsed:>8.2f}  {counters}')
+            for key, value in expected.items():
+                assert stats[key] == value, (name, key, stats[key])
+            if name == 'повторы в пачке':
+                assert stats['rows'] == (stats['inserted'] + stats['updated']
+                                         + stats['unchanged'] + stats['duplicates'])
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк классификации маркетплейсов: цепочка any(x in ...) на каждую
+строку (как было в lot_detail) против правил marketplaces.py, собранных
+в одно выражение, - без запоминания и с ним.
+
+    python -m benchmarks.marketplaces --rows 5000000
+
+PostgreSQL не нужен: строки генерируются в памяти.
+"""
+
+import argparse
+import random
+import time
+
+import marketplaces
+
+KNOWN = [
+    'aliexpress', 'AliExpress', '1688', '1688.com', 'taobao', 'Taobao.com', 'temu',
+    'pinduoduo', 'kaspi', 'Kaspi.kz', 'satu', 'satu.kz', 'ozon.kz', 'otevertka',
+    'wildberries', 'Wildberries', 'wb.ru', 'ozon', 'ozon.ru', 'Ozon.ru', 'chipdip',
+]
+
+
+def generate(rows, unknown, seed=1):
+    """Названия маркетплейсов; доля unknown - неизвестные площадки"""
+    rnd = random.Random(seed)
+    shops = [f'shop{i}.example' for i in range(200)]
+    return [rnd.choice(shops) if rnd.random() < unknown else rnd.choice(KNOWN)
+            for _ in range(rows)]
+
+
+def legacy_classify(marketplace):
+    """Классификация из lot_detail до marketplaces.py (без умолчания RU)"""
+    marketplace = (marketplace or '').lower()
+    if any(x in marketplace for x in ['1688', 'taobao', 'temu', 'aliexpress', 'pinduoduo']):
+        return 'CN'
+    elif any(x in marketplace for x in ['kaspi', 'satu', 'ozon.kz', 'otevertka']):
+        return 'KZ'
+    elif any(x in marketplace for x in ['wildberries', 'ozon.ru', 'ozon', 'chipdip', 'wb.ru']):
+        return 'RU'
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=5000000)
+    parser.add_argument('--unknown', type=float, default=0.05, help='доля неизвестных площадок')
+    args = parser.parse_args()
+
+    names = generate(args.rows, args.unknown)
+    classifier = marketplaces.Classifier()
+
+    scenarios = [
+        ('any() по спискам', lambda: [legacy_classify(name) for name in names]),
+        ('выражение', lambda: [classifier._classify(name) for name in names]),
+        ('выражение + кеш', lambda: classifier.classify_many(names)),
+    ]
+
+    results = {}
+    print(f'{"режим":<20}{"строк/с":>14}{"с":>8}')
+    for name, run in scenarios:
+        started = time.perf_counter()
+        results[name] = run()
+        elapsed = time.perf_counter() - started
+        print(f'{name:<20}{args.rows / elapsed:>14,.0f}{elapsed:>8.2f}')
+
+    # Правила те же - результаты обязаны совпасть
+    expected = results['any() по спискам']
+    for name, values in results.items():
+        assert values == expected, name
+
+
+if __name__ == '__main__':
+    main()
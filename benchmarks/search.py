@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк поиска по названиям лотов: ILIKE '%...%' без индексов (как было)
+против полнотекстового + триграммного поиска search.py по индексам
+migrations/003_lots_search.sql.
+
+    DATABASE_URL=postgresql://localhost/bench \\
+        python -m benchmarks.search --lots 1000000
+"""
+
+import argparse
+import os
+import time
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+import search as lot_search
+from benchmarks.common import measure, migration, run_sql_file
+
+WORDS = [
+    'ноутбук', 'монитор', 'принтер', 'картридж', 'бумага', 'кабель', 'клавиатура',
+    'мышь', 'стул', 'стол', 'шкаф', 'лампа', 'перчатки', 'халат', 'маска', 'шприц',
+    'бинт', 'лента', 'краска', 'кисть', 'насос', 'фильтр', 'датчик', 'провод',
+    'laptop', 'monitor', 'printer', 'toner', 'router', 'switch', 'cable', 'adapter',
+]
+ATTRIBUTES = [
+    'офисный', 'медицинский', 'белый', 'черный', 'а4', 'usb', 'hdmi', '24"', 'led',
+    'одноразовые', 'нитриловые', 'металлический', 'пластиковый', 'hp', 'canon', 'dell',
+]
+
+QUERIES = ['ноутбук', 'ноут', 'картриджи hp', 'монитр', 'printer canon', 'перчатки нитриловые']
+
+PER_PAGE = 20
+
+
+def generate(conn, schema, lots):
+    """Лоты со случайными названиями из словаря"""
+    cursor = conn.cursor()
+    cursor.execute(f'DROP SCHEMA IF EXISTS {schema} CASCADE')
+    cursor.execute(f'CREATE SCHEMA {schema}')
+    cursor.execute(f'SET search_path = {schema}, public')
+    cursor.execute("""
+        CREATE TABLE lots (
+            id SERIAL PRIMARY KEY,
+            lot_number TEXT UNIQUE NOT NULL,
+            original_name TEXT,
+            simplified_name TEXT,
+            tender_price NUMERIC(14, 2),
+            quantity INTEGER,
+            created_at TIMESTAMP DEFAULT now()
+        )
+    """)
+    cursor.execute("""
+        INSERT INTO lots (lot_number, original_name, simplified_name, tender_price, quantity, created_at)
+        SELECT 'LOT-' || g,
+               initcap(w1) || ' ' || a1 || ' ' || a2 || ' для нужд учреждения №' || (g % 500),
+               w1 || ' ' || a1,
+               round((random() * 1000000)::numeric, 2), 1 + (random() * 100)::int,
+               now() - g * interval '1 minute'
+        FROM (
+            SELECT g,
+                   (%(words)s::text[])[1 + floor(random() * %(nwords)s)::int] as w1,
+                   (%(attrs)s::text[])[1 + floor(random() * %(nattrs)s)::int] as a1,
+                   (%(attrs)s::text[])[1 + floor(random() * %(nattrs)s)::int] as a2
+            FROM generate_series(1, %(lots)s) g
+        ) s
+    """, {'words': WORDS, 'nwords': len(WORDS), 'attrs': ATTRIBUTES,
+          'nattrs': len(ATTRIBUTES), 'lots': lots})
+    cursor.execute('ANALYZE lots')
+    cursor.close()
+
+
+def ilike_search(cursor, term):
+    cursor.execute("""
+        SELECT l.id FROM lots l
+        WHERE l.original_name ILIKE %s OR l.simplified_name ILIKE %s
+        ORDER BY l.created_at DESC LIMIT %s
+    """, [f'%{term}%', f'%{term}%', PER_PAGE])
+    return len(cursor.fetchall())
+
+
+def indexed_search(cursor, term):
+    where_sql, where_params, rank_sql, rank_params = lot_search.build_search(term)
+    cursor.execute(f"""
+        SELECT l.id, {rank_sql} as rank FROM lots l
+        WHERE {where_sql}
+        ORDER BY rank DESC, l.id DESC LIMIT %s
+    """, rank_params + where_params + [PER_PAGE])
+    return len(cursor.fetchall())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dsn', default=os.getenv('DATABASE_URL'))
+    parser.add_argument('--schema', default='bench_search')
+    parser.add_argument('--lots', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    if not args.dsn:
+        parser.error('укажите --dsn или DATABASE_URL')
+
+    conn = psycopg2.connect(args.dsn)
+    conn.autocommit = True
+
+    started = time.perf_counter()
+    generate(conn, args.schema, args.lots)
+    print(f'Данные: {args.lots} лотов за {time.perf_counter() - started:.1f} с')
+
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    cursor.execute(f'SET search_path = {args.schema}, public')
+    before = {term: measure(ilike_search, cursor, term, repeat=args.repeat) for term in QUERIES}
+
+    started = time.perf_counter()
+    run_sql_file(conn, migration('003_lots_search.sql'))
+    cursor.execute('ANALYZE lots')
+    print(f'Миграция 003 (колонка + индексы): {time.perf_counter() - started:.1f} с')
+
+    print(f'{"запрос":<24}{"ILIKE, мс":>12}{"найдено":>10}{"индексы, мс":>14}{"найдено":>10}')
+    for term in QUERIES:
+        old_ms, old_found = before[term]
+        new_ms, new_found = measure(indexed_search, cursor, term, repeat=args.repeat)
+        print(f'{term:<24}{old_ms:>12.1f}{old_found:>10}{new_ms:>14.1f}{new_found:>10}')
+
+    cursor.close()
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
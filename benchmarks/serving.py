@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Нагрузочный тест режимов gunicorn: синхронные воркеры (как в Procfile)
+против воркеров gevent (-k gevent) с тем же числом процессов.
+
+    DATABASE_URL=postgresql://localhost/bench \\
+        python -m benchmarks.serving --workers 2 --concurrency 64 --duration 20
+
+Приложение запускается в подпроцессе на каждый режим; нагрузку дают
+--concurrency потоков, каждый запрос - новое HTTP-подключение. Для режима
+gevent нужен пакет gevent.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from benchmarks.common import ROOT, http_request, login, percentile
+
+MODES = {
+    'sync': ['-k', 'sync'],
+    'gevent': ['-k', 'gevent', '--worker-connections', '1000'],
+}
+
+
+def request(port, method, path, cookie=None, body=None):
+    return http_request('127.0.0.1', port, method, path, cookie, body)
+
+
+def start(mode, workers, port, users_db):
+    """Запустить gunicorn и дождаться ответа"""
+    env = dict(os.environ, USERS_DB=users_db)
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-w', str(workers), *MODES[mode],
+         '-b', f'127.0.0.1:{port}', '--timeout', '120', 'app:app'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            request(port, 'GET', '/')
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'gunicorn ({mode}) не запустился')
+
+
+def load(port, cookie, paths, concurrency, duration):
+    """Гонять запросы по кругу: латентности (мс) по путям и число ошибок"""
+    timings = {path: [] for path in paths}
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(offset):
+        i = offset
+        while time.monotonic() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            started = time.perf_counter()
+            try:
+                status, _, _ = request(port, 'GET', path, cookie)
+                ok = status == 200
+            except OSError:
+                ok = False
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                if ok:
+                    timings[path].append(elapsed)
+                else:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return timings, errors[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--modes', default='sync,gevent')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--email', default='admin@tenderfinder.com')
+    parser.add_argument('--password', default='admin123')
+    args = parser.parse_args()
+
+    if not os.getenv('DATABASE_URL'):
+        parser.error('укажите DATABASE_URL')
+
+    users_db = os.path.join(tempfile.mkdtemp(), 'users.db')
+    results = []
+    for mode in args.modes.split(','):
+        process = start(mode, args.workers, args.port, users_db)
+        try:
+            cookie = login('127.0.0.1', args.port, args.email, args.password)
+            _, _, body = request(args.port, 'GET', '/api/lots?per_page=1', cookie)
+            lots = json.loads(body)['lots']
+            paths = ['/catalog', '/api/lots?per_page=20']
+            if lots:
+                paths.append(f"/lot/{urllib.parse.quote(lots[0]['lot_number'])}")
+
+            load(args.port, cookie, paths, args.concurrency, 2)  # прогрев
+            timings, errors = load(args.port, cookie, paths, args.concurrency, args.duration)
+            results.append((mode, timings, errors))
+        finally:
+            process.terminate()
+            process.wait()
+
+    print(f'{"режим":<8}{"маршрут":<26}{"запр./с":>10}{"p50, мс":>10}{"p99, мс":>10}')
+    for mode, timings, errors in results:
+        for path, values in timings.items():
+            rps = len(values) / args.duration
+            values = sorted(values) or [0]
+            p99 = percentile(values, 99)
+            print(f'{mode:<8}{path[:25]:<26}{rps:>10.1f}'
+                  f'{statistics.median(values):>10.1f}{p99:>10.1f}')
+        total = sum(len(values) for values in timings.values())
+        print(f'{mode:<8}{"всего":<26}{total / args.duration:>10.1f}    ошибок: {errors}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк обращений к SQLite пользователей на запрос: как было (новое
+подключение и SELECT на каждый вызов get_current_user) против постоянного
+подключения в WAL и пользователя, запомненного на запрос (и кеша с TTL).
+
+    python -m benchmarks.user_lookups --requests 2000
+
+PostgreSQL не нужен: меряются страницы, которые читают только SQLite.
+"""
+
+import argparse
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+
+ROUTES = ['/', '/admin', '/admin/users']
+
+
+class Counter:
+    def __init__(self):
+        self.connections = 0
+        self.statements = 0
+
+    def trace(self, statement):
+        if not statement.startswith('PRAGMA'):
+            self.statements += 1
+
+
+def run(client, requests):
+    """Латентность (мс) по маршрутам"""
+    timings = {route: [] for route in ROUTES}
+    for i in range(requests):
+        route = ROUTES[i % len(ROUTES)]
+        started = time.perf_counter()
+        response = client.get(route)
+        timings[route].append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200, (route, response.status_code)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    os.environ['USERS_DB'] = os.path.join(tempfile.mkdtemp(), 'users.db')
+    os.environ['USERS_BACKEND'] = 'sqlite'
+    os.environ.pop('DATABASE_URL', None)
+    import app as app_module
+    import users
+    store = users.get_store()
+    store.get(1)  # таблица и администратор создаются при первом обращении
+
+    client = app_module.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1  # администратор по умолчанию
+
+    original_connection = store.connection
+    original_get_current_user = app_module.get_current_user
+
+    # Как было: новое подключение на каждое обращение, без запоминания
+    legacy = Counter()
+
+    def legacy_get_users_db():
+        conn = sqlite3.connect(store.path)
+        conn.row_factory = sqlite3.Row
+        conn.set_trace_callback(legacy.trace)
+        legacy.connections += 1
+        return conn
+
+    def legacy_get_current_user():
+        user_id = app_module.session.get('user_id')
+        if not user_id:
+            return None
+        c = legacy_get_users_db().cursor()
+        c.execute('SELECT * FROM users WHERE id = ?', (user_id,))
+        user = c.fetchone()
+        return dict(user) if user else None
+
+    # Как стало: постоянное подключение, пользователь запоминается на запрос
+    memo, memo_ttl = Counter(), Counter()
+    traced = {}
+
+    def traced_connection():
+        conn = original_connection()
+        if id(conn) not in traced:
+            counter = memo_ttl if app_module.USER_CACHE_TTL else memo
+            conn.set_trace_callback(counter.trace)
+            counter.connections += 1
+            traced[id(conn)] = conn
+        return conn
+
+    results = []
+    scenarios = [
+        ('как было', legacy, legacy_get_users_db, legacy_get_current_user, 0),
+        ('запрос (g)', memo, traced_connection, original_get_current_user, 0),
+        ('g + TTL 5 с', memo_ttl, traced_connection, original_get_current_user, 5),
+    ]
+    for name, counter, connection, get_current_user, ttl in scenarios:
+        # Каждый сценарий начинает со своего подключения
+        store._local.conn = None
+        store.connection = connection
+        app_module.get_current_user = get_current_user
+        app_module.USER_CACHE_TTL = ttl
+        app_module._user_cache.clear()
+
+        run(client, len(ROUTES))  # прогрев
+        counter.connections = counter.statements = 0
+        timings = run(client, args.requests)
+        results.append((name, counter, timings))
+
+    store.connection = original_connection
+    app_module.get_current_user = original_get_current_user
+
+    print(f'{"режим":<14}{"маршрут":<14}{"p50, мс":>9}{"p99, мс":>9}'
+          f'{"SQL/запрос":>12}{"подключ./запрос":>17}')
+    for name, counter, timings in results:
+        for route in ROUTES:
+            values = sorted(timings[route])
+            p99 = values[min(len(values) - 1, int(len(values) * 0.99))]
+            print(f'{name:<14}{route:<14}{statistics.median(values):>9.2f}{p99:>9.2f}'
+                  f'{counter.statements / args.requests:>12.2f}'
+                  f'{counter.connections / args.requests:>17.2f}')
+
+
+if __name__ == '__main__':
+    main()
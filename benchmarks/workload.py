@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Нагрузка по сценариям на запущенное приложение: каталог (первая страница,
+поиск, фильтр по странам, сортировка по марже, глубокие страницы), страницы лотов и /api/stats.
+Печатает пропускную способность и перцентили задержки по сценариям,
+сохраняет их в JSON и сравнивает с прошлым прогоном.
+
+    python -m benchmarks.dataset --products 1000000           # данные
+    DATABASE_URL='...' gunicorn -w 4 app:app                  # приложение
+    python -m benchmarks.workload --url http://127.0.0.1:8000 --duration 60 \\
+        --save baseline.json
+    python -m benchmarks.workload --url http://127.0.0.1:8000 --baseline baseline.json
+
+С --baseline код выхода 1, если p99 сценария выросла или пропускная
+способность упала больше чем на --tolerance.
+"""
+
+import argparse
+import json
+import random
+import statistics
+import sys
+import threading
+import time
+import urllib.parse
+
+from benchmarks.common import http_request, login, percentile
+from benchmarks.search import QUERIES, WORDS
+
+# Сценарий -> вес (доля запросов)
+SCENARIOS = {
+    'catalog': 15,
+    'catalog_search': 20,
+    'catalog_country': 10,
+    'catalog_margin': 5,
+    'catalog_deep': 10,
+    'lot': 35,
+    'stats': 5,
+}
+
+COUNTRY_FILTERS = [
+    'country_kz=1&country_ru=0&country_cn=0',
+    'country_kz=0&country_ru=1&country_cn=0',
+    'country_kz=0&country_ru=0&country_cn=1',
+    'country_kz=1&country_ru=0&country_cn=1',
+]
+
+
+class Workload:
+    """Адреса сценариев; лоты и курсоры глубоких страниц берутся из /api/lots"""
+
+    def __init__(self, host, port, cookie, deep_pages=50, seed=1):
+        self.host = host
+        self.port = port
+        self.cookie = cookie
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.lot_numbers = []
+        self.cursors = []
+        self._walk(deep_pages)
+
+    def _walk(self, pages):
+        after = None
+        for _ in range(pages):
+            path = '/api/lots?per_page=100&count=none' + (f'&after={after}' if after else '')
+            status, _, body = http_request(self.host, self.port, 'GET', path, self.cookie)
+            if status != 200:
+                raise RuntimeError(f'{path}: HTTP {status}')
+            page = json.loads(body)
+            self.lot_numbers.extend(lot['lot_number'] for lot in page['lots'])
+            after = page['next_cursor']
+            if not after:
+                break
+            self.cursors.append(after)
+        if not self.lot_numbers:
+            raise RuntimeError('в базе нет лотов - сначала python -m benchmarks.dataset')
+
+    def path(self, scenario):
+        with self.lock:
+            rnd = self.random
+            if scenario == 'catalog':
+                return '/catalog'
+            if scenario == 'catalog_search':
+                term = rnd.choice(QUERIES) if rnd.random() < 0.5 else rnd.choice(WORDS)
+                return '/catalog?' + urllib.parse.urlencode({'search': term})
+            if scenario == 'catalog_country':
+                return '/catalog?' + rnd.choice(COUNTRY_FILTERS)
+            if scenario == 'catalog_margin':
+                return '/catalog?sort=margin'
+            if scenario == 'catalog_deep':
+                cursor = rnd.choice(self.cursors) if self.cursors else ''
+                return '/catalog?' + urllib.parse.urlencode({'after': cursor})
+            if scenario == 'lot':
+                return '/lot/' + urllib.parse.quote(rnd.choice(self.lot_numbers))
+            if scenario == 'stats':
+                return '/api/stats'
+            raise ValueError(scenario)
+
+    def pick(self, scenarios):
+        with self.lock:
+            return self.random.choices(scenarios, weights=[SCENARIOS[s] for s in scenarios])[0]
+
+
+def run(workload, scenarios, concurrency, duration):
+    """Латентности (мс) и ошибки по сценариям"""
+    timings = {scenario: [] for scenario in scenarios}
+    errors = dict.fromkeys(scenarios, 0)
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker():
+        while time.monotonic() < deadline:
+            scenario = workload.pick(scenarios)
+            path = workload.path(scenario)
+            started = time.perf_counter()
+            try:
+                status, _, _ = http_request(workload.host, workload.port, 'GET', path, workload.cookie)
+                ok = status == 200
+            except OSError:
+                ok = False
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                if ok:
+                    timings[scenario].append(elapsed)
+                else:
+                    errors[scenario] += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return timings, errors
+
+
+def summarize(timings, errors, duration):
+    result = {}
+    for scenario, values in timings.items():
+        values = sorted(values)
+        result[scenario] = {
+            'requests': len(values),
+            'errors': errors[scenario],
+            'rps': round(len(values) / duration, 2),
+            'p50': round(statistics.median(values), 2) if values else 0.0,
+            'p90': round(percentile(values, 90), 2),
+            'p99': round(percentile(values, 99), 2),
+            'max': round(values[-1], 2) if values else 0.0,
+        }
+    return result
+
+
+def compare(result, baseline, tolerance):
+    """Регрессии относительно baseline: список строк"""
+    regressions = []
+    for scenario, current in result.items():
+        before = baseline.get(scenario)
+        if not before:
+            continue
+        if before['p99'] and current['p99'] > before['p99'] * (1 + tolerance):
+            regressions.append(f'{scenario}: p99 {before["p99"]} -> {current["p99"]} мс')
+        if before['rps'] and current['rps'] < before['rps'] * (1 - tolerance):
+            regressions.append(f'{scenario}: {before["rps"]} -> {current["rps"]} запр./с')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--warmup', type=float, default=5)
+    parser.add_argument('--deep-pages', type=int, default=50,
+                        help='на сколько страниц /api/lots уходить за курсорами')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--email', default='admin@tenderfinder.com')
+    parser.add_argument('--password', default='admin123')
+    parser.add_argument('--save', help='сохранить результат в JSON')
+    parser.add_argument('--baseline', help='JSON прошлого прогона для сравнения')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    scenarios = args.scenarios.split(',')
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f'неизвестные сценарии: {", ".join(unknown)}')
+
+    url = urllib.parse.urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    cookie = login(host, port, args.email, args.password)
+    workload = Workload(host, port, cookie, args.deep_pages, args.seed)
+    print(f'Лотов для /lot: {len(workload.lot_numbers)}, курсоров глубоких страниц: {len(workload.cursors)}')
+
+    if args.warmup:
+        run(workload, scenarios, args.concurrency, args.warmup)
+    timings, errors = run(workload, scenarios, args.concurrency, args.duration)
+    result = summarize(timings, errors, args.duration)
+
+    print(f'{"сценарий":<18}{"запр./с":>10}{"p50, мс":>10}{"p90, мс":>10}{"p99, мс":>10}'
+          f'{"max, мс":>10}{"ошибок":>8}')
+    for scenario, row in result.items():
+        print(f'{scenario:<18}{row["rps"]:>10.1f}{row["p50"]:>10.1f}{row["p90"]:>10.1f}'
+              f'{row["p99"]:>10.1f}{row["max"]:>10.1f}{row["errors"]:>8}')
+    print(f'{"всего":<18}{sum(row["rps"] for row in result.values()):>10.1f}')
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f'РЕГРЕССИЯ {line}')
+        if regressions:
+            return 1
+        print('Регрессий нет')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
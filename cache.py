@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TenderFinder Commercial - Кеш данных и ответов
+
+Два уровня: LRU с TTL в памяти процесса и необязательный общий бэкенд
+(Redis при CACHE_REDIS_URL, в тестах - любой объект с get/set/delete и,
+для сброса по префиксу, delete_prefix).
+Просроченное значение еще stale_ttl секунд отдается сразу, а свежее
+считается в фоне (stale-while-revalidate). У каждого значения есть ETag.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from flask import request
+
+
+class LocalCache:
+    """LRU-словарь записей в памяти процесса"""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data.move_to_end(key)
+            return entry
+
+    def set(self, key, entry, ttl):
+        with self._lock:
+            self._data[key] = entry
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def keys(self):
+        with self._lock:
+            return list(self._data)
+
+
+class RedisCache:
+    """Общий бэкенд на Redis (пакет redis нужен только при CACHE_REDIS_URL)"""
+
+    def __init__(self, url, prefix='tenderfinder:'):
+        import redis
+        self._redis = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self._redis.get(self.prefix + key)
+        return pickle.loads(raw) if raw is not None else None
+
+    def set(self, key, entry, ttl):
+        self._redis.set(self.prefix + key, pickle.dumps(entry), ex=max(int(ttl), 1))
+
+    def delete(self, key):
+        self._redis.delete(self.prefix + key)
+
+    def delete_prefix(self, prefix):
+        """Удалить все ключи с префиксом (SCAN по шаблону, без блокировки Redis)"""
+        pattern = re.sub(r'([*?\[\]\\])', r'\\\1', self.prefix + prefix) + '*'
+        keys = []
+        for key in self._redis.scan_iter(match=pattern, count=1000):
+            keys.append(key)
+            if len(keys) >= 1000:
+                self._redis.delete(*keys)
+                keys = []
+        if keys:
+            self._redis.delete(*keys)
+
+
+def make_etag(value):
+    """ETag (без кавычек) по содержимому значения"""
+    try:
+        raw = json.dumps(value, sort_keys=True, default=str).encode()
+    except TypeError:
+        raw = pickle.dumps(value)
+    return hashlib.sha1(raw).hexdigest()[:20]
+
+
+class Cache:
+    """
+    Кеш с TTL, stale-while-revalidate и метриками по ключам.
+
+    Запись: {'value', 'etag', 'created', 'expires', 'stale_until'} (время - time.time()).
+    """
+
+    def __init__(self, local=None, shared=None, default_ttl=60, default_stale_ttl=300):
+        self.local = local or LocalCache()
+        self.shared = shared
+        self.default_ttl = default_ttl
+        self.default_stale_ttl = default_stale_ttl
+
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    # ------------------------------------------------------------------
+    # Метрики
+    # ------------------------------------------------------------------
+
+    def _count(self, key, name, amount=1):
+        with self._lock:
+            metrics = self._metrics.setdefault(key, {
+                'hits': 0, 'stale_hits': 0, 'misses': 0, 'refreshes': 0,
+                'errors': 0, 'compute_time_total': 0.0,
+            })
+            metrics[name] += amount
+
+    def stats(self):
+        """Метрики по ключам"""
+        with self._lock:
+            return {key: dict(metrics) for key, metrics in self._metrics.items()}
+
+    # ------------------------------------------------------------------
+    # Хранение
+    # ------------------------------------------------------------------
+
+    def _lookup(self, key):
+        now = time.time()
+        entry = self.local.get(key)
+        if entry is not None and now >= entry['stale_until']:
+            self.local.delete(key)
+            entry = None
+
+        # Другой воркер мог уже посчитать свежее значение
+        if (entry is None or now >= entry['expires']) and self.shared is not None:
+            try:
+                shared_entry = self.shared.get(key)
+            except Exception:
+                self._count(key, 'errors')
+                shared_entry = None
+            if shared_entry is not None and (entry is None or shared_entry['created'] > entry['created']):
+                entry = shared_entry
+                self.local.set(key, entry, entry['stale_until'] - now)
+        return entry
+
+    def _store(self, key, value, ttl, stale_ttl):
+        now = time.time()
+        entry = {
+            'value': value,
+            'etag': make_etag(value),
+            'created': now,
+            'expires': now + ttl,
+            'stale_until': now + ttl + stale_ttl,
+        }
+        self.local.set(key, entry, ttl + stale_ttl)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, entry, ttl + stale_ttl)
+            except Exception:
+                self._count(key, 'errors')
+        return entry
+
+    def _compute(self, key, compute, ttl, stale_ttl):
+        started = time.monotonic()
+        value = compute()
+        self._count(key, 'compute_time_total', time.monotonic() - started)
+        return self._store(key, value, ttl, stale_ttl)
+
+    def _refresh_in_background(self, key, compute, ttl, stale_ttl):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._compute(key, compute, ttl, stale_ttl)
+                self._count(key, 'refreshes')
+            except Exception:
+                # Остается устаревшее значение до stale_until
+                self._count(key, 'errors')
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, name=f'cache-refresh:{key}', daemon=True).start()
+
+    # ------------------------------------------------------------------
+    # Публичный API
+    # ------------------------------------------------------------------
+
+    def get_entry(self, key, compute, ttl=None, stale_ttl=None):
+        """
+        Запись по ключу; при отсутствии или истечении stale_until - compute().
+
+        compute вызывается без аргументов; в фоне - в отдельном потоке, так
+        что он не должен полагаться на контекст текущего запроса.
+        """
+        ttl = self.default_ttl if ttl is None else ttl
+        stale_ttl = self.default_stale_ttl if stale_ttl is None else stale_ttl
+        now = time.time()
+
+        entry = self._lookup(key)
+        if entry is not None and now < entry['expires']:
+            self._count(key, 'hits')
+            return entry
+        if entry is not None and now < entry['stale_until']:
+            self._count(key, 'stale_hits')
+            self._refresh_in_background(key, compute, ttl, stale_ttl)
+            return entry
+
+        self._count(key, 'misses')
+        return self._compute(key, compute, ttl, stale_ttl)
+
+    def get_or_compute(self, key, compute, ttl=None, stale_ttl=None):
+        """Значение по ключу (см. get_entry)"""
+        return self.get_entry(key, compute, ttl, stale_ttl)['value']
+
+    def invalidate_prefix(self, prefix):
+        """
+        Удалить все ключи с префиксом из обоих уровней. Общий бэкенд без
+        delete_prefix (не Redis) отпускает свои записи только по TTL.
+        """
+        for key in self.local.keys():
+            if key.startswith(prefix):
+                self.local.delete(key)
+        if self.shared is not None and hasattr(self.shared, 'delete_prefix'):
+            try:
+                self.shared.delete_prefix(prefix)
+            except Exception:
+                self._count(prefix, 'errors')
+
+    def invalidate(self, key):
+        """Удалить ключ из обоих уровней"""
+        self.local.delete(key)
+        if self.shared is not None:
+            try:
+                self.shared.delete(key)
+            except Exception:
+                self._count(key, 'errors')
+
+
+def conditional(response, entry, public=False):
+    """
+    Проставить ETag и Cache-Control записи кеша и ответить 304,
+    если If-None-Match клиента совпал.
+    """
+    response.set_etag(entry['etag'], weak=True)
+    response.cache_control.max_age = max(int(entry['expires'] - time.time()), 0)
+    if public:
+        response.cache_control.public = True
+    else:
+        response.cache_control.private = True
+    return response.make_conditional(request)
+
+
+# ============================================================================
+# КЕШ ПРОЦЕССА
+# ============================================================================
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Кеш текущего процесса"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                url = os.getenv('CACHE_REDIS_URL')
+                _cache = Cache(
+                    local=LocalCache(int(os.getenv('CACHE_MAX_ENTRIES', 1024))),
+                    shared=RedisCache(url) if url else None,
+                    default_ttl=float(os.getenv('CACHE_TTL', 60)),
+                    default_stale_ttl=float(os.getenv('CACHE_STALE_TTL', 300)),
+                )
+    return _cache
+
+
+def set_cache(cache):
+    """Подменить кеш процесса (тесты, локальная замена общего бэкенда)"""
+    global _cache
+    _cache = cache
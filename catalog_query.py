@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TenderFinder Commercial - Запросы каталога
+
+Общая часть для /catalog и /api/lots: разбор фильтров, построение WHERE,
+keyset-пагинация по (created_at, id), (релевантность, id) или (маржа, id) и
+подсчет общего количества.
+"""
+
+import base64
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from decimal import Decimal
+
+import search as lot_search
+
+PER_PAGE = 20
+MAX_PER_PAGE = 100
+
+# exact - COUNT(*) на каждый запрос, cached - COUNT(*) с кешем на COUNT_TTL секунд,
+# estimate - оценка планировщика (EXPLAIN), none - не считать
+COUNT_MODE = os.getenv('CATALOG_COUNT_MODE', 'cached')
+COUNT_TTL = float(os.getenv('CATALOG_COUNT_TTL', 60))
+
+
+class InvalidCursor(ValueError):
+    """Поврежденный или чужой токен пагинации"""
+
+
+# ============================================================================
+# ФИЛЬТРЫ
+# ============================================================================
+
+def parse_filters(args):
+    """Фильтры каталога из query string (request.args)"""
+    return {
+        'country_kz': args.get('country_kz', '1') == '1',
+        'country_ru': args.get('country_ru', '1') == '1',
+        'country_cn': args.get('country_cn', '1') == '1',
+        'deposit': args.get('deposit', type=float),
+        'margin': args.get('margin', type=float),
+        'search': args.get('search', '').strip(),
+        # relevance - по релевантности (только вместе с search), newest - новые сверху,
+        # margin - наибольшая оценка маржи сверху (lot_analytics, analytics.py)
+        'sort': args.get('sort', 'relevance'),
+    }
+
+
+def build_where(filters):
+    """WHERE для лотов (алиас l, агрегаты lot_summaries - s, аналитика - a) и его параметры"""
+    where_clauses = []
+    params = []
+
+    # Фильтр по поиску (полнотекстовый + триграммы, см. search.py)
+    search = lot_search.build_search(filters['search']) if filters['search'] else None
+    if search:
+        where_clauses.append(search[0])
+        params.extend(search[1])
+
+    # Фильтр по странам - по предвычисленной колонке search_results.country
+    # (migrations/001_search_results_country.sql)
+    countries = selected_countries(filters)
+    if countries is not None:
+        where_clauses.append("""EXISTS (
+            SELECT 1 FROM search_results sc
+            WHERE sc.lot_number = l.lot_number AND sc.country = ANY(%s)
+        )""")
+        params.append(countries)
+
+    # Депозит и маржа - по самому дешевому найденному товару. Для всех стран
+    # это индексированные s.min_cost и s.margin, для части стран - минимум
+    # из цен выбранных стран (migrations/006_lot_summaries_costs.sql). Цены
+    # в lot_summaries уже в тенге, как и цена тендера (012_currency_rates.sql)
+    if filters['deposit'] is not None or filters['margin'] is not None:
+        min_cost, margin = _cost_expressions(filters)
+        if filters['deposit'] is not None:
+            where_clauses.append(f"{min_cost} <= %s")
+            params.append(filters['deposit'])
+        if filters['margin'] is not None:
+            where_clauses.append(f"{margin} >= %s")
+            params.append(filters['margin'])
+
+    # В сортировке по марже - только лоты с посчитанной маржой (частичный
+    # индекс migrations/011_lot_analytics.sql)
+    if filters.get('sort') == 'margin':
+        where_clauses.append("a.est_margin IS NOT NULL")
+
+    where_sql = " AND ".join(where_clauses) if where_clauses else "1=1"
+    return where_sql, params
+
+
+def selected_countries(filters):
+    """Коды выбранных стран или None, если выбраны все (фильтра нет)"""
+    if filters['country_kz'] and filters['country_ru'] and filters['country_cn']:
+        return None
+    return [code for code, key in (('KZ', 'country_kz'), ('RU', 'country_ru'), ('CN', 'country_cn'))
+            if filters[key]]
+
+
+def _cost_expressions(filters):
+    """SQL-выражения минимальной стоимости закупки и маржи (₸) с учетом стран"""
+    selected = [column for column, key in (('s.kz_min_price', 'country_kz'),
+                                           ('s.ru_min_price', 'country_ru'),
+                                           ('s.cn_min_price', 'country_cn'))
+                if filters[key]]
+    if len(selected) == 3:
+        return 's.min_cost', 's.margin'
+    if not selected:
+        return 'NULL', 'NULL'
+
+    min_price = selected[0] if len(selected) == 1 else f"least({', '.join(selected)})"
+    min_cost = f"({min_price} * l.quantity)"
+    return min_cost, f"(l.tender_price - {min_cost})"
+
+
+# ============================================================================
+# КУРСОРЫ
+# ============================================================================
+
+def encode_cursor(sort, lot):
+    """Непрозрачный токен позиции лота в сортировке (sort_key DESC, id DESC)"""
+    value = lot['sort_key']
+    if value is not None:
+        value = value.isoformat() if isinstance(value, datetime) else str(value)
+    payload = json.dumps([sort, value, lot['id']], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(sort, token):
+    """
+    (sort_key, id) из токена; sort_key None - у лота нет значения (created_at
+    IS NULL). InvalidCursor, если токен не наш или от другой сортировки.
+    """
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        token_sort, value, lot_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if token_sort != sort:
+            raise ValueError(token_sort)
+        if value is not None:
+            value = datetime.fromisoformat(value) if sort == 'newest' else Decimal(value)
+        return value, int(lot_id)
+    except (ValueError, TypeError, ArithmeticError) as e:
+        raise InvalidCursor(f'Некорректный курсор: {token!r}') from e
+
+
+def keyset_condition(sort_key, sort_params, value, lot_id, forward):
+    """
+    Условие строк после позиции (value, lot_id) - forward - или перед ней в
+    порядке sort_key DESC, id DESC и его параметры (sort_params - параметры
+    выражения sort_key). NULL в DESC идут первыми (так же их хранит индекс),
+    а сравнение строк с NULL дает NULL, поэтому лоты без значения
+    обрабатываются отдельно.
+    """
+    if value is None:
+        if forward:
+            return (f"(({sort_key} IS NULL AND l.id < %s) OR {sort_key} IS NOT NULL)",
+                    sort_params + [lot_id] + sort_params)
+        return f"({sort_key} IS NULL AND l.id > %s)", sort_params + [lot_id]
+    if forward:
+        return f"({sort_key}, l.id) < (%s, %s)", sort_params + [value, lot_id]
+    return (f"(({sort_key}, l.id) > (%s, %s) OR {sort_key} IS NULL)",
+            sort_params + [value, lot_id] + sort_params)
+
+
+# ============================================================================
+# СТРАНИЦА
+# ============================================================================
+
+PAGE_SQL = """
+    SELECT * FROM (
+        SELECT l.*, {sort_key} as sort_key,
+               s.products_count, s.min_price, s.max_price, s.median_price,
+               s.kz_count, s.ru_count, s.cn_count, s.min_cost, s.margin,
+               a.best_price, a.best_country, a.est_cost, a.est_margin, a.margin_pct
+        FROM lots l
+        LEFT JOIN lot_summaries s ON s.lot_number = l.lot_number
+        LEFT JOIN lot_analytics a ON a.lot_number = l.lot_number
+        WHERE {where}
+        ORDER BY sort_key {order}, l.id {order}
+        LIMIT %s
+    ) l
+    ORDER BY l.sort_key DESC, l.id DESC
+"""
+
+
+def fetch_page(cursor, filters, after=None, before=None, per_page=PER_PAGE):
+    """
+    Страница лотов после токена after (вперед) или перед токеном before (назад).
+
+    С поиском лоты идут по релевантности, иначе (или при sort=newest) -
+    от новых к старым; при sort=margin - по оценке маржи из lot_analytics.
+    Возвращает dict: lots, next_cursor, prev_cursor (None, если дальше
+    некуда). Курсор должен быть RealDictCursor.
+    """
+    where_sql, params = build_where(filters)
+
+    search = lot_search.build_search(filters['search']) if filters['search'] else None
+    if filters.get('sort') == 'margin':
+        sort, sort_key, sort_params = 'margin', 'a.est_margin', []
+    elif search and filters.get('sort') != 'newest':
+        sort, sort_key, sort_params = 'relevance', search[2], search[3]
+    else:
+        sort, sort_key, sort_params = 'newest', 'l.created_at', []
+
+    if before or after:
+        value, lot_id = decode_cursor(sort, before or after)
+        condition, condition_params = keyset_condition(sort_key, sort_params, value, lot_id,
+                                                       forward=not before)
+        where_sql += f" AND {condition}"
+        params = params + condition_params
+    order = 'ASC' if before else 'DESC'
+
+    # Берем на одну строку больше, чтобы узнать, есть ли следующая страница
+    cursor.execute(PAGE_SQL.format(sort_key=sort_key, where=where_sql, order=order),
+                   sort_params + params + [per_page + 1])
+    lots = cursor.fetchall()
+
+    has_more = len(lots) > per_page
+    if before:
+        # Лишняя строка - самая "верхняя", она в начале
+        if has_more:
+            lots = lots[1:]
+        has_prev, has_next = has_more, True
+    else:
+        lots = lots[:per_page]
+        has_prev, has_next = bool(after), has_more
+
+    page = {
+        'lots': lots,
+        'next_cursor': encode_cursor(sort, lots[-1]) if lots and has_next else None,
+        'prev_cursor': encode_cursor(sort, lots[0]) if lots and has_prev else None,
+    }
+    for lot in lots:
+        lot.pop('sort_key', None)
+        lot.pop('search_vector', None)
+    return page
+
+
+# ============================================================================
+# ОБЩЕЕ КОЛИЧЕСТВО
+# ============================================================================
+
+_count_cache = {}
+_count_lock = threading.Lock()
+
+
+def count_lots(cursor, filters, mode=None):
+    """
+    Количество лотов под фильтрами: (total, is_estimate).
+
+    total = None в режиме none.
+    """
+    mode = mode or COUNT_MODE
+    where_sql, params = build_where(filters)
+    sql = f"""SELECT COUNT(*) as total FROM lots l
+        LEFT JOIN lot_summaries s ON s.lot_number = l.lot_number
+        LEFT JOIN lot_analytics a ON a.lot_number = l.lot_number
+        WHERE {where_sql}"""
+
+    if mode == 'none':
+        return None, False
+
+    if mode == 'estimate':
+        cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+        plan = cursor.fetchone()
+        plan = plan['QUERY PLAN'] if isinstance(plan, dict) else plan[0]
+        # Оценка для входа агрегата - строки, которые он посчитал бы
+        node = plan[0]['Plan']
+        rows = node['Plans'][0]['Plan Rows'] if node.get('Plans') else node['Plan Rows']
+        return int(rows), True
+
+    if mode == 'cached':
+        key = (where_sql, repr(params))
+        now = time.monotonic()
+        with _count_lock:
+            hit = _count_cache.get(key)
+        if hit and hit[1] > now:
+            return hit[0], False
+
+    cursor.execute(sql, params)
+    total = cursor.fetchone()['total']
+
+    if mode == 'cached':
+        with _count_lock:
+            if len(_count_cache) > 1000:
+                _count_cache.clear()
+            _count_cache[key] = (total, now + COUNT_TTL)
+    return total, False
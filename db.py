@@ -0,0 +1,631 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TenderFinder Commercial - Пул подключений к PostgreSQL
+
+Один пул на процесс: создается лениво при первом обращении и пересоздается
+после fork (gunicorn --preload), поэтому воркеры никогда не делят сокеты.
+Здесь же - фоновые слушатели LISTEN/NOTIFY (тоже по одному на процесс),
+отмена команд отключившихся клиентов, предохранитель от медленной или
+недоступной базы и поддержка воркеров gevent (gunicorn -k gevent).
+"""
+
+import os
+import select
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+import instrumentation
+
+
+class PoolTimeout(Exception):
+    """Не удалось получить подключение за отведенное время"""
+
+
+class CircuitOpen(Exception):
+    """Предохранитель разомкнут: база недавно не отвечала, запрос не отправлялся"""
+
+
+class ConnectionPool:
+    """
+    Потокобезопасный пул подключений psycopg2.
+
+    connect - фабрика подключений (по умолчанию psycopg2.connect(dsn) с
+    connect_timeout секунд на подключение), ее можно подменить заглушкой в
+    тестах. Подключение и проверка SELECT 1 выполняются вне блокировки пула:
+    медленный сервер задерживает только того, кто ждет это подключение.
+    """
+
+    def __init__(self, dsn=None, minconn=1, maxconn=10, timeout=5.0,
+                 healthcheck_interval=30.0, max_lifetime=3600.0, connect=None,
+                 connect_timeout=10):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError('Некорректные размеры пула: min=%s, max=%s' % (minconn, maxconn))
+
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.healthcheck_interval = healthcheck_interval
+        self.max_lifetime = max_lifetime
+        self._connect = connect or (lambda: psycopg2.connect(dsn, connect_timeout=connect_timeout))
+
+        self._cond = threading.Condition()
+        self._idle = []          # [(conn, created_at, returned_at)]
+        self._created = {}       # id(conn) -> created_at
+        self._reserved = 0       # слоты под подключения, которые сейчас открываются
+        self._timeouts = {}      # id(conn) -> statement_timeout, мс (нет - значение сервера)
+        self._pid = os.getpid()
+        self._closed = False
+
+        self._stats = {
+            'acquired': 0,
+            'released': 0,
+            'created': 0,
+            'discarded': 0,
+            'timeouts': 0,
+            'healthcheck_failures': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+        }
+
+        for _ in range(minconn):
+            conn = self._new_connection()
+            self._idle.append((conn, self._created[id(conn)], time.monotonic()))
+
+    # ------------------------------------------------------------------
+    # Внутренние помощники
+    # ------------------------------------------------------------------
+
+    def _new_connection(self):
+        conn = self._connect()
+        self._created[id(conn)] = time.monotonic()
+        self._stats['created'] += 1
+        return conn
+
+    def _discard(self, conn):
+        self._created.pop(id(conn), None)
+        self._timeouts.pop(id(conn), None)
+        self._stats['discarded'] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn, created_at, returned_at):
+        """Проверка простаивавшего подключения перед выдачей"""
+        now = time.monotonic()
+        if getattr(conn, 'closed', 0):
+            return False
+        if self.max_lifetime and now - created_at > self.max_lifetime:
+            return False
+        if self.healthcheck_interval is not None and now - returned_at >= self.healthcheck_interval:
+            try:
+                cursor = conn.cursor()
+                cursor.execute('SELECT 1')
+                cursor.fetchone()
+                cursor.close()
+                conn.rollback()
+            except Exception:
+                with self._cond:
+                    self._stats['healthcheck_failures'] += 1
+                return False
+        return True
+
+    def _check_fork(self):
+        """После fork унаследованные сокеты принадлежат родителю - забываем их"""
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._idle = []
+            self._created = {}
+            self._timeouts = {}
+            self._reserved = 0
+            self._cond = threading.Condition()
+
+    # ------------------------------------------------------------------
+    # Публичный API
+    # ------------------------------------------------------------------
+
+    def getconn(self, timeout=None, statement_timeout=None):
+        """
+        Взять подключение из пула (ждет не дольше timeout секунд).
+
+        statement_timeout - предел времени одной команды, мс (0 - без
+        предела, None - значение сервера по умолчанию); выставляется, только
+        если подключение было настроено иначе.
+        """
+        conn = self._acquire(timeout)
+        try:
+            self._set_statement_timeout(conn, statement_timeout)
+        except Exception:
+            self.putconn(conn, discard=True)
+            raise
+        return conn
+
+    def _acquire(self, timeout):
+        self._check_fork()
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+
+        while True:
+            with self._cond:
+                idle = self._reserve(deadline, timeout)
+
+            if idle is not None:
+                # Простаивавшее подключение проверяется вне блокировки
+                conn, created_at, returned_at = idle
+                healthy = self._is_healthy(conn, created_at, returned_at)
+                with self._cond:
+                    if healthy:
+                        return self._checked_out(conn, started)
+                    self._discard(conn)
+                    self._cond.notify()
+                continue
+
+            # Слот зарезервирован: подключаемся вне блокировки
+            try:
+                conn = self._connect()
+            except BaseException:
+                with self._cond:
+                    self._reserved -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._reserved -= 1
+                self._created[id(conn)] = time.monotonic()
+                self._stats['created'] += 1
+                if self._closed:
+                    self._discard(conn)
+                    raise PoolTimeout('Пул подключений закрыт')
+                return self._checked_out(conn, started)
+
+    def _reserve(self, deadline, timeout):
+        """
+        Под блокировкой: простаивающее подключение (conn, created_at,
+        returned_at) или None - зарезервирован слот под новое.
+        """
+        while True:
+            if self._closed:
+                raise PoolTimeout('Пул подключений закрыт')
+            if self._idle:
+                return self._idle.pop()
+            if len(self._created) + self._reserved < self.maxconn:
+                self._reserved += 1
+                return None
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._stats['timeouts'] += 1
+                raise PoolTimeout(
+                    'Нет свободных подключений за %.1f с (max=%s)' % (timeout, self.maxconn))
+            self._cond.wait(remaining)
+
+    def _set_statement_timeout(self, conn, statement_timeout):
+        current = self._timeouts.get(id(conn))
+        if current == statement_timeout:
+            return
+        # SET в транзакции откатился бы вместе с ней
+        autocommit = conn.autocommit
+        conn.autocommit = True
+        try:
+            cursor = conn.cursor()
+            if statement_timeout is None:
+                cursor.execute('RESET statement_timeout')
+            else:
+                cursor.execute('SET statement_timeout = %s', [int(statement_timeout)])
+            cursor.close()
+        finally:
+            conn.autocommit = autocommit
+        if statement_timeout is None:
+            self._timeouts.pop(id(conn), None)
+        else:
+            self._timeouts[id(conn)] = statement_timeout
+
+    def _checked_out(self, conn, started):
+        waited = time.monotonic() - started
+        self._stats['acquired'] += 1
+        self._stats['wait_time_total'] += waited
+        self._stats['wait_time_max'] = max(self._stats['wait_time_max'], waited)
+        return conn
+
+    def putconn(self, conn, discard=False):
+        """Вернуть подключение в пул; сломанные и грязные закрываются"""
+        if self._pid != os.getpid():
+            return
+
+        with self._cond:
+            self._stats['released'] += 1
+            if id(conn) not in self._created:
+                return
+
+            if not discard and not getattr(conn, 'closed', 0):
+                try:
+                    conn.rollback()
+                except Exception:
+                    discard = True
+            else:
+                discard = True
+
+            if discard or self._closed:
+                self._discard(conn)
+            else:
+                self._idle.append((conn, self._created[id(conn)], time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None, statement_timeout=None):
+        """with pool.connection() as conn: ... - подключение вернется даже при исключении"""
+        conn = self.getconn(timeout, statement_timeout)
+        try:
+            yield conn
+        except BaseException:
+            # В том числе GeneratorExit - клиент бросил потоковый ответ
+            self.putconn(conn, discard=bool(getattr(conn, 'closed', 0)))
+            raise
+        else:
+            self.putconn(conn)
+
+    def closeall(self):
+        """Закрыть все простаивающие подключения и запретить новые"""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _, _ = self._idle.pop()
+                self._discard(conn)
+            self._cond.notify_all()
+
+    def stats(self):
+        """Метрики пула для подбора min/max"""
+        with self._cond:
+            total = len(self._created)
+            idle = len(self._idle)
+            connecting = self._reserved
+            stats = dict(self._stats)
+        acquired = stats['acquired'] or 1
+        stats.update({
+            'pid': self._pid,
+            'min': self.minconn,
+            'max': self.maxconn,
+            'size': total,
+            'idle': idle,
+            'in_use': total - idle,
+            'connecting': connecting,
+            'wait_time_avg': stats['wait_time_total'] / acquired,
+        })
+        return stats
+
+
+# ============================================================================
+# ПУЛ ПРОЦЕССА
+# ============================================================================
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Пул текущего процесса (None, если DATABASE_URL не задан)"""
+    global _pool
+    dsn = os.getenv('DATABASE_URL')
+    if not dsn:
+        return None
+
+    if _pool is None or _pool._pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool._pid != os.getpid():
+                make_green()
+                connect_timeout = int(os.getenv('DB_CONNECT_TIMEOUT', 5))
+                _pool = ConnectionPool(
+                    dsn,
+                    minconn=int(os.getenv('DB_POOL_MIN', 1)),
+                    maxconn=int(os.getenv('DB_POOL_MAX', 10)),
+                    timeout=float(os.getenv('DB_POOL_TIMEOUT', 5)),
+                    healthcheck_interval=float(os.getenv('DB_POOL_HEALTHCHECK', 30)),
+                    max_lifetime=float(os.getenv('DB_POOL_MAX_LIFETIME', 3600)),
+                    connect=instrumentation.pg_connect(dsn, connect_timeout=connect_timeout),
+                    connect_timeout=connect_timeout,
+                )
+    return _pool
+
+
+def set_pool(pool):
+    """Подменить пул процесса (тесты, заглушки)"""
+    global _pool
+    _pool = pool
+
+
+# ============================================================================
+# LISTEN / NOTIFY
+# ============================================================================
+
+class Listener(threading.Thread):
+    """
+    Фоновый LISTEN на канал PostgreSQL: callback(payload) на каждый NOTIFY.
+
+    Держит отдельное подключение (не из пула) и переподключается после
+    ошибок; on_reconnect() вызывается после каждого (пере)подключения -
+    уведомления за время разрыва потеряны.
+    """
+
+    def __init__(self, dsn, channel, callback, on_reconnect=None, connect=None):
+        super().__init__(name=f'listen:{channel}', daemon=True)
+        self.dsn = dsn
+        self.channel = channel
+        self.callback = callback
+        self.on_reconnect = on_reconnect
+        self._connect = connect or (lambda: psycopg2.connect(dsn))
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        delay = 1.0
+        while not self._stop_event.is_set():
+            conn = None
+            try:
+                conn = self._connect()
+                conn.autocommit = True
+                cursor = conn.cursor()
+                cursor.execute(f'LISTEN {self.channel}')
+                cursor.close()
+                if self.on_reconnect:
+                    self.on_reconnect()
+                delay = 1.0
+
+                while not self._stop_event.is_set():
+                    if select.select([conn], [], [], 5.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self.callback(conn.notifies.pop(0).payload)
+            except Exception:
+                self._stop_event.wait(delay)
+                delay = min(delay * 2, 60.0)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+
+_listeners = {}
+_listeners_lock = threading.Lock()
+
+
+def listen(channel, callback, on_reconnect=None):
+    """Запустить (один раз на процесс) слушателя канала; None без DATABASE_URL"""
+    dsn = os.getenv('DATABASE_URL')
+    if not dsn:
+        return None
+
+    key = (os.getpid(), channel)
+    with _listeners_lock:
+        listener = _listeners.get(key)
+        if listener is None or not listener.is_alive():
+            make_green()
+            listener = Listener(dsn, channel, callback, on_reconnect)
+            listener.start()
+            _listeners[key] = listener
+    return listener
+
+
+# ============================================================================
+# ОТМЕНА КОМАНД
+# ============================================================================
+
+class Watch:
+    """Наблюдение за подключением запроса (QueryWatchdog.watch)"""
+
+    def __init__(self, conn, is_gone):
+        self.conn = conn
+        self.is_gone = is_gone
+        self.cancelled = False
+
+
+class QueryWatchdog(threading.Thread):
+    """
+    Отмена команд, которые больше некому отдать.
+
+    Раз в interval секунд опрашивает is_gone() наблюдаемых подключений
+    (обычно - закрыл ли клиент HTTP-соединение) и для сработавших вызывает
+    conn.cancel(): PostgreSQL прерывает текущую команду (QueryCanceled), и
+    воркер освобождается, не дожидаясь statement_timeout.
+    """
+
+    def __init__(self, interval=0.5):
+        super().__init__(name='query-watchdog', daemon=True)
+        self.interval = interval
+        self.cancelled = 0
+        self._watches = set()
+        self._lock = threading.Lock()
+
+    def watch(self, conn, is_gone):
+        watch = Watch(conn, is_gone)
+        with self._lock:
+            self._watches.add(watch)
+        return watch
+
+    def unwatch(self, watch):
+        with self._lock:
+            self._watches.discard(watch)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                watches = list(self._watches)
+            for watch in watches:
+                try:
+                    gone = watch.is_gone()
+                except Exception:
+                    gone = False
+                if not gone:
+                    continue
+                self.unwatch(watch)
+                watch.cancelled = True
+                self.cancelled += 1
+                try:
+                    watch.conn.cancel()
+                except Exception:
+                    pass
+
+
+_watchdog = None
+_watchdog_lock = threading.Lock()
+
+
+def get_watchdog():
+    """Сторож отмены команд текущего процесса (запускается при первом обращении)"""
+    global _watchdog
+    if _watchdog is None or _watchdog.pid != os.getpid():
+        with _watchdog_lock:
+            if _watchdog is None or _watchdog.pid != os.getpid():
+                _watchdog = QueryWatchdog(float(os.getenv('DB_CANCEL_POLL_INTERVAL', 0.5)))
+                _watchdog.pid = os.getpid()
+                _watchdog.start()
+    return _watchdog
+
+
+# ============================================================================
+# ПРЕДОХРАНИТЕЛЬ
+# ============================================================================
+
+class CircuitBreaker:
+    """
+    Предохранитель тяжелых запросов.
+
+    После threshold сбоев подряд (потеря подключения, пустой пул; таймауты
+    отдельных команд сбоями не считаются) размыкается на cooldown секунд:
+    allow() возвращает False, и маршруты сразу отдают запасной ответ, не
+    занимая воркер ожиданием базы. Затем пропускает один пробный запрос:
+    успех замыкает цепь, сбой - снова размыкает. Любой успех обнуляет
+    счетчик сбоев.
+    """
+
+    def __init__(self, threshold=5, cooldown=30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._state = 'closed'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_at = None
+        self._stats = {'failures': 0, 'opened': 0, 'rejected': 0}
+
+    def allow(self):
+        """Можно ли сейчас идти в базу"""
+        with self._lock:
+            if self._state == 'closed':
+                return True
+            now = time.monotonic()
+            # Пробный запрос - один на cooldown (вдруг он не отчитался)
+            if now - self._opened_at >= self.cooldown and (
+                    self._trial_at is None or now - self._trial_at >= self.cooldown):
+                self._state = 'half_open'
+                self._trial_at = now
+                return True
+            self._stats['rejected'] += 1
+            return False
+
+    def success(self):
+        with self._lock:
+            self._state = 'closed'
+            self._failures = 0
+            self._trial_at = None
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            self._stats['failures'] += 1
+            if self._state == 'half_open' or (self._state == 'closed' and self._failures >= self.threshold):
+                self._state = 'open'
+                self._opened_at = time.monotonic()
+                self._trial_at = None
+                self._stats['opened'] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, state=self._state, consecutive_failures=self._failures,
+                        threshold=self.threshold, cooldown=self.cooldown)
+
+
+_breaker = None
+_breaker_lock = threading.Lock()
+
+
+def get_breaker():
+    """Предохранитель текущего процесса"""
+    global _breaker
+    if _breaker is None:
+        with _breaker_lock:
+            if _breaker is None:
+                _breaker = CircuitBreaker(
+                    threshold=int(os.getenv('DB_BREAKER_THRESHOLD', 5)),
+                    cooldown=float(os.getenv('DB_BREAKER_COOLDOWN', 30)),
+                )
+    return _breaker
+
+
+def set_breaker(breaker):
+    """Подменить предохранитель процесса (тесты)"""
+    global _breaker
+    _breaker = breaker
+
+
+# ============================================================================
+# GEVENT
+# ============================================================================
+
+def is_green():
+    """Процесс работает под gevent с подмененными модулями (gunicorn -k gevent)"""
+    if 'gevent' not in sys.modules:
+        return False
+    from gevent import monkey
+    return monkey.is_module_patched('socket')
+
+
+def _gevent_wait(conn, timeout=None):
+    """Ожидание ответа сервера, уступающее управление другим гринлетам"""
+    from gevent.socket import wait_read, wait_write
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError('Неожиданный результат poll: %r' % state)
+
+
+def make_green():
+    """
+    Под gevent - неблокирующий psycopg2 (wait callback); иначе ничего.
+
+    В этом режиме не работает COPY, поэтому загрузчики данных запускаются
+    отдельно, а не в веб-воркерах.
+    """
+    if is_green() and extensions.get_wait_callback() is None:
+        extensions.set_wait_callback(_gevent_wait)
+
+
+def thread_local():
+    """
+    threading.local() настоящего потока ОС.
+
+    Под gevent обычный threading.local() принадлежит гринлету, то есть
+    запросу, и "постоянное" подключение открывалось бы заново на каждый запрос.
+    """
+    if is_green():
+        from gevent import monkey
+        return monkey.get_original('threading', 'local')()
+    return threading.local()
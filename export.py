@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TenderFinder Commercial - Выгрузка каталога (CSV / JSONL / XLSX)
+
+Все лоты под фильтрами каталога вместе с их товарами - строка на товар
+(лот без товаров - одна строка с пустыми полями товара). Лоты читаются
+именованным (серверным) курсором в порядке индекса idx_lots_created_at_id
+пачками по ITERSIZE, товары - отдельным запросом на пачку лотов: общий
+JOIN пришлось бы сортировать целиком до первой строки. Строки сразу
+отдаются клиенту, поэтому память не зависит от размера выгрузки.
+
+XLSX пишется через необязательный пакет xlsxwriter во временный файл
+(в режиме constant_memory) и отдается после записи; лист Excel вмещает
+не больше XLSX_MAX_ROWS строк, остальное отбрасывается.
+"""
+
+import csv
+import io
+import json
+import os
+import tempfile
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+
+import catalog_query
+
+ITERSIZE = int(os.getenv('EXPORT_ITERSIZE', 2000))
+# Выгрузка читает весь отбор - свой, более длинный statement_timeout
+STATEMENT_TIMEOUT_MS = int(os.getenv('EXPORT_STATEMENT_TIMEOUT_MS', 120000))
+
+# (колонка, заголовок для CSV/XLSX)
+COLUMNS = [
+    ('lot_number', 'Номер лота'),
+    ('original_name', 'Наименование'),
+    ('simplified_name', 'Краткое наименование'),
+    ('customer', 'Заказчик'),
+    ('category', 'Категория'),
+    ('quantity', 'Количество'),
+    ('unit', 'Ед. изм.'),
+    ('tender_price', 'Цена тендера'),
+    ('created_at', 'Добавлен'),
+    ('marketplace', 'Маркетплейс'),
+    ('country', 'Страна'),
+    ('product_title', 'Товар'),
+    ('product_price', 'Цена (текст)'),
+    ('price', 'Цена'),
+    ('currency', 'Валюта'),
+    ('product_url', 'Ссылка'),
+]
+
+FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'jsonl': ('application/x-ndjson; charset=utf-8', 'jsonl'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+}
+
+# Лоты - в порядке индекса (created_at DESC, id DESC), без сортировки
+LOTS_SQL = """
+    SELECT l.lot_number, l.original_name, l.simplified_name, l.customer, l.category,
+           l.quantity, l.unit, l.tender_price, l.created_at
+    FROM lots l
+    LEFT JOIN lot_summaries s ON s.lot_number = l.lot_number
+    LEFT JOIN lot_analytics a ON a.lot_number = l.lot_number
+    WHERE {where}
+    ORDER BY l.created_at DESC, l.id DESC
+"""
+
+# Товары пачки лотов; при фильтре по странам - только товары этих стран
+PRODUCTS_SQL = """
+    SELECT sr.lot_number, sr.marketplace, sr.country, sr.product_title, sr.product_price,
+           sr.price, sr.currency, sr.product_url
+    FROM search_results sr
+    WHERE sr.lot_number = ANY(%s){countries}
+    ORDER BY sr.lot_number, sr.id
+"""
+
+# Поля товара у лота без товаров
+NO_PRODUCT = (None,) * 7
+
+# Строк в одном фрагменте ответа
+CHUNK_ROWS = 500
+
+# Предел строк листа Excel (без заголовка)
+XLSX_MAX_ROWS = 1048575
+
+
+def iter_rows(conn, filters, itersize=ITERSIZE):
+    """Кортежи строк выгрузки в порядке COLUMNS (новые лоты сверху)"""
+    where_sql, params = catalog_query.build_where(filters)
+    countries = catalog_query.selected_countries(filters)
+    products_sql = PRODUCTS_SQL.format(
+        countries=' AND sr.country = ANY(%s)' if countries is not None else '')
+    lots_cursor = conn.cursor(name=f'export_{uuid.uuid4().hex}')
+    products_cursor = conn.cursor()
+    try:
+        lots_cursor.execute(LOTS_SQL.format(where=where_sql), params)
+        while True:
+            lots = lots_cursor.fetchmany(itersize)
+            if not lots:
+                break
+            products_params = [[lot[0] for lot in lots]]
+            if countries is not None:
+                products_params.append(countries)
+            products_cursor.execute(products_sql, products_params)
+            products = {}
+            for row in products_cursor:
+                products.setdefault(row[0], []).append(row[1:])
+            for lot in lots:
+                for product in products.get(lot[0]) or [NO_PRODUCT]:
+                    yield lot + product
+    finally:
+        products_cursor.close()
+        lots_cursor.close()
+        conn.rollback()
+
+
+def _plain(value):
+    if isinstance(value, Decimal):
+        return float(value) if value % 1 else int(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def csv_chunks(rows):
+    """CSV с BOM (чтобы Excel узнал UTF-8) фрагментами по CHUNK_ROWS строк"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow([title for _, title in COLUMNS])
+    for i, row in enumerate(rows, 1):
+        writer.writerow([_plain(value) for value in row])
+        if i % CHUNK_ROWS == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def jsonl_chunks(rows):
+    """JSON Lines: объект на строку, ключи - имена колонок"""
+    keys = [key for key, _ in COLUMNS]
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(keys, map(_plain, row))), ensure_ascii=False))
+        if len(lines) == CHUNK_ROWS:
+            yield ('\n'.join(lines) + '\n').encode('utf-8')
+            lines = []
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def xlsx_available():
+    try:
+        import xlsxwriter  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def xlsx_chunks(rows, chunk_size=64 * 1024):
+    """
+    XLSX: запись во временный файл (constant_memory), затем сам файл.
+
+    Ссылки пишутся текстом: гиперссылки xlsxwriter держит в памяти до
+    конца листа, а после 65 530 на лист пропускает с предупреждением на
+    каждую строку.
+    """
+    import xlsxwriter
+
+    with tempfile.TemporaryFile() as f:
+        workbook = xlsxwriter.Workbook(f, {'constant_memory': True, 'in_memory': False,
+                                           'strings_to_urls': False})
+        sheet = workbook.add_worksheet('Лоты')
+        sheet.write_row(0, 0, [title for _, title in COLUMNS])
+        for i, row in enumerate(rows, 1):
+            if i > XLSX_MAX_ROWS:
+                break
+            sheet.write_row(i, 0, [_plain(value) for value in row])
+        workbook.close()
+
+        f.seek(0)
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+WRITERS = {'csv': csv_chunks, 'jsonl': jsonl_chunks, 'xlsx': xlsx_chunks}
+
+
+def stream(pool, filters, fmt):
+    """
+    Фрагменты выгрузки в формате fmt.
+
+    Подключение берется из пула на время выгрузки, а не на время запроса:
+    генератор дочитывается уже после обработчика маршрута.
+    """
+    with pool.connection(statement_timeout=STATEMENT_TIMEOUT_MS) as conn:
+        yield from WRITERS[fmt](iter_rows(conn, filters))
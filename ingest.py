@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TenderFinder Commercial - Загрузка лотов и товаров
+
+CSV (с заголовком) или JSONL читается потоком, пачками по batch_size
+строк: COPY во временную таблицу, затем upsert в lots / search_results.
+Лоты сопоставляются по lot_number, товары - по (lot_number, product_url);
+повторы внутри пачки схлопываются (побеждает последняя строка), строки
+без изменений не перезаписываются. Цены товаров разбираются здесь же
+(prices.py), агрегаты lot_summaries и сброс кеша страниц лотов делают
+триггеры (migrations/004, 006, 007). Нужна migrations/008_ingest.sql.
+
+    python ingest.py lots lots.csv
+    python ingest.py results results.jsonl [--batch-size 10000]
+
+Колонки, которых нет в файле, у существующих строк не меняются; набор
+колонок у всех записей должен быть один (в JSONL - как у первой записи).
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+import db
+import marketplaces
+import prices
+
+# Вид -> (таблица, колонки, которые можно загрузить, ключ)
+KINDS = {
+    'lots': ('lots', ['lot_number', 'original_name', 'simplified_name', 'customer', 'category',
+                      'quantity', 'unit', 'tender_price', 'created_at'], ['lot_number']),
+    'results': ('search_results', ['lot_number', 'marketplace', 'product_title',
+                                   'product_price', 'product_url'], ['lot_number', 'product_url']),
+}
+
+# Колонки товаров, которые считает сам загрузчик
+PRICE_COLUMNS = ['price', 'currency', 'price_normalized_at']
+
+
+class IngestError(ValueError):
+    """Файл нельзя загрузить (формат, колонки, значения)"""
+
+
+# ============================================================================
+# ЧТЕНИЕ
+# ============================================================================
+
+def detect_format(filename):
+    """csv / jsonl по расширению файла"""
+    name = (filename or '').lower()
+    if name.endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    return 'csv'
+
+
+def _lines(stream):
+    """(номер, строка) бинарного потока в UTF-8; BOM в начале пропускается"""
+    for number, line in enumerate(stream, 1):
+        try:
+            yield number, line.decode('utf-8-sig' if number == 1 else 'utf-8')
+        except UnicodeDecodeError as e:
+            raise IngestError(f'Строка {number}: текст не в кодировке UTF-8') from e
+
+
+def read_records(stream, fmt):
+    """
+    Записи (dict) из бинарного потока. Ошибки кодировки и разбора -
+    IngestError с номером строки файла.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(line for _, line in _lines(stream))
+        try:
+            for record in reader:
+                # Лишние поля DictReader кладет под ключ None, недостающие - None
+                if None in record or None in record.values():
+                    raise IngestError(f'Строка {reader.line_num}: '
+                                      f'число полей не совпадает с заголовком')
+                yield record
+        except csv.Error as e:
+            # DictReader.line_num обновляется только после удачной записи
+            raise IngestError(f'Строка {reader.reader.line_num}: {e}') from e
+    elif fmt == 'jsonl':
+        for number, line in _lines(stream):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise IngestError(f'Строка {number}: некорректный JSON ({e})') from e
+            if not isinstance(record, dict):
+                raise IngestError(f'Строка {number}: ожидался объект JSON')
+            yield record
+    else:
+        raise IngestError(f'Неизвестный формат: {fmt}')
+
+
+# ============================================================================
+# ЗАГРУЗКА
+# ============================================================================
+
+def _value(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _staging(cursor, table, columns):
+    staging = f'ingest_{table}'
+    cursor.execute(f'DROP TABLE IF EXISTS {staging}')
+    # Типы колонок - как в целевой таблице: COPY сам проверит значения
+    cursor.execute(f"""
+        CREATE TEMP TABLE {staging} AS
+        SELECT {', '.join(columns)} FROM {table} LIMIT 0
+    """)
+    cursor.execute(f'ALTER TABLE {staging} ADD COLUMN ingest_ord BIGSERIAL')
+    return staging
+
+
+def _copy(cursor, staging, columns, rows):
+    """Строки во временную таблицу: COPY, под gevent - INSERT (COPY там недоступен)"""
+    if db.is_green():
+        execute_values(cursor, f"INSERT INTO {staging} ({', '.join(columns)}) VALUES %s",
+                       rows, page_size=1000)
+        return
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor.copy_expert(
+        f"COPY {staging} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def _upsert_sql(table, staging, columns, key):
+    changed = [column for column in columns if column not in key]
+    # Время разбора цены новое у каждой загрузки - само по себе не изменение
+    compared = [column for column in changed if column != 'price_normalized_at']
+    conflict = (f"DO UPDATE SET {', '.join(f'{c} = EXCLUDED.{c}' for c in changed)} "
+                f"WHERE ({', '.join(f't.{c}' for c in compared)}) "
+                f"IS DISTINCT FROM ({', '.join(f'EXCLUDED.{c}' for c in compared)})"
+                if changed else 'DO NOTHING')
+    # Повторы ключа внутри пачки схлопывает DISTINCT ON; source считается
+    # отдельно, чтобы отличить схлопнутые повторы от неизмененных строк
+    return f"""
+        WITH source AS (
+            SELECT DISTINCT ON ({', '.join(key)}) {', '.join(columns)}
+            FROM {staging}
+            ORDER BY {', '.join(key)}, ingest_ord DESC
+        ), upserted AS (
+            INSERT INTO {table} AS t ({', '.join(columns)})
+            SELECT {', '.join(columns)} FROM source
+            ON CONFLICT ({', '.join(key)}) {conflict}
+            RETURNING (xmax = 0) as inserted
+        )
+        SELECT (SELECT COUNT(*) FROM source),
+               COUNT(*) FILTER (WHERE inserted), COUNT(*) FILTER (WHERE NOT inserted)
+        FROM upserted
+    """
+
+
+def prepare(kind, record, source_columns, key_positions, normalized_at):
+    """
+    Строка для временной таблицы: колонки файла и, у товаров, разобранная
+    цена. None, если в записи нет ключа.
+    """
+    row = [_value(record.get(column)) for column in source_columns]
+    if any(row[position] is None for position in key_positions):
+        return None
+    if kind == 'results':
+        country = marketplaces.classify(_value(record.get('marketplace')))
+        price, currency = prices.parse_price(_value(record.get('product_price')),
+                                             prices.COUNTRY_CURRENCIES.get(country))
+        row.extend([price, currency, normalized_at])
+    return row
+
+
+def ingest(conn, kind, records, batch_size=10000, progress=None):
+    """
+    Загрузить записи вида kind ('lots' / 'results').
+
+    Каждая пачка - отдельная транзакция: прерванную загрузку можно
+    запустить заново. Возвращает dict со счетчиками строк: duplicates -
+    повторы ключа внутри одной пачки (загружена последняя из строк),
+    unchanged - строки, совпавшие с уже загруженными.
+    """
+    if kind not in KINDS:
+        raise IngestError(f'Неизвестный вид данных: {kind}')
+    table, allowed, key = KINDS[kind]
+
+    stats = {'rows': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0, 'duplicates': 0,
+             'skipped': 0}
+    started = time.monotonic()
+    records = iter(records)
+
+    first = next(records, None)
+    if first is None:
+        return dict(stats, elapsed=0.0)
+    source_columns = [column for column in allowed if column in first]
+    missing = [column for column in key if column not in source_columns]
+    if missing:
+        raise IngestError(f'Нет обязательных колонок: {", ".join(missing)}')
+    key_positions = [source_columns.index(column) for column in key]
+    expected = set(source_columns)
+    columns = source_columns + (PRICE_COLUMNS if kind == 'results' else [])
+
+    cursor = conn.cursor()
+    staging = _staging(cursor, table, columns)
+    upsert_sql = _upsert_sql(table, staging, columns, key)
+    conn.commit()
+
+    def flush(batch):
+        try:
+            cursor.execute(f'TRUNCATE {staging}')
+            _copy(cursor, staging, columns, batch)
+            cursor.execute(upsert_sql)
+            unique, inserted, updated = cursor.fetchone()
+            conn.commit()
+        except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+            conn.rollback()
+            raise IngestError(f'Строки {stats["rows"] + 1}-{stats["rows"] + len(batch)}: '
+                              f'{e.pgerror or e}'.strip()) from e
+        stats['rows'] += len(batch)
+        stats['inserted'] += inserted
+        stats['updated'] += updated
+        stats['unchanged'] += unique - inserted - updated
+        stats['duplicates'] += len(batch) - unique
+        if progress:
+            elapsed = time.monotonic() - started
+            progress(f'{stats["rows"]} строк, {stats["rows"] / elapsed if elapsed else 0:.0f} строк/с')
+
+    batch = []
+    normalized_at = datetime.now(timezone.utc).isoformat()
+    for number, record in enumerate(_chain(first, records), 1):
+        # Колонки, которой нет в записи, upsert присвоил бы NULL - поэтому
+        # набор колонок у всех записей один, как у первой
+        present = {column for column in allowed if column in record}
+        if present != expected:
+            raise IngestError(_columns_mismatch(number, expected, present))
+        row = prepare(kind, record, source_columns, key_positions, normalized_at)
+        if row is None:
+            stats['skipped'] += 1
+            continue
+        batch.append(row)
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+
+    cursor.execute(f'DROP TABLE IF EXISTS {staging}')
+    conn.commit()
+    cursor.close()
+    stats['elapsed'] = round(time.monotonic() - started, 3)
+    return stats
+
+
+def _columns_mismatch(number, expected, present):
+    details = []
+    for label, columns in (('нет', expected - present), ('лишние', present - expected)):
+        if columns:
+            details.append(f'{label}: {", ".join(sorted(columns))}')
+    return f'Запись {number}: колонки не совпадают с первой записью ({"; ".join(details)})'
+
+
+def _chain(first, rest):
+    yield first
+    yield from rest
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Загрузка лотов и товаров (CSV / JSONL)')
+    parser.add_argument('--dsn', default=os.getenv('DATABASE_URL'))
+    parser.add_argument('kind', choices=sorted(KINDS))
+    parser.add_argument('path', help="файл или '-' для stdin")
+    parser.add_argument('--format', choices=['csv', 'jsonl'])
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    if not args.dsn:
+        parser.error('укажите --dsn или DATABASE_URL')
+
+    fmt = args.format or detect_format(args.path)
+    conn = psycopg2.connect(args.dsn)
+    try:
+        if args.path == '-':
+            stream = sys.stdin.buffer
+        else:
+            stream = open(args.path, 'rb')
+        with stream:
+            stats = ingest(conn, args.kind, read_records(stream, fmt), args.batch_size, progress=print)
+        elapsed = stats['elapsed']
+        print(f'Готово за {elapsed:.1f} с ({stats["rows"] / elapsed if elapsed else 0:.0f} строк/с): '
+              f'добавлено {stats["inserted"]}, обновлено {stats["updated"]}, '
+              f'без изменений {stats["unchanged"]}, повторов в файле {stats["duplicates"]}, '
+              f'пропущено {stats["skipped"]}')
+        return 0
+    except IngestError as e:
+        print(f'Ошибка: {e}', file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
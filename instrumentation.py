@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TenderFinder Commercial - Профилирование запросов и метрики
+
+Включается переменной PROFILING=1. Тогда:
+
+- каждый SQL (psycopg2 и sqlite3) записывается с длительностью и числом строк;
+- время запроса раскладывается по фазам: postgres, sqlite, шаблон, python
+  (остальное) - в заголовке Server-Timing и в /api/profile (администратор);
+- запросы дольше SLOW_QUERY_MS пишутся в журнал tenderfinder.slow_query
+  вместе с планом (EXPLAIN / EXPLAIN QUERY PLAN);
+- /metrics дополнительно отдает гистограммы запросов и SQL.
+
+/metrics (формат Prometheus, по воркеру) есть всегда: счетчики сбоев
+запросов к базе (таймауты, отмены, потеря подключения) и запасных ответов,
+метрики пула и состояние предохранителя ведутся и без профилирования.
+Без METRICS_TOKEN /metrics отвечает только локальным запросам (сбор
+метрик на той же машине), с ним - по Authorization: Bearer <токен>.
+
+Выключенное профилирование ничего не подменяет: обычные подключения,
+никаких обработчиков запроса.
+"""
+
+import hmac
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2 import extensions
+
+ENABLED = os.getenv('PROFILING', '0') == '1'
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 200))
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', 100))
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# Без METRICS_TOKEN /metrics отвечает только на запросы с этих адресов
+LOCAL_ADDRESSES = ('127.0.0.1', '::1')
+
+# Границы корзин гистограмм, секунд
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Фазы запроса (Server-Timing)
+PHASES = ('postgres', 'sqlite', 'render', 'python')
+
+slow_log = logging.getLogger('tenderfinder.slow_query')
+
+
+# ============================================================================
+# МЕТРИКИ
+# ============================================================================
+
+class Histogram:
+    """Гистограмма Prometheus с метками"""
+
+    def __init__(self, name, help_text, labels, buckets=BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # значения меток -> [счетчики корзин..., сумма, количество]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted(self._series.items())
+            items = [(labels, list(series)) for labels, series in items]
+        for label_values, series in items:
+            labels = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.labels, label_values))
+            prefix = labels + ',' if labels else ''
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {series[-1]}')
+            lines.append(f'{self.name}_sum{{{labels}}} {series[-2]:.6f}')
+            lines.append(f'{self.name}_count{{{labels}}} {series[-1]}')
+        return lines
+
+
+class Counter:
+    """Счетчик Prometheus с метками"""
+
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            labels = ','.join(f'{name}="{_escape(v)}"' for name, v in zip(self.labels, label_values))
+            lines.append(f'{self.name}{{{labels}}} {value}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REQUEST_DURATION = Histogram('tenderfinder_request_duration_seconds',
+                             'Длительность HTTP-запроса', ('route', 'method'))
+REQUESTS = Counter('tenderfinder_requests_total', 'HTTP-запросы', ('route', 'method', 'status'))
+PHASE_DURATION = Histogram('tenderfinder_request_phase_seconds',
+                           'Время запроса по фазам', ('route', 'phase'))
+SQL_DURATION = Histogram('tenderfinder_sql_duration_seconds',
+                         'Длительность SQL-команды', ('db',))
+SLOW_QUERIES = Counter('tenderfinder_slow_queries_total',
+                       'SQL-команды дольше SLOW_QUERY_MS', ('db',))
+DB_FAILURES = Counter('tenderfinder_db_failures_total',
+                      'Сбои запросов к PostgreSQL (timeout, cancelled, connection, pool_timeout)',
+                      ('route', 'kind'))
+DEGRADED_RESPONSES = Counter('tenderfinder_degraded_responses_total',
+                             'Ответы запасным путем (stale, no_count, unavailable, stale_user, anonymous)', ('route', 'fallback'))
+
+
+# ============================================================================
+# ПРОФИЛЬ ЗАПРОСА
+# ============================================================================
+
+_local = threading.local()
+_profiles = deque(maxlen=PROFILE_KEEP)
+_profiles_lock = threading.Lock()
+
+
+def _current():
+    """Профиль текущего запроса (None вне запроса)"""
+    return getattr(_local, 'profile', None)
+
+
+def _record(db, sql, started, rows, explain=None):
+    """Записать выполненную команду в профиль запроса и метрики"""
+    duration = time.perf_counter() - started
+    SQL_DURATION.observe(duration, db)
+
+    statement = {'db': db, 'sql': ' '.join(sql.split()), 'ms': round(duration * 1000, 3), 'rows': rows}
+    profile = _current()
+    if profile is not None:
+        profile['statements'].append(statement)
+        profile['phases'][db] += duration
+
+    if duration * 1000 >= SLOW_QUERY_MS:
+        SLOW_QUERIES.inc(db)
+        plan = None
+        if explain is not None:
+            try:
+                plan = explain()
+            except Exception as e:
+                plan = f'(план не получен: {e})'
+        statement['plan'] = plan
+        slow_log.warning('Медленный запрос %s (%.1f мс, строк: %s): %s\n%s',
+                         db, duration * 1000, rows, statement['sql'], plan or '')
+    return statement
+
+
+# ============================================================================
+# POSTGRESQL
+# ============================================================================
+
+class _TimedPgCursor:
+    """Примесь к классу курсора psycopg2: время и строки каждой команды"""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            sql = query if isinstance(query, str) else query.decode()
+            self._statement = _record('postgres', sql, started, self.rowcount,
+                                      explain=lambda: self._explain(sql, vars))
+
+    def _explain(self, sql, vars):
+        # Именованный курсор и команды не-SELECT не объясняем
+        if self.name or not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+            return None
+        if self.connection.get_transaction_status() == extensions.TRANSACTION_STATUS_INERROR:
+            return None
+        # Обычный курсор мимо профиля - сам EXPLAIN не записываем
+        cursor = extensions.connection.cursor(self.connection)
+        cursor.execute('EXPLAIN ' + sql, vars)
+        plan = '\n'.join(row[0] for row in cursor.fetchall())
+        cursor.close()
+        return plan
+
+
+_pg_cursor_classes = {}
+
+
+class PgConnection(extensions.connection):
+    """Подключение psycopg2, курсоры которого записываются в профиль"""
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get('cursor_factory') or self.cursor_factory or extensions.cursor
+        timed = _pg_cursor_classes.get(base)
+        if timed is None:
+            timed = _pg_cursor_classes[base] = type('Timed' + base.__name__, (_TimedPgCursor, base), {})
+        kwargs['cursor_factory'] = timed
+        return super().cursor(*args, **kwargs)
+
+
+def pg_connect(dsn, **kwargs):
+    """Фабрика подключений для db.ConnectionPool (None - обычная)"""
+    if not ENABLED:
+        return None
+    return lambda: psycopg2.connect(dsn, connection_factory=PgConnection, **kwargs)
+
+
+# ============================================================================
+# SQLITE
+# ============================================================================
+
+class _SqliteCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._statement = _record(
+                'sqlite', sql, started, self.rowcount if self.rowcount >= 0 else 0,
+                explain=lambda: self._explain(sql, parameters))
+
+    def _explain(self, sql, parameters):
+        if not sql.lstrip().upper().startswith('SELECT'):
+            return None
+        rows = sqlite3.Connection.execute(self.connection, 'EXPLAIN QUERY PLAN ' + sql, parameters).fetchall()
+        return '\n'.join(str(tuple(row)[-1]) for row in rows)
+
+    def _count(self, rows):
+        statement = getattr(self, '_statement', None)
+        if statement is not None:
+            statement['rows'] += rows
+
+    def fetchone(self):
+        row = super().fetchone()
+        self._count(row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(size if size is not None else self.arraysize)
+        self._count(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self._count(len(rows))
+        return rows
+
+
+class SqliteConnection(sqlite3.Connection):
+    """Подключение sqlite3, команды которого записываются в профиль"""
+
+    def cursor(self, factory=_SqliteCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+
+def sqlite_factory():
+    """factory для sqlite3.connect"""
+    return SqliteConnection if ENABLED else sqlite3.Connection
+
+
+# ============================================================================
+# FLASK
+# ============================================================================
+
+def _route():
+    from flask import request
+    return request.url_rule.rule if request.url_rule else '<unmatched>'
+
+
+def _local_request(request):
+    """
+    Запрос с этой же машины. Через обратный прокси (nginx на том же
+    сервере) любой запрос приходит с 127.0.0.1, поэтому запросы с
+    заголовками прокси локальными не считаются.
+    """
+    if 'X-Forwarded-For' in request.headers or 'Forwarded' in request.headers:
+        return False
+    return request.remote_addr in LOCAL_ADDRESSES
+
+
+def init_app(app):
+    """
+    Подключить к приложению /metrics и профилирование (если PROFILING=1).
+
+    Без профилирования /metrics отдает только сбои базы, запасные ответы,
+    пул и предохранитель - они ведутся всегда.
+    """
+    from flask import Response, abort, request
+
+    @app.route('/metrics')
+    def metrics():
+        """Метрики воркера в формате Prometheus"""
+        if METRICS_TOKEN:
+            supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+            if not hmac.compare_digest(supplied, METRICS_TOKEN):
+                abort(403)
+        elif not _local_request(request):
+            abort(403)
+        series = (DB_FAILURES, DEGRADED_RESPONSES)
+        if ENABLED:
+            series = (REQUEST_DURATION, REQUESTS, PHASE_DURATION, SQL_DURATION, SLOW_QUERIES) + series
+        lines = []
+        for metric in series:
+            lines.extend(metric.render())
+        lines.extend(_pool_metrics())
+        lines.extend(_breaker_metrics())
+        return Response('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    if not ENABLED:
+        return
+
+    from flask.signals import before_render_template, template_rendered
+
+    @app.before_request
+    def start_profile():
+        _local.profile = {
+            'started': time.perf_counter(),
+            'statements': [],
+            'phases': dict.fromkeys(PHASES, 0.0),
+            'render_started': None,
+        }
+
+    def render_started(sender, **extra):
+        profile = _current()
+        if profile is not None:
+            profile['render_started'] = time.perf_counter()
+
+    def render_finished(sender, **extra):
+        profile = _current()
+        if profile is not None and profile['render_started'] is not None:
+            profile['phases']['render'] += time.perf_counter() - profile['render_started']
+            profile['render_started'] = None
+
+    before_render_template.connect(render_started, app, weak=False)
+    template_rendered.connect(render_finished, app, weak=False)
+
+    @app.after_request
+    def finish_profile(response):
+        profile = _current()
+        if profile is None:
+            return response
+        _local.profile = None
+
+        total = time.perf_counter() - profile['started']
+        phases = profile['phases']
+        phases['python'] = max(total - phases['postgres'] - phases['sqlite'] - phases['render'], 0.0)
+        route, method = _route(), request.method
+
+        REQUEST_DURATION.observe(total, route, method)
+        REQUESTS.inc(route, method, response.status_code)
+        for phase, seconds in phases.items():
+            PHASE_DURATION.observe(seconds, route, phase)
+
+        response.headers['Server-Timing'] = ', '.join(
+            [f'{phase};dur={seconds * 1000:.2f}' for phase, seconds in phases.items()]
+            + [f'total;dur={total * 1000:.2f}'])
+
+        if route not in ('/metrics', '/api/profile'):
+            with _profiles_lock:
+                _profiles.append({
+                    'time': time.time(),
+                    'method': method,
+                    'path': request.full_path.rstrip('?'),
+                    'route': route,
+                    'status': response.status_code,
+                    'ms': round(total * 1000, 3),
+                    'phases_ms': {phase: round(s * 1000, 3) for phase, s in phases.items()},
+                    'statements': profile['statements'],
+                })
+        return response
+
+
+def recent_profiles(limit=20):
+    """Последние профили запросов воркера (новые первыми)"""
+    with _profiles_lock:
+        profiles = list(_profiles)[-limit:]
+    return list(reversed(profiles))
+
+
+def _pool_metrics():
+    import db
+    pool = db.get_pool()
+    if pool is None:
+        return []
+    stats = pool.stats()
+    lines = []
+    for key, kind in (('size', 'gauge'), ('in_use', 'gauge'), ('idle', 'gauge'),
+                      ('acquired', 'counter'), ('timeouts', 'counter'), ('wait_time_total', 'counter')):
+        name = f'tenderfinder_db_pool_{key}' + ('_total' if kind == 'counter' and not key.endswith('total') else '')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.append(f'{name} {stats[key]}')
+    return lines
+
+
+def _breaker_metrics():
+    import db
+    stats = db.get_breaker().stats()
+    return [
+        '# TYPE tenderfinder_db_circuit_open gauge',
+        f'tenderfinder_db_circuit_open {int(stats["state"] != "closed")}',
+        '# TYPE tenderfinder_db_circuit_opened_total counter',
+        f'tenderfinder_db_circuit_opened_total {stats["opened"]}',
+        '# TYPE tenderfinder_db_circuit_rejected_total counter',
+        f'tenderfinder_db_circuit_rejected_total {stats["rejected"]}',
+    ]
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TenderFinder Commercial - Страна маркетплейса
+
+Единые правила для страницы лота, импорта и генерируемой колонки
+search_results.country (migrations/013_marketplace_domains.sql). У страны
+три вида правил:
+
+- маркеры - подстроки названия ('kaspi' в "Kaspi.kz", "kaspi магазин");
+- домены - адрес площадки или его поддомен: 'tmall.com' подходит для
+  "tmall.com", "detail.tmall.com" и "https://www.tmall.com/item", но не
+  для "nottmall.com";
+- псевдонимы - название целиком, без учета регистра ('вб', 'озон').
+
+Страны проверяются по порядку: первая, чье правило сработало, побеждает
+(ozon.kz - Казахстан, ozon - Россия). Неизвестный маркетплейс - без
+страны (None), как в SQL.
+
+Свои правила - JSON-файл в MARKETPLACE_RULES:
+[["CN", ["1688", ...], ["tmall.com", ...], ["таобао", ...]], ...]
+(домены и псевдонимы можно не указывать). После их изменения колонку в
+базе нужно пересоздать новой миграцией (выражение печатает
+`python marketplaces.py sql`).
+
+    python marketplaces.py classify "Kaspi.kz"
+    python marketplaces.py check      # сверить search_results.country с правилами
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+import psycopg2
+
+COUNTRIES = ('CN', 'KZ', 'RU')
+OTHER = 'OTHER'  # группа товаров неизвестных маркетплейсов
+
+# (страна, маркеры, домены, псевдонимы) в порядке приоритета
+DEFAULT_RULES = [
+    ('CN', ['1688', 'taobao', 'temu', 'aliexpress', 'pinduoduo'],
+     ['tmall.com', 'jd.com', 'alibaba.com', 'yangkeduo.com'],
+     ['tmall', 'jd', 'таобао', 'алиэкспресс', 'али', 'пиндуодуо']),
+    ('KZ', ['kaspi', 'satu', 'ozon.kz', 'otevertka'],
+     ['halykmarket.kz', 'wildberries.kz', 'wb.kz'],
+     ['каспи', 'сату', 'halyk market']),
+    ('RU', ['wildberries', 'wb.ru', 'chipdip', 'ozon'],
+     ['market.yandex.ru', 'megamarket.ru'],
+     ['wb', 'вб', 'вайлдберриз', 'озон', 'чипдип', 'яндекс маркет']),
+]
+
+
+def _rule(rule):
+    """(страна, маркеры, домены, псевдонимы) из правила с 2-4 элементами"""
+    country, markers, *rest = rule
+    domains = rest[0] if rest else []
+    aliases = rest[1] if len(rest) > 1 else []
+    return (country, [m.lower() for m in markers], [d.lower() for d in domains],
+            [a.strip(' ').lower() for a in aliases])
+
+
+def hostname(marketplace):
+    """Имя хоста, если название похоже на адрес ("Kaspi.kz", "https://..."), иначе None"""
+    text = marketplace.strip(' ').lower()
+    if '.' not in text or ' ' in text:
+        return None
+    try:
+        return urlsplit(text if '//' in text else '//' + text).hostname
+    except ValueError:
+        return None
+
+
+class Classifier:
+    """
+    Правила, собранные в одно регулярное выражение.
+
+    Выражение - просмотр вперед с альтернативой всех маркеров, поэтому
+    один проход по строке находит маркеры, начинающиеся в любой позиции
+    (в том числе перекрывающиеся). Домены и псевдонимы - словари: хост и
+    его родительские домены, название целиком. Результат запоминается по
+    строке.
+    """
+
+    def __init__(self, rules=None, cache_size=65536):
+        self.rules = [_rule(rule) for rule in (rules or DEFAULT_RULES)]
+
+        self._priority = {}
+        self._domains = {}
+        self._aliases = {}
+        alternatives = []
+        for priority, (country, markers, domains, aliases) in enumerate(self.rules):
+            # Длинные маркеры раньше коротких - на случай общего начала
+            for marker in sorted(markers, key=len, reverse=True):
+                if marker not in self._priority:
+                    self._priority[marker] = (priority, country)
+                    alternatives.append(re.escape(marker))
+            for domain in domains:
+                self._domains.setdefault(domain, (priority, country))
+            for alias in aliases:
+                self._aliases.setdefault(alias, (priority, country))
+        self._pattern = re.compile('(?=(%s))' % '|'.join(alternatives)) if alternatives else None
+
+        self.classify = lru_cache(maxsize=cache_size)(self._classify)
+
+    def _classify(self, marketplace):
+        if not marketplace:
+            return None
+        lowered = marketplace.lower()
+        best = self._aliases.get(lowered.strip(' '))
+        if self._domains:
+            host = hostname(marketplace)
+            if host:
+                labels = host.split('.')
+                for i in range(len(labels) - 1):
+                    found = self._domains.get('.'.join(labels[i:]))
+                    if found is not None and (best is None or found < best):
+                        best = found
+        if self._pattern is not None:
+            for match in self._pattern.finditer(lowered):
+                found = self._priority[match.group(1)]
+                if best is None or found < best:
+                    best = found
+                    if best[0] == 0:
+                        break
+        return best[1] if best else None
+
+    def classify_many(self, marketplaces):
+        """Страны для последовательности названий"""
+        classify = self.classify
+        return [classify(marketplace) for marketplace in marketplaces]
+
+    def group(self, rows, key='marketplace'):
+        """Строки (словари), разложенные по странам; неизвестные - в OTHER"""
+        groups = {country: [] for country in COUNTRIES}
+        groups[OTHER] = []
+        classify = self.classify
+        for row in rows:
+            groups.setdefault(classify(row.get(key)) or OTHER, []).append(row)
+        return groups
+
+    def sql_case(self, column='marketplace'):
+        """CASE-выражение PostgreSQL с теми же правилами"""
+        lines = ['CASE']
+        for country, markers, domains, aliases in self.rules:
+            conditions = []
+            if markers:
+                pattern = '|'.join(re.escape(marker) for marker in markers)
+                conditions.append(f"lower({column}) ~ '{_sql_string(pattern)}'")
+            if domains:
+                conditions.append(f"lower(btrim({column})) ~ '{_sql_string(domain_pattern(domains))}'")
+            if aliases:
+                names = ', '.join(f"'{_sql_string(alias)}'" for alias in aliases)
+                conditions.append(f"lower(btrim({column})) IN ({names})")
+            if conditions:
+                lines.append(f"    WHEN {' OR '.join(conditions)} THEN '{country}'")
+        lines.append('END')
+        return '\n'.join(lines)
+
+
+def domain_pattern(domains):
+    """
+    Регулярное выражение для SQL: строка - адрес, хост которого - один из
+    domains или их поддомен (то же, что hostname() в Python).
+    """
+    names = '|'.join(re.escape(domain) for domain in domains)
+    return rf'^([a-z][a-z0-9+.-]*:)?(//)?([^/?#@ ]*@)?([^/?#:@ ]*\.)?({names})(:[0-9]*)?([/?#][^ ]*)?$'
+
+
+def _sql_string(value):
+    return value.replace("'", "''")
+
+
+def load_rules(path):
+    """Правила из JSON-файла: [[страна, [маркеры], [домены], [псевдонимы]], ...]"""
+    with open(path, encoding='utf-8') as f:
+        return [tuple(rule) for rule in json.load(f)]
+
+
+_classifier = None
+
+
+def get_classifier():
+    """Классификатор процесса (правила из MARKETPLACE_RULES или по умолчанию)"""
+    global _classifier
+    if _classifier is None:
+        path = os.getenv('MARKETPLACE_RULES')
+        _classifier = Classifier(load_rules(path) if path else None)
+    return _classifier
+
+
+def set_classifier(classifier):
+    """Подменить классификатор процесса"""
+    global _classifier
+    _classifier = classifier
+
+
+def classify(marketplace):
+    """Страна маркетплейса ('CN' / 'KZ' / 'RU') или None"""
+    return get_classifier().classify(marketplace)
+
+
+def classify_many(marketplaces):
+    """Страны для последовательности названий маркетплейсов"""
+    return get_classifier().classify_many(marketplaces)
+
+
+def group_by_country(rows, key='marketplace'):
+    """Товары по странам: {'CN': [...], 'KZ': [...], 'RU': [...], 'OTHER': [...]}"""
+    return get_classifier().group(rows, key)
+
+
+def check(conn):
+    """Маркетплейсы, у которых search_results.country расходится с правилами"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT DISTINCT marketplace, country FROM search_results")
+    mismatches = [(marketplace, country, classify(marketplace))
+                  for marketplace, country in cursor.fetchall()
+                  if (country or '').strip() != (classify(marketplace) or '')]
+    cursor.close()
+    conn.rollback()
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Страна маркетплейса')
+    parser.add_argument('--dsn', default=os.getenv('DATABASE_URL'))
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_classify = sub.add_parser('classify', help='страна одного маркетплейса')
+    p_classify.add_argument('marketplace')
+
+    sub.add_parser('sql', help='CASE-выражение для search_results.country')
+    sub.add_parser('check', help='сверить search_results.country с правилами')
+
+    args = parser.parse_args()
+
+    if args.command == 'classify':
+        print(classify(args.marketplace))
+        return 0
+    if args.command == 'sql':
+        print(get_classifier().sql_case())
+        return 0
+
+    if not args.dsn:
+        parser.error('укажите --dsn или DATABASE_URL')
+
+    conn = psycopg2.connect(args.dsn)
+    try:
+        mismatches = check(conn)
+        for marketplace, actual, expected in mismatches:
+            print(f'{marketplace}\tв базе: {actual}\tпо правилам: {expected}')
+        if not mismatches:
+            print('Расхождений нет')
+            return 0
+        return 1
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TenderFinder Commercial - Миграции схемы PostgreSQL
+
+migrations/NNN_имя.sql применяются по порядку номеров; примененные
+записываются в schema_migrations (номер, имя, контрольная сумма, время).
+Файл с командами, которые нельзя выполнять в транзакции (CREATE INDEX
+CONCURRENTLY, VACUUM), выполняется по одной команде, остальные - целиком в
+одной транзакции. Параллельный запуск ждет advisory lock.
+
+    python migrate.py status
+    python migrate.py up [--to 9]
+    python migrate.py baseline 8    # база уже обновлена вручную через psql -f
+    python migrate.py check         # seq scan в планах горячих запросов
+
+При старте приложение в фоне пишет в журнал tenderfinder.schema
+предупреждения о непримененных миграциях и seq scan в горячих запросах.
+"""
+
+import argparse
+import glob
+import hashlib
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+import psycopg2
+from werkzeug.datastructures import MultiDict
+
+import catalog_query
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+# Ключ pg_advisory_lock - одна миграция на базу за раз
+LOCK_ID = 7301017
+
+# Таблицы меньше этого числа строк планировщик честно читает целиком
+CHECK_MIN_ROWS = int(os.getenv('SCHEMA_CHECK_MIN_ROWS', 10000))
+
+# Что запустить после миграции (данные, которые она не заполняет сама)
+FOLLOW_UP = {
+    4: 'python summaries.py rebuild',
+    5: 'python prices.py backfill',
+    6: 'python summaries.py rebuild',
+    11: 'python analytics.py run',
+    # Версия lot_summaries сменится у всех лотов - аналитику после агрегатов
+    12: ('python summaries.py rebuild', 'python analytics.py run'),
+    # Страны товаров пересчитаны - агрегаты по странам, затем лучшая страна в аналитике
+    13: ('python summaries.py rebuild', 'python analytics.py run'),
+}
+
+log = logging.getLogger('tenderfinder.schema')
+
+
+# ============================================================================
+# SQL-ФАЙЛЫ
+# ============================================================================
+
+# Начало комментария, строки или тела в $$ - внутри них ';' не разделяет команды
+SQL_TOKEN_RE = re.compile(r"--[^\n]*|'(?:[^']|'')*'|\$([A-Za-z_0-9]*)\$|;")
+
+# Команды, которые PostgreSQL не выполняет внутри транзакции
+NO_TRANSACTION_RE = re.compile(r'\bCONCURRENTLY\b|^\s*VACUUM\b', re.IGNORECASE)
+
+CONCURRENT_INDEX_RE = re.compile(
+    r'\bINDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)', re.IGNORECASE)
+
+
+def _code(statement):
+    """Команда без комментариев"""
+    return re.sub(r'--[^\n]*', '', statement).strip()
+
+
+def split_sql(sql):
+    """Команды SQL-файла (точки с запятой в строках, комментариях и $$ не считаются)"""
+    statements = []
+    start = pos = 0
+    while True:
+        match = SQL_TOKEN_RE.search(sql, pos)
+        if not match:
+            break
+        token = match.group()
+        if token == ';':
+            statements.append(sql[start:match.start()])
+            start = pos = match.end()
+        elif token.startswith('$'):
+            end = sql.find(token, match.end())
+            pos = len(sql) if end < 0 else end + len(token)
+        else:
+            pos = match.end()
+    statements.append(sql[start:])
+
+    # Пустые и состоящие из одних комментариев куски пропускаем
+    return [statement.strip() for statement in statements if _code(statement)]
+
+
+def discover(directory=MIGRATIONS_DIR):
+    """Миграции по порядку номеров: [{'version', 'name', 'path', 'checksum'}]"""
+    migrations = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.sql'))):
+        name = os.path.basename(path)
+        prefix = name.split('_', 1)[0]
+        if not prefix.isdigit():
+            continue
+        with open(path, 'rb') as f:
+            checksum = hashlib.sha256(f.read()).hexdigest()
+        migrations.append({'version': int(prefix), 'name': name, 'path': path, 'checksum': checksum})
+    versions = [m['version'] for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError('Повторяющиеся номера миграций в ' + directory)
+    return migrations
+
+
+# ============================================================================
+# ПРИМЕНЕНИЕ
+# ============================================================================
+
+def _ensure_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            checksum TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            duration_ms INTEGER
+        )
+    """)
+
+
+def applied(conn):
+    """Примененные миграции: {номер: (имя, контрольная сумма, applied_at)}"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        cursor.close()
+        conn.rollback()
+        return {}
+    cursor.execute("SELECT version, name, checksum, applied_at FROM schema_migrations")
+    result = {row[0]: row[1:] for row in cursor.fetchall()}
+    cursor.close()
+    conn.rollback()
+    return result
+
+
+def pending(conn, migrations=None):
+    """Миграции, которых нет в schema_migrations"""
+    done = applied(conn)
+    return [m for m in (migrations or discover()) if m['version'] not in done]
+
+
+def _record(cursor, migration, duration_ms=None):
+    cursor.execute("""
+        INSERT INTO schema_migrations (version, name, checksum, duration_ms)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (version) DO UPDATE
+        SET name = EXCLUDED.name, checksum = EXCLUDED.checksum,
+            applied_at = now(), duration_ms = EXCLUDED.duration_ms
+    """, [migration['version'], migration['name'], migration['checksum'], duration_ms])
+
+
+def _drop_invalid_indexes(cursor, statements):
+    """
+    Индексы CONCURRENTLY, которые остались INVALID после прерванной
+    миграции: IF NOT EXISTS их пропустил бы, поэтому удаляем и строим заново.
+    """
+    names = [match.group(1) for statement in statements
+             for match in CONCURRENT_INDEX_RE.finditer(_code(statement))]
+    if not names:
+        return
+    cursor.execute("""
+        SELECT c.relname FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE NOT i.indisvalid AND c.relname = ANY(%s) AND pg_table_is_visible(c.oid)
+    """, [names])
+    for (name,) in cursor.fetchall():
+        log.warning('Индекс %s не достроен (INVALID) - пересоздаю', name)
+        cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+
+def apply(conn, migration):
+    """Применить одну миграцию и записать ее в schema_migrations"""
+    with open(migration['path'], encoding='utf-8') as f:
+        statements = split_sql(f.read())
+    started = time.monotonic()
+    cursor = conn.cursor()
+
+    if any(NO_TRANSACTION_RE.search(_code(statement)) for statement in statements):
+        # По одной команде: файлы пишутся идемпотентными (IF NOT EXISTS,
+        # OR REPLACE), прерванную миграцию можно запустить заново
+        conn.autocommit = True
+        try:
+            _drop_invalid_indexes(cursor, statements)
+            for statement in statements:
+                cursor.execute(statement)
+            _record(cursor, migration, int((time.monotonic() - started) * 1000))
+        finally:
+            conn.autocommit = False
+    else:
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+            _record(cursor, migration, int((time.monotonic() - started) * 1000))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    cursor.close()
+    return time.monotonic() - started
+
+
+def _locked(conn, func):
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    cursor = conn.cursor()
+    cursor.execute("SELECT pg_advisory_lock(%s)", [LOCK_ID])
+    _ensure_table(cursor)
+    conn.autocommit = False
+    try:
+        return func()
+    finally:
+        conn.rollback()
+        conn.autocommit = True
+        cursor.execute("SELECT pg_advisory_unlock(%s)", [LOCK_ID])
+        cursor.close()
+        conn.autocommit = autocommit
+
+
+def migrate(conn, target=None, progress=None):
+    """Применить непримененные миграции до номера target включительно; список примененных"""
+    def run():
+        done = []
+        for migration in pending(conn):
+            if target is not None and migration['version'] > target:
+                break
+            if progress:
+                progress(f"{migration['name']}...")
+            elapsed = apply(conn, migration)
+            done.append(migration)
+            if progress:
+                progress(f"{migration['name']}: {elapsed:.1f} с")
+        return done
+    return _locked(conn, run)
+
+
+def baseline(conn, version):
+    """Отметить миграции до version включительно примененными, не выполняя их"""
+    def run():
+        cursor = conn.cursor()
+        marked = [m for m in pending(conn) if m['version'] <= version]
+        for migration in marked:
+            _record(cursor, migration)
+        conn.commit()
+        cursor.close()
+        return marked
+    return _locked(conn, run)
+
+
+def follow_up(migrations):
+    """Команды после применения migrations (по одному разу, в порядке последнего упоминания)"""
+    commands = []
+    for migration in migrations:
+        command = FOLLOW_UP.get(migration['version'])
+        if command:
+            commands.extend([command] if isinstance(command, str) else command)
+    return [command for i, command in enumerate(commands) if command not in commands[i + 1:]]
+
+
+# ============================================================================
+# ПРОВЕРКА ПЛАНОВ
+# ============================================================================
+
+def hot_queries():
+    """Горячие запросы приложения: [(название, sql, параметры)]"""
+    queries = []
+    for name, args, sort_key in (('каталог', {}, 'l.created_at'),
+                                 ('каталог по странам', {'country_cn': '0'}, 'l.created_at'),
+                                 ('каталог по марже', {'sort': 'margin'}, 'a.est_margin')):
+        where_sql, params = catalog_query.build_where(catalog_query.parse_filters(MultiDict(args)))
+        sql = catalog_query.PAGE_SQL.format(sort_key=sort_key, where=where_sql, order='DESC')
+        queries.append((name, sql, params + [catalog_query.PER_PAGE + 1]))
+    queries += [
+        ('лот', "SELECT * FROM lots WHERE lot_number = %s", ['LOT-0']),
+        ('товары лота', """
+            SELECT * FROM search_results
+            WHERE lot_number = %s
+            ORDER BY marketplace, price NULLS LAST, product_price
+        """, ['LOT-0']),
+        ('версия лота', "SELECT refreshed_at FROM lot_summaries WHERE lot_number = %s", ['LOT-0']),
+        ('аналитика лота', "SELECT * FROM lot_analytics WHERE lot_number = %s", ['LOT-0']),
+    ]
+    return queries
+
+
+def _seq_scans(plan):
+    if plan.get('Node Type') == 'Seq Scan':
+        yield plan.get('Relation Name')
+    for child in plan.get('Plans', []):
+        yield from _seq_scans(child)
+
+
+def check(conn, min_rows=CHECK_MIN_ROWS):
+    """
+    Seq scan по большим таблицам в планах горячих запросов.
+
+    Возвращает список (запрос, таблица, оценка строк). Таблицы меньше
+    min_rows строк не учитываются: для них seq scan - нормальный план.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT relname, reltuples::bigint FROM pg_class
+        WHERE relkind = 'r' AND pg_table_is_visible(oid)
+    """)
+    sizes = dict(cursor.fetchall())
+
+    problems = []
+    for name, sql, params in hot_queries():
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0][0]['Plan']
+        for relation in sorted(set(_seq_scans(plan))):
+            if sizes.get(relation, 0) >= min_rows:
+                problems.append((name, relation, sizes[relation]))
+    cursor.close()
+    conn.rollback()
+    return problems
+
+
+def startup_check(pool):
+    """Предупредить в журнале о непримененных миграциях и seq scan (ошибки не роняют приложение)"""
+    try:
+        with pool.connection() as conn:
+            waiting = pending(conn)
+            if waiting:
+                log.warning('Не применены миграции: %s - python migrate.py up',
+                            ', '.join(m['name'] for m in waiting))
+            for name, relation, rows in check(conn):
+                log.warning('Seq scan по %s (~%s строк) в запросе «%s» - не хватает индекса?',
+                            relation, rows, name)
+    except Exception as e:
+        log.warning('Проверка схемы не выполнена: %s', e)
+
+
+def check_in_background(get_pool):
+    """startup_check в фоновом потоке, чтобы не задерживать старт воркера"""
+    def run():
+        pool = get_pool()
+        if pool is not None:
+            startup_check(pool)
+    thread = threading.Thread(target=run, name='schema-check', daemon=True)
+    thread.start()
+    return thread
+
+
+# ============================================================================
+# CLI
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description='Миграции схемы PostgreSQL')
+    parser.add_argument('--dsn', default=os.getenv('DATABASE_URL'))
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    sub.add_parser('status', help='примененные и ожидающие миграции')
+    p_up = sub.add_parser('up', help='применить ожидающие миграции')
+    p_up.add_argument('--to', type=int, help='до номера включительно')
+    p_baseline = sub.add_parser('baseline', help='отметить примененными, не выполняя')
+    p_baseline.add_argument('version', type=int)
+    p_check = sub.add_parser('check', help='seq scan в планах горячих запросов')
+    p_check.add_argument('--min-rows', type=int, default=CHECK_MIN_ROWS)
+
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error('укажите --dsn или DATABASE_URL')
+
+    conn = psycopg2.connect(args.dsn)
+    try:
+        if args.command == 'status':
+            done = applied(conn)
+            for migration in discover():
+                row = done.get(migration['version'])
+                if row is None:
+                    state = 'ожидает'
+                elif row[1] != migration['checksum']:
+                    state = f'применена {row[2]:%Y-%m-%d %H:%M}, файл изменен после этого'
+                else:
+                    state = f'применена {row[2]:%Y-%m-%d %H:%M}'
+                print(f"{migration['name']}\t{state}")
+            return 0
+
+        if args.command == 'up':
+            done = migrate(conn, args.to, progress=print)
+            print(f'Применено миграций: {len(done)}')
+            for command in follow_up(done):
+                print(f'Теперь выполните: {command}')
+            return 0
+
+        if args.command == 'baseline':
+            marked = baseline(conn, args.version)
+            print(f'Отмечено примененными: {len(marked)}')
+            return 0
+
+        problems = check(conn, args.min_rows)
+        for name, relation, rows in problems:
+            print(f'{name}\tseq scan по {relation} (~{rows} строк)')
+        if not problems:
+            print('Горячие запросы читают большие таблицы по индексам')
+            return 0
+        return 1
+    except psycopg2.Error as e:
+        print(f'Ошибка: {e}', file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
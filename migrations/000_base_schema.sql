@@ -0,0 +1,28 @@
+-- Исходные таблицы тендеров в том виде, в каком их наполняет внешний
+-- процесс (и ingest.py). На существующей базе ничего не меняет.
+--
+-- Ключи и индексы добавляют следующие миграции: уникальные lot_number и
+-- (lot_number, product_url) - 008, created_at - 002, lot_number товаров -
+-- 001 и 005, marketplace - 009.
+
+CREATE TABLE IF NOT EXISTS lots (
+    id SERIAL PRIMARY KEY,
+    lot_number TEXT NOT NULL,
+    original_name TEXT,
+    simplified_name TEXT,
+    customer TEXT,
+    category TEXT,
+    tender_price NUMERIC(14, 2),
+    quantity INTEGER,
+    unit TEXT,
+    created_at TIMESTAMP DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS search_results (
+    id SERIAL PRIMARY KEY,
+    lot_number TEXT NOT NULL,
+    marketplace TEXT,
+    product_title TEXT,
+    product_price TEXT,
+    product_url TEXT
+);
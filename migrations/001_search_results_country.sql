@@ -0,0 +1,22 @@
+-- Страна маркетплейса как предвычисленный атрибут search_results.
+--
+-- Классификация повторяет правила каталога: Китай, затем Казахстан
+-- (ozon.kz раньше ozon), затем Россия; неизвестные маркетплейсы - NULL.
+-- Генерируемая колонка пересчитывается самим PostgreSQL при INSERT/UPDATE.
+--
+-- ВНИМАНИЕ: ADD COLUMN ... STORED переписывает таблицу под блокировкой,
+-- запускайте в окно обслуживания. CREATE INDEX CONCURRENTLY нельзя
+-- выполнять внутри транзакции: psql -f выполняет команды по одной.
+
+ALTER TABLE search_results
+    ADD COLUMN IF NOT EXISTS country CHAR(2) GENERATED ALWAYS AS (
+        CASE
+            WHEN lower(marketplace) ~ '1688|taobao|temu|aliexpress|pinduoduo' THEN 'CN'
+            WHEN lower(marketplace) ~ 'kaspi|satu|ozon\.kz|otevertka' THEN 'KZ'
+            WHEN lower(marketplace) ~ 'wildberries|wb\.ru|chipdip|ozon' THEN 'RU'
+        END
+    ) STORED;
+
+-- Фильтр каталога: EXISTS (... WHERE lot_number = ? AND country = ANY(?))
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_search_results_lot_country
+    ON search_results (lot_number, country);
@@ -0,0 +1,5 @@
+-- Keyset-пагинация каталога: ORDER BY created_at DESC, id DESC
+-- и (created_at, id) < (?, ?) читаются по одному индексу без сортировки.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_lots_created_at_id
+    ON lots (created_at DESC, id DESC);
@@ -0,0 +1,25 @@
+-- Поиск по названиям лотов (search.py).
+--
+-- search_vector - русская и английская конфигурации по обоим названиям,
+-- GIN по нему обслуживает @@ с префиксами слов; триграммные GIN-индексы
+-- обслуживают <% (опечатки) и старый ILIKE '%...%'.
+--
+-- ADD COLUMN ... STORED переписывает lots под блокировкой; индексы
+-- строятся CONCURRENTLY и не блокируют запись.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE lots
+    ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        to_tsvector('russian', coalesce(original_name, '') || ' ' || coalesce(simplified_name, ''))
+        || to_tsvector('english', coalesce(original_name, '') || ' ' || coalesce(simplified_name, ''))
+    ) STORED;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_lots_search_vector
+    ON lots USING gin (search_vector);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_lots_original_name_trgm
+    ON lots USING gin (original_name gin_trgm_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_lots_simplified_name_trgm
+    ON lots USING gin (simplified_name gin_trgm_ops);
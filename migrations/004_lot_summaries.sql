@@ -0,0 +1,92 @@
+-- Предвычисленные агрегаты по лотам для каталога (summaries.py).
+--
+-- lot_summaries_expected - единственное определение агрегатов: из него
+-- заполняется таблица и с ним же сверяется проверка согласованности.
+-- Триггеры на search_results пересчитывают только затронутые лоты
+-- (по переходным таблицам, один раз на команду).
+--
+-- После применения заполните таблицу: python summaries.py rebuild
+
+CREATE TABLE IF NOT EXISTS lot_summaries (
+    lot_number TEXT PRIMARY KEY,
+    products_count INTEGER NOT NULL DEFAULT 0,
+    min_price NUMERIC,
+    max_price NUMERIC,
+    median_price NUMERIC,
+    kz_count INTEGER NOT NULL DEFAULT 0,
+    ru_count INTEGER NOT NULL DEFAULT 0,
+    cn_count INTEGER NOT NULL DEFAULT 0,
+    refreshed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE OR REPLACE VIEW lot_summaries_expected AS
+    SELECT sr.lot_number,
+           COUNT(*)::int as products_count,
+           MIN(p.price) as min_price,
+           MAX(p.price) as max_price,
+           (percentile_cont(0.5) WITHIN GROUP (ORDER BY p.price))::numeric as median_price,
+           (COUNT(*) FILTER (WHERE sr.country = 'KZ'))::int as kz_count,
+           (COUNT(*) FILTER (WHERE sr.country = 'RU'))::int as ru_count,
+           (COUNT(*) FILTER (WHERE sr.country = 'CN'))::int as cn_count
+    FROM search_results sr
+    CROSS JOIN LATERAL (
+        SELECT CASE
+            WHEN sr.product_price ~ '^[0-9]+\.?[0-9]*$'
+            THEN CAST(sr.product_price AS DECIMAL)
+        END as price
+    ) p
+    GROUP BY sr.lot_number;
+
+CREATE OR REPLACE FUNCTION refresh_lot_summaries(p_lot_numbers TEXT[]) RETURNS void AS $$
+    DELETE FROM lot_summaries s
+    WHERE s.lot_number = ANY(p_lot_numbers)
+      AND NOT EXISTS (SELECT 1 FROM search_results sr WHERE sr.lot_number = s.lot_number);
+
+    INSERT INTO lot_summaries (lot_number, products_count, min_price, max_price, median_price,
+                               kz_count, ru_count, cn_count, refreshed_at)
+    SELECT e.lot_number, e.products_count, e.min_price, e.max_price, e.median_price,
+           e.kz_count, e.ru_count, e.cn_count, now()
+    FROM lot_summaries_expected e
+    WHERE e.lot_number = ANY(p_lot_numbers)
+    ON CONFLICT (lot_number) DO UPDATE SET
+        products_count = EXCLUDED.products_count,
+        min_price = EXCLUDED.min_price,
+        max_price = EXCLUDED.max_price,
+        median_price = EXCLUDED.median_price,
+        kz_count = EXCLUDED.kz_count,
+        ru_count = EXCLUDED.ru_count,
+        cn_count = EXCLUDED.cn_count,
+        refreshed_at = EXCLUDED.refreshed_at;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION search_results_refresh_summaries() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM refresh_lot_summaries(ARRAY(SELECT DISTINCT lot_number FROM new_rows));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM refresh_lot_summaries(ARRAY(SELECT DISTINCT lot_number FROM old_rows));
+    ELSE
+        PERFORM refresh_lot_summaries(ARRAY(
+            SELECT lot_number FROM new_rows UNION SELECT lot_number FROM old_rows));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_search_results_summaries_ins ON search_results;
+CREATE TRIGGER trg_search_results_summaries_ins
+    AFTER INSERT ON search_results
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION search_results_refresh_summaries();
+
+DROP TRIGGER IF EXISTS trg_search_results_summaries_upd ON search_results;
+CREATE TRIGGER trg_search_results_summaries_upd
+    AFTER UPDATE ON search_results
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION search_results_refresh_summaries();
+
+DROP TRIGGER IF EXISTS trg_search_results_summaries_del ON search_results;
+CREATE TRIGGER trg_search_results_summaries_del
+    AFTER DELETE ON search_results
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION search_results_refresh_summaries();
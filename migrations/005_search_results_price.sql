@@ -0,0 +1,53 @@
+-- Числовая цена товара (prices.py).
+--
+-- price/currency заполняет python prices.py backfill пачками по первичному
+-- ключу; строки с price_normalized_at IS NULL ждут обработки. Если внешний
+-- процесс меняет product_price, триггер сбрасывает разобранную цену.
+--
+-- Колонки без DEFAULT добавляются без перезаписи таблицы.
+
+ALTER TABLE search_results
+    ADD COLUMN IF NOT EXISTS price NUMERIC(14, 2),
+    ADD COLUMN IF NOT EXISTS currency CHAR(3),
+    ADD COLUMN IF NOT EXISTS price_normalized_at TIMESTAMPTZ;
+
+CREATE OR REPLACE FUNCTION search_results_reset_price() RETURNS trigger AS $$
+BEGIN
+    IF NEW.product_price IS DISTINCT FROM OLD.product_price THEN
+        NEW.price := NULL;
+        NEW.currency := NULL;
+        NEW.price_normalized_at := NULL;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_search_results_reset_price ON search_results;
+CREATE TRIGGER trg_search_results_reset_price
+    BEFORE UPDATE OF product_price ON search_results
+    FOR EACH ROW EXECUTE FUNCTION search_results_reset_price();
+
+-- Очередь нормализации
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_search_results_price_pending
+    ON search_results (id) WHERE price_normalized_at IS NULL;
+
+-- Минимальная цена по лоту и сортировка товаров лота
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_search_results_lot_price
+    ON search_results (lot_number, price);
+
+-- Диапазоны цен по всем товарам
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_search_results_price
+    ON search_results (price) WHERE price IS NOT NULL;
+
+-- Агрегаты лотов считаются по числовой цене
+CREATE OR REPLACE VIEW lot_summaries_expected AS
+    SELECT sr.lot_number,
+           COUNT(*)::int as products_count,
+           MIN(sr.price) as min_price,
+           MAX(sr.price) as max_price,
+           (percentile_cont(0.5) WITHIN GROUP (ORDER BY sr.price))::numeric as median_price,
+           (COUNT(*) FILTER (WHERE sr.country = 'KZ'))::int as kz_count,
+           (COUNT(*) FILTER (WHERE sr.country = 'RU'))::int as ru_count,
+           (COUNT(*) FILTER (WHERE sr.country = 'CN'))::int as cn_count
+    FROM search_results sr
+    GROUP BY sr.lot_number;
@@ -0,0 +1,101 @@
+-- Фильтры по депозиту и марже в каталоге (catalog_query.py).
+--
+-- lot_summaries получает минимальные цены по странам и предвычисленные
+-- min_cost = min_price * quantity и margin = tender_price - min_cost с
+-- индексами. Так как они зависят от lots, триггеры на lots тоже
+-- пересчитывают агрегаты при вставке и смене цены или количества.
+--
+-- После применения пересчитайте таблицу: python summaries.py rebuild
+
+ALTER TABLE lot_summaries
+    ADD COLUMN IF NOT EXISTS kz_min_price NUMERIC,
+    ADD COLUMN IF NOT EXISTS ru_min_price NUMERIC,
+    ADD COLUMN IF NOT EXISTS cn_min_price NUMERIC,
+    ADD COLUMN IF NOT EXISTS min_cost NUMERIC,
+    ADD COLUMN IF NOT EXISTS margin NUMERIC;
+
+DROP VIEW IF EXISTS lot_summaries_expected;
+CREATE VIEW lot_summaries_expected AS
+    SELECT agg.*,
+           agg.min_price * l.quantity as min_cost,
+           l.tender_price - agg.min_price * l.quantity as margin
+    FROM (
+        SELECT sr.lot_number,
+               COUNT(*)::int as products_count,
+               MIN(sr.price) as min_price,
+               MAX(sr.price) as max_price,
+               (percentile_cont(0.5) WITHIN GROUP (ORDER BY sr.price))::numeric as median_price,
+               (COUNT(*) FILTER (WHERE sr.country = 'KZ'))::int as kz_count,
+               (COUNT(*) FILTER (WHERE sr.country = 'RU'))::int as ru_count,
+               (COUNT(*) FILTER (WHERE sr.country = 'CN'))::int as cn_count,
+               MIN(sr.price) FILTER (WHERE sr.country = 'KZ') as kz_min_price,
+               MIN(sr.price) FILTER (WHERE sr.country = 'RU') as ru_min_price,
+               MIN(sr.price) FILTER (WHERE sr.country = 'CN') as cn_min_price
+        FROM search_results sr
+        GROUP BY sr.lot_number
+    ) agg
+    LEFT JOIN lots l ON l.lot_number = agg.lot_number;
+
+CREATE OR REPLACE FUNCTION refresh_lot_summaries(p_lot_numbers TEXT[]) RETURNS void AS $$
+    DELETE FROM lot_summaries s
+    WHERE s.lot_number = ANY(p_lot_numbers)
+      AND NOT EXISTS (SELECT 1 FROM search_results sr WHERE sr.lot_number = s.lot_number);
+
+    INSERT INTO lot_summaries (lot_number, products_count, min_price, max_price, median_price,
+                               kz_count, ru_count, cn_count,
+                               kz_min_price, ru_min_price, cn_min_price,
+                               min_cost, margin, refreshed_at)
+    SELECT e.lot_number, e.products_count, e.min_price, e.max_price, e.median_price,
+           e.kz_count, e.ru_count, e.cn_count,
+           e.kz_min_price, e.ru_min_price, e.cn_min_price,
+           e.min_cost, e.margin, now()
+    FROM lot_summaries_expected e
+    WHERE e.lot_number = ANY(p_lot_numbers)
+    ON CONFLICT (lot_number) DO UPDATE SET
+        products_count = EXCLUDED.products_count,
+        min_price = EXCLUDED.min_price,
+        max_price = EXCLUDED.max_price,
+        median_price = EXCLUDED.median_price,
+        kz_count = EXCLUDED.kz_count,
+        ru_count = EXCLUDED.ru_count,
+        cn_count = EXCLUDED.cn_count,
+        kz_min_price = EXCLUDED.kz_min_price,
+        ru_min_price = EXCLUDED.ru_min_price,
+        cn_min_price = EXCLUDED.cn_min_price,
+        min_cost = EXCLUDED.min_cost,
+        margin = EXCLUDED.margin,
+        refreshed_at = EXCLUDED.refreshed_at;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION lots_refresh_summaries() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM refresh_lot_summaries(ARRAY(SELECT lot_number FROM new_rows));
+    ELSE
+        PERFORM refresh_lot_summaries(ARRAY(
+            SELECT n.lot_number FROM new_rows n JOIN old_rows o ON o.id = n.id
+            WHERE n.tender_price IS DISTINCT FROM o.tender_price
+               OR n.quantity IS DISTINCT FROM o.quantity
+               OR n.lot_number IS DISTINCT FROM o.lot_number));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_lots_summaries_ins ON lots;
+CREATE TRIGGER trg_lots_summaries_ins
+    AFTER INSERT ON lots
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION lots_refresh_summaries();
+
+DROP TRIGGER IF EXISTS trg_lots_summaries_upd ON lots;
+CREATE TRIGGER trg_lots_summaries_upd
+    AFTER UPDATE ON lots
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION lots_refresh_summaries();
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_lot_summaries_min_cost
+    ON lot_summaries (min_cost);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_lot_summaries_margin
+    ON lot_summaries (margin);
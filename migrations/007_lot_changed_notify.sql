@@ -0,0 +1,63 @@
+-- Сброс кеша страниц лотов (app.py, lot_detail).
+--
+-- При любом пересчете агрегатов лота (то есть при изменении его
+-- search_results) и при изменении самого лота PostgreSQL шлет NOTIFY
+-- lot_changed со списком номеров через запятую; воркеры слушают канал и
+-- сбрасывают свои записи. Если список не помещается в payload - '*'.
+
+CREATE OR REPLACE FUNCTION notify_lot_changed(p_lot_numbers TEXT[]) RETURNS void AS $$
+    SELECT pg_notify('lot_changed',
+        CASE WHEN length(array_to_string(p_lot_numbers, ',')) < 7900
+             THEN array_to_string(p_lot_numbers, ',')
+             ELSE '*'
+        END)
+    WHERE cardinality(p_lot_numbers) > 0;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION search_results_refresh_summaries() RETURNS trigger AS $$
+DECLARE
+    changed TEXT[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        changed := ARRAY(SELECT DISTINCT lot_number FROM new_rows);
+    ELSIF TG_OP = 'DELETE' THEN
+        changed := ARRAY(SELECT DISTINCT lot_number FROM old_rows);
+    ELSE
+        changed := ARRAY(SELECT lot_number FROM new_rows UNION SELECT lot_number FROM old_rows);
+    END IF;
+    PERFORM refresh_lot_summaries(changed);
+    PERFORM notify_lot_changed(changed);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION lots_refresh_summaries() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM refresh_lot_summaries(ARRAY(SELECT lot_number FROM new_rows));
+    ELSE
+        PERFORM refresh_lot_summaries(ARRAY(
+            SELECT n.lot_number FROM new_rows n JOIN old_rows o ON o.id = n.id
+            WHERE n.tender_price IS DISTINCT FROM o.tender_price
+               OR n.quantity IS DISTINCT FROM o.quantity
+               OR n.lot_number IS DISTINCT FROM o.lot_number));
+        -- Страница лота показывает все его поля
+        PERFORM notify_lot_changed(ARRAY(
+            SELECT lot_number FROM new_rows UNION SELECT lot_number FROM old_rows));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION lots_notify_deleted() RETURNS trigger AS $$
+BEGIN
+    PERFORM notify_lot_changed(ARRAY(SELECT lot_number FROM old_rows));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_lots_notify_del ON lots;
+CREATE TRIGGER trg_lots_notify_del
+    AFTER DELETE ON lots
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION lots_notify_deleted();
@@ -0,0 +1,60 @@
+-- Загрузка данных (ingest.py, POST /api/import/<вид>).
+--
+-- Загрузчик делает upsert: лоты - по lot_number, товары - по
+-- (lot_number, product_url). Для ON CONFLICT нужны уникальные индексы;
+-- повторы лотов и товаров, накопившиеся до них, удаляются (остается
+-- последняя по id строка). Товары ссылаются на лот по lot_number, поэтому
+-- у оставшегося лота они сохраняются.
+--
+-- Товары без product_url (NULL) уникальный индекс не ограничивает, а
+-- загрузчик строки без ключа пропускает - такие товары остаются как есть.
+-- Среди них удаляются только полные повторы (тот же маркетплейс, название
+-- и цена у того же лота).
+--
+-- Цены загрузчик разбирает сам, поэтому триггер 005 больше не сбрасывает
+-- цену, если UPDATE принес новую price_normalized_at вместе с product_price.
+--
+-- ВНИМАНИЕ: DELETE повторов идет по всей таблице - запускайте в окно
+-- обслуживания. CREATE INDEX CONCURRENTLY нельзя выполнять внутри
+-- транзакции: psql -f выполняет команды по одной.
+
+DELETE FROM lots l
+USING lots newer
+WHERE newer.lot_number = l.lot_number
+  AND newer.id > l.id;
+
+DELETE FROM search_results sr
+USING search_results newer
+WHERE newer.lot_number = sr.lot_number
+  AND newer.product_url = sr.product_url
+  AND newer.id > sr.id;
+
+DELETE FROM search_results sr
+USING search_results newer
+WHERE sr.product_url IS NULL
+  AND newer.product_url IS NULL
+  AND newer.lot_number = sr.lot_number
+  AND newer.marketplace IS NOT DISTINCT FROM sr.marketplace
+  AND newer.product_title IS NOT DISTINCT FROM sr.product_title
+  AND newer.product_price IS NOT DISTINCT FROM sr.product_price
+  AND newer.id > sr.id;
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_search_results_lot_url
+    ON search_results (lot_number, product_url);
+
+-- Если lot_number уже объявлен UNIQUE, этот индекс его дублирует - тогда
+-- его можно удалить: ON CONFLICT (lot_number) подойдет любой уникальный
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_lots_lot_number
+    ON lots (lot_number);
+
+CREATE OR REPLACE FUNCTION search_results_reset_price() RETURNS trigger AS $$
+BEGIN
+    IF NEW.product_price IS DISTINCT FROM OLD.product_price
+       AND NEW.price_normalized_at IS NOT DISTINCT FROM OLD.price_normalized_at THEN
+        NEW.price := NULL;
+        NEW.currency := NULL;
+        NEW.price_normalized_at := NULL;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,14 @@
+-- Индексы оставшихся горячих запросов (python migrate.py check).
+--
+-- Страница лота: WHERE lot_number = ? ORDER BY marketplace, price NULLS
+-- LAST, product_price - товары читаются по индексу уже в нужном порядке.
+-- /api/stats: GROUP BY marketplace - index-only scan вместо чтения всей
+-- search_results.
+--
+-- Индексы строятся CONCURRENTLY и не блокируют запись.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_search_results_lot_marketplace
+    ON search_results (lot_number, marketplace, price NULLS LAST, product_price);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_search_results_marketplace
+    ON search_results (marketplace);
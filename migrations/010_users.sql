@@ -0,0 +1,16 @@
+-- Пользователи в PostgreSQL (users.py, USERS_BACKEND=postgres).
+--
+-- Та же структура, что у SQLite USERS_DB, флаги - boolean, даты -
+-- timestamp. Перенос существующих пользователей с сохранением id:
+-- python users.py copy. Администратор по умолчанию создается при
+-- первом обращении приложения.
+
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    email TEXT UNIQUE NOT NULL,
+    password_hash TEXT NOT NULL,
+    is_admin BOOLEAN NOT NULL DEFAULT false,
+    has_access BOOLEAN NOT NULL DEFAULT false,
+    access_until TIMESTAMP,
+    created_at TIMESTAMP NOT NULL DEFAULT now()
+);
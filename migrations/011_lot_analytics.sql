@@ -0,0 +1,34 @@
+-- Аналитика цен по лотам (analytics.py).
+--
+-- В отличие от lot_summaries, таблицу заполняют не триггеры, а фоновое
+-- задание: лучшие цены по странам, разброс, оценка маржи на количество
+-- лота и статистика без выбросов. source_refreshed_at - версия
+-- lot_summaries.refreshed_at, по которой посчитана строка: задание
+-- пересчитывает только лоты, у которых она с тех пор сменилась.
+--
+-- После применения заполните таблицу: python analytics.py run
+
+CREATE TABLE IF NOT EXISTS lot_analytics (
+    lot_number TEXT PRIMARY KEY,
+    source_refreshed_at TIMESTAMPTZ NOT NULL,
+    prices_count INTEGER NOT NULL DEFAULT 0,
+    outliers_count INTEGER NOT NULL DEFAULT 0,
+    kz_best_price NUMERIC,
+    ru_best_price NUMERIC,
+    cn_best_price NUMERIC,
+    best_price NUMERIC,
+    best_country CHAR(2),
+    median_price NUMERIC,
+    mean_price NUMERIC,
+    max_price NUMERIC,
+    price_spread NUMERIC,
+    country_spread NUMERIC,
+    est_cost NUMERIC,
+    est_margin NUMERIC,
+    margin_pct NUMERIC,
+    computed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- Каталог: sort=margin, наибольшая маржа сверху
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_lot_analytics_margin
+    ON lot_analytics (est_margin) WHERE est_margin IS NOT NULL;
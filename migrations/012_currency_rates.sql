@@ -0,0 +1,49 @@
+-- Цены в тенге для агрегатов по лотам (catalog_query.py, analytics.py).
+--
+-- search_results.price хранится в валюте магазина (currency), а цена
+-- тендера - в тенге. Чтобы депозит, маржа и минимальные цены сравнивались
+-- в одних единицах, lot_summaries считает все цены в KZT по курсам из
+-- currency_rates. Строки без курса (валюта не распознана или курса нет в
+-- таблице) в цены лота не входят, но учитываются в количестве товаров.
+--
+-- Курсы ниже ориентировочные - обновите их под свои расчеты:
+--     UPDATE currency_rates SET kzt_rate = 6.3, updated_at = now() WHERE currency = 'RUB';
+-- и пересчитайте агрегаты: python summaries.py rebuild
+
+CREATE TABLE IF NOT EXISTS currency_rates (
+    currency CHAR(3) PRIMARY KEY,
+    kzt_rate NUMERIC NOT NULL CHECK (kzt_rate > 0),  -- тенге за единицу валюты
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+INSERT INTO currency_rates (currency, kzt_rate) VALUES
+    ('KZT', 1),
+    ('RUB', 6.4),
+    ('CNY', 72),
+    ('USD', 520),
+    ('EUR', 600)
+ON CONFLICT (currency) DO NOTHING;
+
+DROP VIEW IF EXISTS lot_summaries_expected;
+CREATE VIEW lot_summaries_expected AS
+    SELECT agg.*,
+           agg.min_price * l.quantity as min_cost,
+           l.tender_price - agg.min_price * l.quantity as margin
+    FROM (
+        SELECT sr.lot_number,
+               COUNT(*)::int as products_count,
+               MIN(p.kzt) as min_price,
+               MAX(p.kzt) as max_price,
+               (percentile_cont(0.5) WITHIN GROUP (ORDER BY p.kzt))::numeric as median_price,
+               (COUNT(*) FILTER (WHERE sr.country = 'KZ'))::int as kz_count,
+               (COUNT(*) FILTER (WHERE sr.country = 'RU'))::int as ru_count,
+               (COUNT(*) FILTER (WHERE sr.country = 'CN'))::int as cn_count,
+               MIN(p.kzt) FILTER (WHERE sr.country = 'KZ') as kz_min_price,
+               MIN(p.kzt) FILTER (WHERE sr.country = 'RU') as ru_min_price,
+               MIN(p.kzt) FILTER (WHERE sr.country = 'CN') as cn_min_price
+        FROM search_results sr
+        LEFT JOIN currency_rates r ON r.currency = sr.currency
+        CROSS JOIN LATERAL (SELECT round(sr.price * r.kzt_rate, 2) as kzt) p
+        GROUP BY sr.lot_number
+    ) agg
+    LEFT JOIN lots l ON l.lot_number = agg.lot_number;
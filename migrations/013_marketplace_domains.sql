@@ -0,0 +1,49 @@
+-- Страна маркетплейса: домены и псевдонимы (marketplaces.py).
+--
+-- Кроме подстрок названия правила теперь узнают площадку по адресу
+-- (tmall.com, detail.tmall.com, wb.kz) и по названию целиком ("вб",
+-- "озон"). Выражение ниже печатает python marketplaces.py sql.
+--
+-- Генерируемую колонку нельзя изменить на месте, поэтому она
+-- пересоздается вместе с зависящим от нее lot_summaries_expected - в одной
+-- транзакции. Индекс по стране строит следующая миграция (014).
+--
+-- ВНИМАНИЕ: ADD COLUMN ... STORED переписывает таблицу под блокировкой,
+-- запускайте в окно обслуживания. После применения:
+-- python summaries.py rebuild (количество товаров по странам)
+
+DROP VIEW IF EXISTS lot_summaries_expected;
+
+ALTER TABLE search_results DROP COLUMN IF EXISTS country;
+
+ALTER TABLE search_results
+    ADD COLUMN country CHAR(2) GENERATED ALWAYS AS (
+        CASE
+            WHEN lower(marketplace) ~ '1688|taobao|temu|aliexpress|pinduoduo' OR lower(btrim(marketplace)) ~ '^([a-z][a-z0-9+.-]*:)?(//)?([^/?#@ ]*@)?([^/?#:@ ]*\.)?(tmall\.com|jd\.com|alibaba\.com|yangkeduo\.com)(:[0-9]*)?([/?#][^ ]*)?$' OR lower(btrim(marketplace)) IN ('tmall', 'jd', 'таобао', 'алиэкспресс', 'али', 'пиндуодуо') THEN 'CN'
+            WHEN lower(marketplace) ~ 'kaspi|satu|ozon\.kz|otevertka' OR lower(btrim(marketplace)) ~ '^([a-z][a-z0-9+.-]*:)?(//)?([^/?#@ ]*@)?([^/?#:@ ]*\.)?(halykmarket\.kz|wildberries\.kz|wb\.kz)(:[0-9]*)?([/?#][^ ]*)?$' OR lower(btrim(marketplace)) IN ('каспи', 'сату', 'halyk market') THEN 'KZ'
+            WHEN lower(marketplace) ~ 'wildberries|wb\.ru|chipdip|ozon' OR lower(btrim(marketplace)) ~ '^([a-z][a-z0-9+.-]*:)?(//)?([^/?#@ ]*@)?([^/?#:@ ]*\.)?(market\.yandex\.ru|megamarket\.ru)(:[0-9]*)?([/?#][^ ]*)?$' OR lower(btrim(marketplace)) IN ('wb', 'вб', 'вайлдберриз', 'озон', 'чипдип', 'яндекс маркет') THEN 'RU'
+        END
+    ) STORED;
+
+CREATE VIEW lot_summaries_expected AS
+    SELECT agg.*,
+           agg.min_price * l.quantity as min_cost,
+           l.tender_price - agg.min_price * l.quantity as margin
+    FROM (
+        SELECT sr.lot_number,
+               COUNT(*)::int as products_count,
+               MIN(p.kzt) as min_price,
+               MAX(p.kzt) as max_price,
+               (percentile_cont(0.5) WITHIN GROUP (ORDER BY p.kzt))::numeric as median_price,
+               (COUNT(*) FILTER (WHERE sr.country = 'KZ'))::int as kz_count,
+               (COUNT(*) FILTER (WHERE sr.country = 'RU'))::int as ru_count,
+               (COUNT(*) FILTER (WHERE sr.country = 'CN'))::int as cn_count,
+               MIN(p.kzt) FILTER (WHERE sr.country = 'KZ') as kz_min_price,
+               MIN(p.kzt) FILTER (WHERE sr.country = 'RU') as ru_min_price,
+               MIN(p.kzt) FILTER (WHERE sr.country = 'CN') as cn_min_price
+        FROM search_results sr
+        LEFT JOIN currency_rates r ON r.currency = sr.currency
+        CROSS JOIN LATERAL (SELECT round(sr.price * r.kzt_rate, 2) as kzt) p
+        GROUP BY sr.lot_number
+    ) agg
+    LEFT JOIN lots l ON l.lot_number = agg.lot_number;
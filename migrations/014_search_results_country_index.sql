@@ -0,0 +1,5 @@
+-- Индекс фильтра по странам для пересозданной колонки search_results.country
+-- (013_marketplace_domains.sql). Строится без блокировки записи.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_search_results_lot_country
+    ON search_results (lot_number, country);
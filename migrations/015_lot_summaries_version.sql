@@ -0,0 +1,56 @@
+-- Версия агрегатов лота для аналитики (analytics.py).
+--
+-- Раньше задание сравнивало lot_analytics.source_refreshed_at с
+-- lot_summaries.refreshed_at, а refreshed_at - это now(), время начала
+-- транзакции. Долгая транзакция, начатая раньше, могла записать агрегаты
+-- после более поздней и уже посчитанной аналитикой: время шло назад, и
+-- лот больше не пересчитывался. Теперь у lot_summaries есть version из
+-- последовательности. При обновлении строки номер берется в SET, уже
+-- после блокировки строки, поэтому каждая запись получает номер больше,
+-- чем у всех записей этой строки до нее.
+--
+-- Колонки с постоянным DEFAULT добавляются без перезаписи таблиц. У
+-- существующих строк обе версии равны 0: уже посчитанная аналитика
+-- остается в силе до следующего изменения лота.
+
+CREATE SEQUENCE IF NOT EXISTS lot_summaries_version_seq;
+
+ALTER TABLE lot_summaries
+    ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0;
+
+ALTER TABLE lot_analytics
+    ADD COLUMN IF NOT EXISTS source_version BIGINT NOT NULL DEFAULT 0;
+
+ALTER TABLE lot_analytics DROP COLUMN IF EXISTS source_refreshed_at;
+
+CREATE OR REPLACE FUNCTION refresh_lot_summaries(p_lot_numbers TEXT[]) RETURNS void AS $$
+    DELETE FROM lot_summaries s
+    WHERE s.lot_number = ANY(p_lot_numbers)
+      AND NOT EXISTS (SELECT 1 FROM search_results sr WHERE sr.lot_number = s.lot_number);
+
+    INSERT INTO lot_summaries (lot_number, products_count, min_price, max_price, median_price,
+                               kz_count, ru_count, cn_count,
+                               kz_min_price, ru_min_price, cn_min_price,
+                               min_cost, margin, refreshed_at, version)
+    SELECT e.lot_number, e.products_count, e.min_price, e.max_price, e.median_price,
+           e.kz_count, e.ru_count, e.cn_count,
+           e.kz_min_price, e.ru_min_price, e.cn_min_price,
+           e.min_cost, e.margin, now(), nextval('lot_summaries_version_seq')
+    FROM lot_summaries_expected e
+    WHERE e.lot_number = ANY(p_lot_numbers)
+    ON CONFLICT (lot_number) DO UPDATE SET
+        products_count = EXCLUDED.products_count,
+        min_price = EXCLUDED.min_price,
+        max_price = EXCLUDED.max_price,
+        median_price = EXCLUDED.median_price,
+        kz_count = EXCLUDED.kz_count,
+        ru_count = EXCLUDED.ru_count,
+        cn_count = EXCLUDED.cn_count,
+        kz_min_price = EXCLUDED.kz_min_price,
+        ru_min_price = EXCLUDED.ru_min_price,
+        cn_min_price = EXCLUDED.cn_min_price,
+        min_cost = EXCLUDED.min_cost,
+        margin = EXCLUDED.margin,
+        refreshed_at = EXCLUDED.refreshed_at,
+        version = nextval('lot_summaries_version_seq');
+$$ LANGUAGE sql;
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TenderFinder Commercial - Нормализация цен товаров
+
+search_results.product_price - текст из магазинов ("1 299,90 ₸", "¥12.5-15",
+"от 500 руб."). Здесь он разбирается в search_results.price (NUMERIC) и
+currency (ISO 4217). Колонки создает migrations/005_search_results_price.sql.
+
+    python prices.py backfill [--batch-size 5000]    # все необработанные строки
+    python prices.py backfill --follow               # и дальше следить за новыми
+    python prices.py reparse                         # переразобрать уже обработанные
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+from decimal import Decimal, InvalidOperation
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+# Валюта по умолчанию, если в тексте цены ее нет
+COUNTRY_CURRENCIES = {'KZ': 'KZT', 'RU': 'RUB', 'CN': 'CNY'}
+
+CURRENCY_MARKERS = [
+    ('KZT', ['₸', 'тенге', 'тг', 'kzt']),
+    ('RUB', ['₽', 'руб', 'rub', 'р.']),
+    ('CNY', ['¥', '￥', '元', 'cny', 'rmb', 'yuan']),
+    ('USD', ['$', 'usd']),
+    ('EUR', ['€', 'eur']),
+]
+
+MAX_PRICE = Decimal('999999999999.99')  # NUMERIC(14, 2)
+
+NUMBER_RE = re.compile(r'\d[\d\s.,\']*')
+SPACES_RE = re.compile(r"[\s']+")  # \s покрывает и неразрывные пробелы
+# Между границами диапазона: "100-200", "от 100 до 200"
+RANGE_GAP_RE = re.compile(r'\s*(?:[-–—~]|до)\s*$', re.IGNORECASE)
+
+
+def detect_currency(text):
+    """ISO-код валюты по символам и словам в тексте цены"""
+    lowered = text.lower()
+    for code, markers in CURRENCY_MARKERS:
+        if any(marker in lowered for marker in markers):
+            return code
+    return None
+
+
+def _marker_spans(lowered):
+    """[(start, end)] всех обозначений валют в тексте (нижний регистр)"""
+    spans = []
+    for _, markers in CURRENCY_MARKERS:
+        for marker in markers:
+            start = lowered.find(marker)
+            while start != -1:
+                spans.append((start, start + len(marker)))
+                start = lowered.find(marker, start + 1)
+    return spans
+
+
+def parse_number(raw):
+    """
+    '1 234,56' / '1,234.56' / '1.234,56' / '12,5' / '1.299' -> Decimal
+
+    Единственный разделитель (точка или запятая), за которым ровно три
+    цифры, - разделитель тысяч ('1.299' и '1,299' -> 1299), кроме '0.125'.
+    """
+    number = SPACES_RE.sub('', raw).strip('.,')
+    if not number:
+        return None
+
+    if ',' in number and '.' in number:
+        # Десятичный разделитель - тот, что правее
+        if number.rfind(',') > number.rfind('.'):
+            number = number.replace('.', '').replace(',', '.')
+        else:
+            number = number.replace(',', '')
+    elif number.count(',') + number.count('.') == 1:
+        integer, _, fraction = number.replace(',', '.').partition('.')
+        if len(fraction) == 3 and integer != '0':
+            number = integer + fraction
+        else:
+            number = integer + '.' + fraction
+    else:
+        # Несколько одинаковых разделителей - только тысячи
+        number = number.replace(',', '').replace('.', '')
+
+    try:
+        return Decimal(number)
+    except InvalidOperation:
+        return None
+
+
+def parse_price(text, default_currency=None):
+    """
+    Разобрать текст цены: (Decimal | None, currency | None).
+
+    Если в тексте несколько чисел ("2 шт по 100 ₽"), берется ближайшее к
+    обозначению валюты, без него - первое. Для диапазонов ("100-200",
+    "от 100 до 200") берется нижняя граница.
+    """
+    if not text:
+        return None, None
+
+    matches = list(NUMBER_RE.finditer(text))
+    if not matches:
+        return None, None
+
+    index = 0
+    markers = _marker_spans(text.lower())
+    if markers and len(matches) > 1:
+        def distance(match):
+            start, end = match.start(), match.start() + len(match.group().rstrip())
+            return min(max(m_start - end, start - m_end, 0) for m_start, m_end in markers)
+        index = min(range(len(matches)), key=lambda i: distance(matches[i]))
+        # Верхняя граница диапазона рядом с валютой -> нижняя
+        while index and RANGE_GAP_RE.fullmatch(
+                text[matches[index - 1].end():matches[index].start()]):
+            index -= 1
+
+    price = parse_number(matches[index].group())
+    if price is None or price < 0 or price > MAX_PRICE:
+        return None, None
+
+    return price.quantize(Decimal('0.01')), detect_currency(text) or default_currency
+
+
+# ============================================================================
+# ПАКЕТНАЯ ОБРАБОТКА
+# ============================================================================
+
+def normalize_batch(conn, batch_size=5000):
+    """
+    Разобрать одну пачку необработанных строк. Возвращает число строк.
+
+    Пачка - отдельная транзакция: UPDATE по первичному ключу, без
+    блокировки таблицы; в памяти не больше batch_size строк.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT id, product_price, country FROM search_results
+        WHERE price_normalized_at IS NULL
+        ORDER BY id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    """, [batch_size])
+    rows = cursor.fetchall()
+    if not rows:
+        conn.rollback()
+        cursor.close()
+        return 0
+
+    values = []
+    for row_id, product_price, country in rows:
+        price, currency = parse_price(product_price, COUNTRY_CURRENCIES.get(country))
+        values.append((row_id, price, currency))
+
+    execute_values(cursor, """
+        UPDATE search_results sr
+        SET price = v.price::numeric, currency = v.currency, price_normalized_at = now()
+        FROM (VALUES %s) AS v(id, price, currency)
+        WHERE sr.id = v.id
+    """, values, page_size=len(values))
+    conn.commit()
+    cursor.close()
+    return len(rows)
+
+
+def reparse_batch(conn, after=0, batch_size=5000):
+    """
+    Переразобрать уже обработанные строки после id=after (после изменения
+    правил разбора). Возвращает (число строк, последний id, число измененных).
+
+    Обновляются только строки, у которых изменились цена или валюта.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT id, product_price, country, price, currency FROM search_results
+        WHERE id > %s AND price_normalized_at IS NOT NULL
+        ORDER BY id
+        LIMIT %s
+    """, [after, batch_size])
+    rows = cursor.fetchall()
+    if not rows:
+        conn.rollback()
+        cursor.close()
+        return 0, after, 0
+
+    values = []
+    for row_id, product_price, country, old_price, old_currency in rows:
+        price, currency = parse_price(product_price, COUNTRY_CURRENCIES.get(country))
+        if (price, currency) != (old_price, old_currency and old_currency.strip()):
+            values.append((row_id, price, currency))
+
+    if values:
+        execute_values(cursor, """
+            UPDATE search_results sr
+            SET price = v.price::numeric, currency = v.currency, price_normalized_at = now()
+            FROM (VALUES %s) AS v(id, price, currency)
+            WHERE sr.id = v.id
+        """, values, page_size=len(values))
+    conn.commit()
+    cursor.close()
+    return len(rows), rows[-1][0], len(values)
+
+
+def reparse(conn, batch_size=5000, progress=None):
+    """Переразобрать все обработанные строки. Возвращает число измененных"""
+    after = 0
+    done = changed = 0
+    while True:
+        count, after, updated = reparse_batch(conn, after, batch_size)
+        done += count
+        changed += updated
+        if count and progress:
+            progress(f'{done} строк, изменено {changed}')
+        if count < batch_size:
+            return changed
+
+
+def backfill(conn, batch_size=5000, follow=False, poll_interval=5.0, progress=None):
+    """
+    Обработать все строки с price_normalized_at IS NULL.
+
+    follow=True - не останавливаться, а ждать новых строк (потоковый режим).
+    """
+    done = 0
+    started = time.monotonic()
+    while True:
+        count = normalize_batch(conn, batch_size)
+        done += count
+        if count and progress:
+            elapsed = time.monotonic() - started
+            progress(f'{done} строк, {done / elapsed if elapsed else 0:.0f} строк/с')
+        if count < batch_size:
+            if not follow:
+                return done
+            time.sleep(poll_interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нормализация цен search_results')
+    parser.add_argument('--dsn', default=os.getenv('DATABASE_URL'))
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_backfill = sub.add_parser('backfill', help='разобрать необработанные цены')
+    p_backfill.add_argument('--batch-size', type=int, default=5000)
+    p_backfill.add_argument('--follow', action='store_true', help='следить за новыми строками')
+    p_backfill.add_argument('--poll-interval', type=float, default=5.0)
+
+    p_reparse = sub.add_parser('reparse', help='переразобрать уже обработанные цены')
+    p_reparse.add_argument('--batch-size', type=int, default=5000)
+
+    p_parse = sub.add_parser('parse', help='проверить разбор одной строки')
+    p_parse.add_argument('text')
+
+    args = parser.parse_args()
+
+    if args.command == 'parse':
+        print(parse_price(args.text))
+        return 0
+
+    if not args.dsn:
+        parser.error('укажите --dsn или DATABASE_URL')
+
+    conn = psycopg2.connect(args.dsn)
+    try:
+        if args.command == 'reparse':
+            changed = reparse(conn, args.batch_size, progress=print)
+            print(f'Готово: изменено {changed} строк')
+            return 0
+
+        started = time.monotonic()
+        total = backfill(conn, args.batch_size, args.follow, args.poll_interval, progress=print)
+        elapsed = time.monotonic() - started
+        print(f'Готово: {total} строк за {elapsed:.1f} с ({total / elapsed if elapsed else 0:.0f} строк/с)')
+        return 0
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TenderFinder Commercial - Поиск по названиям лотов
+
+Полнотекстовый поиск по lots.search_vector (русская + английская
+конфигурации, префиксы слов) плюс триграммное сходство pg_trgm для опечаток.
+Индексы создает migrations/003_lots_search.sql.
+"""
+
+import re
+
+# Слова короче не ищем по префиксу: 'а:*' совпадет почти со всем
+MIN_PREFIX_LENGTH = 2
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tsquery_text(search):
+    """'ноутбук hp 15' -> 'ноутбук:* & hp:* & 15' (None, если слов нет)"""
+    words = WORD_RE.findall(search.lower())
+    if not words:
+        return None
+    return ' & '.join(f'{word}:*' if len(word) >= MIN_PREFIX_LENGTH else word for word in words)
+
+
+def build_search(search):
+    """
+    Условие поиска и выражение релевантности для лотов (алиас l).
+
+    Возвращает (where_sql, where_params, rank_sql, rank_params) или None,
+    если в строке нет ни одного слова.
+    """
+    query = tsquery_text(search)
+    if query is None:
+        return None
+
+    tsquery = "(to_tsquery('russian', %s) || to_tsquery('english', %s))"
+    term = search.lower()
+
+    # @@ идет по GIN(search_vector), <% - по GIN(... gin_trgm_ops);
+    # % в SQL удвоен для psycopg2
+    where_sql = f"""(l.search_vector @@ {tsquery}
+        OR %s <%% l.original_name
+        OR %s <%% l.simplified_name)"""
+    where_params = [query, query, term, term]
+
+    # numeric, чтобы значение точно пережило курсор пагинации
+    rank_sql = f"""round((
+        ts_rank_cd(l.search_vector, {tsquery})
+        + greatest(word_similarity(%s, l.original_name),
+                   word_similarity(%s, coalesce(l.simplified_name, '')))
+    )::numeric, 6)"""
+    rank_params = [query, query, term, term]
+
+    return where_sql, where_params, rank_sql, rank_params
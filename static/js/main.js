@@ -2,9 +2,13 @@
 
 document.addEventListener('DOMContentLoaded', function() {
     
-    // Fast filter form submission
+    // Catalog: filters and next pages via /api/lots, without reloading the page
     const filterForm = document.getElementById('filterForm');
-    if (filterForm) {
+    const lotsGrid = document.getElementById('lotsGrid');
+    if (filterForm && lotsGrid && window.fetch && window.AbortController) {
+        initCatalog(filterForm, lotsGrid);
+    } else if (filterForm) {
+        // Fast filter form submission
         const inputs = filterForm.querySelectorAll('input, select');
         inputs.forEach(input => {
             input.addEventListener('change', function() {
@@ -48,8 +52,8 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     });
     
-    // Auto-hide alerts after 5 seconds
-    const alerts = document.querySelectorAll('.alert');
+    // Auto-hide alerts after 5 seconds (state warnings marked data-persist stay)
+    const alerts = document.querySelectorAll('.alert:not([data-persist])');
     alerts.forEach(alert => {
         setTimeout(() => {
             alert.style.opacity = '0';
@@ -196,20 +200,7 @@ document.addEventListener('DOMContentLoaded', function() {
     // Search highlight
     const searchInput = document.getElementById('searchInput');
     if (searchInput) {
-        const searchTerm = searchInput.value.toLowerCase();
-        if (searchTerm) {
-            const lotTitles = document.querySelectorAll('.lot-title');
-            lotTitles.forEach(title => {
-                const text = title.textContent;
-                const index = text.toLowerCase().indexOf(searchTerm);
-                if (index >= 0) {
-                    const before = text.substring(0, index);
-                    const match = text.substring(index, index + searchTerm.length);
-                    const after = text.substring(index + searchTerm.length);
-                    title.innerHTML = before + '<mark style="background: yellow; padding: 2px;">' + match + '</mark>' + after;
-                }
-            });
-        }
+        highlightTitles(document, searchInput.value);
     }
 });
 
@@ -221,3 +212,325 @@ if ('serviceWorker' in navigator) {
             .catch(err => console.log('Service Worker registration failed'));
     });
 }
+
+// ============================================================================
+// Catalog
+// ============================================================================
+
+const CATALOG_DEBOUNCE_MS = 350;
+
+const PREVIEW_COUNTRIES = [
+    ['CN', '🇨🇳 Китай'],
+    ['RU', '🇷🇺 Россия'],
+    ['KZ', '🇰🇿 Казахстан'],
+    ['OTHER', '🌐 Другие']
+];
+
+function escapeHtml(value) {
+    return String(value == null ? '' : value)
+        .replace(/&/g, '&amp;')
+        .replace(/</g, '&lt;')
+        .replace(/>/g, '&gt;')
+        .replace(/"/g, '&quot;')
+        .replace(/'/g, '&#39;');
+}
+
+// Same as "{:,.Nf}".format(value) in the templates
+function formatNumber(value, digits) {
+    return Number(value).toLocaleString('en-US', {
+        minimumFractionDigits: digits,
+        maximumFractionDigits: digits
+    });
+}
+
+function highlightTitles(root, term) {
+    term = (term || '').trim().toLowerCase();
+    if (!term) {
+        return;
+    }
+    root.querySelectorAll('.lot-title').forEach(title => {
+        const text = title.textContent;
+        const index = text.toLowerCase().indexOf(term);
+        if (index >= 0) {
+            const before = text.substring(0, index);
+            const match = text.substring(index, index + term.length);
+            const after = text.substring(index + term.length);
+            title.innerHTML = escapeHtml(before) + '<mark style="background: yellow; padding: 2px;">' +
+                escapeHtml(match) + '</mark>' + escapeHtml(after);
+        }
+    });
+}
+
+// Card markup mirrors templates/catalog.html
+function lotCard(lot, lotUrl) {
+    let prices = '';
+    if (lot.min_price) {
+        const margin = lot.tender_price - lot.min_price * lot.quantity;
+        const estimate = lot.est_margin != null ? `
+                <div style="display: flex; justify-content: space-between; align-items: center; margin-top: 0.5rem;">
+                    <span style="font-size: 0.875rem; color: var(--text-secondary);">Маржа без выбросов:</span>
+                    <span style="font-weight: 700; color: ${lot.est_margin > 0 ? 'var(--secondary-color)' : 'var(--danger-color)'};">${formatNumber(lot.est_margin, 0)} ₸${lot.margin_pct != null ? ` (${formatNumber(lot.margin_pct, 0)}%)` : ''}</span>
+                </div>` : '';
+        prices = `
+            <div style="margin-top: 1rem; padding-top: 1rem; border-top: 1px solid var(--border-color);">
+                <div style="display: flex; justify-content: space-between; align-items: center;">
+                    <span style="font-size: 0.875rem; color: var(--text-secondary);">Мин. цена товара:</span>
+                    <span style="font-weight: 700; color: var(--secondary-color);">${formatNumber(lot.min_price, 2)} ₸</span>
+                </div>
+                <div style="display: flex; justify-content: space-between; align-items: center; margin-top: 0.5rem;">
+                    <span style="font-size: 0.875rem; color: var(--text-secondary);">Потенциальная маржа:</span>
+                    <span style="font-weight: 700; color: ${margin > 0 ? 'var(--secondary-color)' : 'var(--danger-color)'};">${formatNumber(margin, 0)} ₸</span>
+                </div>${estimate}
+            </div>`;
+    }
+    const preview = lot.products_count ? `
+            <button type="button" class="lot-preview-toggle" data-preview="${escapeHtml(lot.lot_number)}">👀 Самые дешевые товары</button>
+            <div class="lot-preview" hidden></div>` : '';
+    return `
+        <a href="${escapeHtml(lotUrl.replace('__lot__', encodeURIComponent(lot.lot_number)))}" style="text-decoration: none; color: inherit;">
+            <div class="lot-card">
+                <div class="lot-header">
+                    <span class="lot-number">${escapeHtml(lot.lot_number)}</span>
+                    <span class="lot-price">${formatNumber(lot.tender_price || 0, 0)} ₸</span>
+                </div>
+                <h3 class="lot-title">${escapeHtml(lot.simplified_name || lot.original_name)}</h3>
+                <div class="lot-meta">
+                    <span>📦 Количество: ${escapeHtml(lot.quantity)} ${escapeHtml(lot.unit || 'шт')}</span>
+                    <span>🛒 Товаров найдено: ${lot.products_count || 0}</span>
+                </div>
+                ${prices}
+                ${preview}
+                <div style="margin-top: 1rem;">
+                    <span class="btn btn-primary" style="width: 100%; text-align: center; padding: 0.5rem;">Подробнее →</span>
+                </div>
+            </div>
+        </a>`;
+}
+
+function previewHtml(data) {
+    const sections = PREVIEW_COUNTRIES
+        .filter(([code]) => data.countries[code] && data.countries[code].count)
+        .map(([code, title]) => {
+            const country = data.countries[code];
+            const items = country.products.map(product => `
+                <li>
+                    <span class="lot-preview-price">${escapeHtml(product.product_price || '—')}</span>
+                    ${escapeHtml(product.product_title)}
+                    <span class="text-secondary">· ${escapeHtml(product.marketplace)}</span>
+                </li>`).join('');
+            return `<div class="lot-preview-country">${title} <span class="text-secondary">(${country.count})</span></div><ul>${items}</ul>`;
+        });
+    return sections.join('') || '<p class="text-secondary">Товаров нет</p>';
+}
+
+function initCatalog(form, grid) {
+    const totalCount = document.getElementById('totalCount');
+    const pagination = document.getElementById('catalogPagination');
+    const sentinel = document.getElementById('catalogSentinel');
+    const status = document.getElementById('catalogStatus');
+    const empty = document.getElementById('catalogEmpty');
+    const lotUrl = grid.dataset.lotUrl;
+    const previews = {};
+
+    let nextCursor = grid.dataset.nextCursor || null;
+    let controller = null;      // request in flight; a newer query aborts it
+    let debounceTimer = null;
+    let pageParams = filterParams();  // filters of the results on screen; nextCursor belongs to them
+
+    // Pages are loaded on scroll instead
+    if (pagination) {
+        pagination.style.display = 'none';
+    }
+
+    function setStatus(text) {
+        status.textContent = text;
+    }
+
+    function filterParams() {
+        const data = new FormData(form);
+        const params = new URLSearchParams();
+        ['country_kz', 'country_ru', 'country_cn'].forEach(name => {
+            params.set(name, data.get(name) ? '1' : '0');
+        });
+        ['deposit', 'margin', 'search', 'sort'].forEach(name => {
+            const value = (data.get(name) || '').trim();
+            if (value) {
+                params.set(name, value);
+            }
+        });
+        return params;
+    }
+
+    function showPage(page, reset) {
+        if (reset) {
+            // The server's warning was about the page it rendered
+            const warning = document.getElementById('catalogWarning');
+            if (warning) {
+                warning.remove();
+            }
+            grid.innerHTML = '';
+            if (page.total == null) {
+                totalCount.textContent = '—';
+            } else {
+                totalCount.textContent = (page.total_is_estimate ? '≈ ' : '') + page.total;
+            }
+        }
+        const html = page.lots.map(lot => lotCard(lot, lotUrl)).join('');
+        const holder = document.createElement('div');
+        holder.innerHTML = html;
+        highlightTitles(holder, form.elements.search ? form.elements.search.value : '');
+        while (holder.firstElementChild) {
+            grid.appendChild(holder.firstElementChild);
+        }
+
+        nextCursor = page.next_cursor;
+        const hasLots = grid.children.length > 0;
+        grid.style.display = hasLots ? '' : 'none';
+        empty.style.display = hasLots ? 'none' : '';
+        if (page.stale) {
+            // The database did not answer in time: a saved copy was served
+            const saved = new Date(page.stale);
+            setStatus('Показаны сохраненные результаты на ' +
+                saved.toLocaleTimeString('ru-RU', { hour: '2-digit', minute: '2-digit' }));
+        } else {
+            setStatus(hasLots && !nextCursor ? 'Показаны все тендеры' : '');
+        }
+    }
+
+    function load(reset) {
+        if (!reset && !nextCursor) {
+            return;
+        }
+        if (controller) {
+            controller.abort();
+        }
+        const current = controller = new AbortController();
+        // Next pages repeat the query on screen, not the form being edited
+        const params = reset ? filterParams() : new URLSearchParams(pageParams);
+
+        if (reset) {
+            pageParams = new URLSearchParams(params);
+            // Address bar and export links follow the filters
+            history.replaceState(null, '', form.action + '?' + params);
+            document.querySelectorAll('[data-export]').forEach(link => {
+                const exportParams = new URLSearchParams(params);
+                exportParams.set('format', link.dataset.export);
+                link.href = grid.dataset.exportUrl + '?' + exportParams;
+            });
+            params.set('count', 'cached');
+        } else {
+            // The total is already on the screen
+            params.set('after', nextCursor);
+            params.set('count', 'none');
+        }
+
+        setStatus('Загрузка...');
+        fetch(grid.dataset.api + '?' + params, {
+            signal: current.signal,
+            credentials: 'same-origin',
+            headers: { 'Accept': 'application/json' }
+        })
+            .then(response => {
+                if (response.status === 503) {
+                    // Timeout or database outage: the server explains which
+                    return response.json().then(body => {
+                        throw new Error(body.error);
+                    });
+                }
+                if (!response.ok) {
+                    throw new Error('HTTP ' + response.status);
+                }
+                return response.json();
+            })
+            .then(page => {
+                if (controller !== current) {
+                    return;
+                }
+                showPage(page, reset);
+                if (nextCursor) {
+                    // The sentinel may still be visible: check again
+                    observer.unobserve(sentinel);
+                    observer.observe(sentinel);
+                }
+            })
+            .catch(error => {
+                if (error.name !== 'AbortError') {
+                    const known = error.message && !error.message.startsWith('HTTP ');
+                    setStatus(known ? error.message : 'Не удалось загрузить тендеры. Обновите страницу.');
+                }
+            })
+            .finally(() => {
+                if (controller === current) {
+                    controller = null;
+                }
+            });
+    }
+
+    const observer = new IntersectionObserver(entries => {
+        if (entries.some(entry => entry.isIntersecting) && nextCursor && !controller) {
+            load(false);
+        }
+    }, { rootMargin: '600px 0px' });
+    observer.observe(sentinel);
+
+    form.addEventListener('submit', function(e) {
+        e.preventDefault();
+        clearTimeout(debounceTimer);
+        load(true);
+    });
+
+    form.querySelectorAll('input, select').forEach(input => {
+        if (input.type === 'checkbox' || input.tagName === 'SELECT') {
+            input.addEventListener('change', () => {
+                clearTimeout(debounceTimer);
+                load(true);
+            });
+        } else {
+            // Typing: wait for a pause, then replace the results
+            input.addEventListener('input', () => {
+                clearTimeout(debounceTimer);
+                debounceTimer = setTimeout(() => load(true), CATALOG_DEBOUNCE_MS);
+            });
+        }
+    });
+
+    // Product previews are fetched on demand and kept for the page's lifetime
+    grid.addEventListener('click', function(e) {
+        const button = e.target.closest('[data-preview]');
+        if (!button) {
+            return;
+        }
+        e.preventDefault();
+        e.stopPropagation();
+
+        const panel = button.nextElementSibling;
+        if (!panel.hidden) {
+            panel.hidden = true;
+            return;
+        }
+        panel.hidden = false;
+
+        const lotNumber = button.dataset.preview;
+        if (previews[lotNumber]) {
+            panel.innerHTML = previews[lotNumber];
+            return;
+        }
+        panel.innerHTML = '<p class="text-secondary">Загрузка...</p>';
+        fetch(grid.dataset.previewUrl.replace('__lot__', encodeURIComponent(lotNumber)), {
+            credentials: 'same-origin',
+            headers: { 'Accept': 'application/json' }
+        })
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error('HTTP ' + response.status);
+                }
+                return response.json();
+            })
+            .then(data => {
+                previews[lotNumber] = panel.innerHTML = previewHtml(data);
+            })
+            .catch(() => {
+                panel.innerHTML = '<p class="text-danger">Не удалось загрузить товары</p>';
+            });
+    });
+}
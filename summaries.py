@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TenderFinder Commercial - Агрегаты по лотам (lot_summaries)
+
+Таблица поддерживается триггерами на search_results
+(migrations/004_lot_summaries.sql), цены в ней - в тенге по курсам
+currency_rates (012_currency_rates.sql). Здесь - первичное заполнение
+пачками и проверка согласованности с сырыми данными:
+
+    python summaries.py rebuild [--batch-size 1000]
+    python summaries.py check [--limit 100] [--fix]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import psycopg2
+
+COLUMNS = ['products_count', 'min_price', 'max_price', 'median_price',
+           'kz_count', 'ru_count', 'cn_count',
+           'kz_min_price', 'ru_min_price', 'cn_min_price', 'min_cost', 'margin']
+
+
+def refresh_lots(conn, lot_numbers):
+    """Пересчитать агрегаты указанных лотов"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT refresh_lot_summaries(%s::text[])", [list(lot_numbers)])
+    cursor.close()
+    conn.commit()
+
+
+def rebuild(conn, batch_size=1000, progress=None):
+    """
+    Пересчитать агрегаты всех лотов пачками по batch_size.
+
+    Каждая пачка - отдельная транзакция, поэтому блокировки короткие и
+    прерванный rebuild можно просто запустить заново.
+    """
+    cursor = conn.cursor()
+    last = ''
+    done = 0
+    started = time.monotonic()
+
+    while True:
+        cursor.execute("""
+            SELECT DISTINCT lot_number FROM search_results
+            WHERE lot_number > %s
+            ORDER BY lot_number
+            LIMIT %s
+        """, [last, batch_size])
+        batch = [row[0] for row in cursor.fetchall()]
+        if not batch:
+            break
+
+        cursor.execute("SELECT refresh_lot_summaries(%s::text[])", [batch])
+        conn.commit()
+
+        last = batch[-1]
+        done += len(batch)
+        if progress:
+            elapsed = time.monotonic() - started
+            progress(f'{done} лотов, {done / elapsed if elapsed else 0:.0f} лотов/с')
+
+    # Лоты, у которых больше нет товаров
+    cursor.execute("""
+        DELETE FROM lot_summaries s
+        WHERE NOT EXISTS (SELECT 1 FROM search_results sr WHERE sr.lot_number = s.lot_number)
+    """)
+    conn.commit()
+    cursor.close()
+    return done
+
+
+def check(conn, limit=100):
+    """
+    Сверить lot_summaries с агрегатами по сырым search_results.
+
+    Возвращает список расхождений: (lot_number, поле, в таблице, ожидается).
+    """
+    diff = ' OR '.join(f's.{c} IS DISTINCT FROM e.{c}' for c in COLUMNS)
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT coalesce(s.lot_number, e.lot_number) as lot_number,
+               s.lot_number IS NULL as missing,
+               e.lot_number IS NULL as orphan,
+               {', '.join(f's.{c}, e.{c}' for c in COLUMNS)}
+        FROM lot_summaries s
+        FULL OUTER JOIN lot_summaries_expected e ON e.lot_number = s.lot_number
+        WHERE s.lot_number IS NULL OR e.lot_number IS NULL OR {diff}
+        LIMIT %s
+    """, [limit])
+
+    mismatches = []
+    for row in cursor.fetchall():
+        lot_number, missing, orphan = row[:3]
+        if missing:
+            mismatches.append((lot_number, '*', None, 'нет строки в lot_summaries'))
+        elif orphan:
+            mismatches.append((lot_number, '*', 'лишняя строка', None))
+        else:
+            values = row[3:]
+            for i, column in enumerate(COLUMNS):
+                actual, expected = values[2 * i], values[2 * i + 1]
+                if actual != expected:
+                    mismatches.append((lot_number, column, actual, expected))
+    cursor.close()
+    conn.rollback()
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Агрегаты по лотам (lot_summaries)')
+    parser.add_argument('--dsn', default=os.getenv('DATABASE_URL'))
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_rebuild = sub.add_parser('rebuild', help='пересчитать все лоты')
+    p_rebuild.add_argument('--batch-size', type=int, default=1000)
+
+    p_check = sub.add_parser('check', help='проверить согласованность с search_results')
+    p_check.add_argument('--limit', type=int, default=100)
+    p_check.add_argument('--fix', action='store_true', help='пересчитать расходящиеся лоты')
+
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error('укажите --dsn или DATABASE_URL')
+
+    conn = psycopg2.connect(args.dsn)
+    try:
+        if args.command == 'rebuild':
+            total = rebuild(conn, args.batch_size, progress=print)
+            print(f'Готово: {total} лотов')
+            return 0
+
+        mismatches = check(conn, args.limit)
+        for lot_number, column, actual, expected in mismatches:
+            print(f'{lot_number}\t{column}\tв таблице: {actual}\tожидается: {expected}')
+        if not mismatches:
+            print('Расхождений нет')
+            return 0
+
+        if args.fix:
+            refresh_lots(conn, {m[0] for m in mismatches})
+            print(f'Пересчитано лотов: {len({m[0] for m in mismatches})}')
+        return 1
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""Модули приложения лежат в корне репозитория, рядом с tests/"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    """
+    Тестовый клиент приложения от имени администратора по умолчанию (id 1):
+    пользователи - во временном SQLite, база тендеров «настроена», но пул
+    подключений задает сам тест (db.set_pool)
+    """
+    import app
+    import cache
+    import db
+    import users
+
+    monkeypatch.setattr(app, 'DATABASE_URL', 'postgresql://test')
+    monkeypatch.setenv('DATABASE_URL', 'postgresql://test')
+    monkeypatch.setattr(users, '_store', users.SqliteUserStore(str(tmp_path / 'users.db')))
+    monkeypatch.setattr(db, '_pool', None)
+    monkeypatch.setattr(db, '_breaker', db.CircuitBreaker())
+    monkeypatch.setattr(cache, '_cache', cache.Cache())
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+    return client
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+import os
+from decimal import Decimal
+
+import psycopg2
+import pytest
+
+import analytics
+import migrate
+from analytics import COLUMNS, analyze, fences
+
+D = Decimal
+LOT = {'tender_price': D('1000'), 'quantity': 3}
+
+
+def test_fences_small_sample():
+    assert fences([D('1'), D('2'), D('1000')]) == (None, None)
+
+
+def test_fences():
+    assert fences([D('90'), D('100'), D('105'), D('110'), D('10000')]) == (D('85'), D('125'))
+
+
+def test_analyze():
+    prices = [('KZ', D('100')), ('RU', D('110')), ('CN', D('90')), ('KZ', D('105')),
+              ('KZ', D('10000'))]
+    result = analyze(LOT, prices)
+
+    assert set(result) == set(COLUMNS)
+    assert result == {
+        'prices_count': 5,
+        'outliers_count': 1,
+        'kz_best_price': D('100'),
+        'ru_best_price': D('110'),
+        'cn_best_price': D('90'),
+        'best_price': D('90'),
+        'best_country': 'CN',
+        'median_price': D('102.50'),
+        'mean_price': D('101.25'),
+        'max_price': D('110'),
+        'price_spread': D('20'),
+        'country_spread': D('20'),
+        'est_cost': D('270'),
+        'est_margin': D('730'),
+        'margin_pct': D('73.00'),
+    }
+
+
+def test_analyze_skips_missing_and_zero_prices():
+    result = analyze(LOT, [('KZ', None), ('KZ', D('0')), ('RU', D('50'))])
+    assert result['prices_count'] == 1
+    assert result['best_price'] == D('50')
+    assert result['best_country'] == 'RU'
+    # Одна страна - разброса между странами нет
+    assert result['country_spread'] is None
+
+
+def test_analyze_unknown_country_best():
+    # Самый дешевый товар - с площадки неизвестной страны
+    result = analyze(LOT, [(None, D('40')), ('KZ', D('60'))])
+    assert result['best_price'] == D('40')
+    assert result['best_country'] is None
+    assert result['kz_best_price'] == D('60')
+    assert result['ru_best_price'] is None
+    assert result['est_margin'] == D('880')
+
+
+def test_analyze_without_prices():
+    result = analyze(LOT, [('KZ', None)])
+    assert result == dict.fromkeys(COLUMNS) | {'prices_count': 0, 'outliers_count': 0}
+
+
+@pytest.mark.parametrize('lot, expected', [
+    # Лота нет в lots - только цены
+    (None, {'est_cost': None, 'est_margin': None, 'margin_pct': None}),
+    ({'tender_price': None, 'quantity': 2},
+     {'est_cost': D('200'), 'est_margin': None, 'margin_pct': None}),
+    # Нулевая цена тендера - маржа есть, процента нет
+    ({'tender_price': D('0'), 'quantity': 2},
+     {'est_cost': D('200'), 'est_margin': D('-200'), 'margin_pct': None}),
+    ({'tender_price': D('150'), 'quantity': 1},
+     {'est_cost': D('100'), 'est_margin': D('50'), 'margin_pct': D('33.33')}),
+])
+def test_analyze_margin(lot, expected):
+    result = analyze(lot, [('KZ', D('100'))])
+    assert {key: result[key] for key in expected} == expected
+
+
+# ============================================================================
+# ВЕРСИЯ АГРЕГАТОВ (нужна база: TEST_DATABASE_URL, схема пересоздается)
+# ============================================================================
+
+SCHEMA = 'test_analytics'
+
+
+@pytest.fixture
+def pg():
+    dsn = os.getenv('TEST_DATABASE_URL')
+    if not dsn:
+        pytest.skip('TEST_DATABASE_URL не задан')
+    conns = []
+
+    def connect():
+        conn = psycopg2.connect(dsn, options=f'-c search_path={SCHEMA},public')
+        conns.append(conn)
+        return conn
+
+    admin = psycopg2.connect(dsn)
+    admin.autocommit = True
+    admin.cursor().execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}')
+    admin.close()
+    migrate.migrate(connect())
+    yield connect
+    for conn in conns:
+        conn.close()
+
+
+def set_price(conn, price):
+    cursor = conn.cursor()
+    cursor.execute("UPDATE search_results SET price = %s WHERE lot_number = 'LOT-1'", [price])
+    conn.commit()
+
+
+def test_summary_committed_late_is_recomputed(pg):
+    job, older, newer = pg(), pg(), pg()
+    cursor = job.cursor()
+    cursor.execute("INSERT INTO lots (lot_number, tender_price, quantity) VALUES ('LOT-1', 1000, 1)")
+    cursor.execute("""
+        INSERT INTO search_results (lot_number, marketplace, product_url, price, currency)
+        VALUES ('LOT-1', 'kaspi.kz', 'https://example.kz/1', 500, 'KZT')
+    """)
+    job.commit()
+    assert analytics.refresh(job) == 1
+
+    # Транзакция older началась раньше, а агрегаты записывает позже newer
+    # и после того, как задание посчитало аналитику по версии newer
+    older.cursor().execute('SELECT now()')
+    set_price(newer, 400)
+    assert analytics.refresh(job) == 1
+    set_price(older, 300)
+
+    assert analytics.refresh(job) == 1
+    cursor.execute("SELECT best_price FROM lot_analytics WHERE lot_number = 'LOT-1'")
+    assert cursor.fetchone()[0] == D('300')
+    assert analytics.refresh(job) == 0
@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+import re
+import threading
+from decimal import Decimal
+
+import pytest
+
+import app
+import cache
+import marketplaces
+import users
+
+
+class SharedCache:
+    """Общий бэкенд в словаре: как Redis, но без TTL"""
+
+    def __init__(self):
+        self.data = {}
+        self.down = False
+
+    def _check(self):
+        if self.down:
+            raise ConnectionError('Redis недоступен')
+
+    def get(self, key):
+        self._check()
+        return self.data.get(key)
+
+    def set(self, key, entry, ttl):
+        self._check()
+        self.data[key] = entry
+
+    def delete(self, key):
+        self._check()
+        self.data.pop(key, None)
+
+    def delete_prefix(self, prefix):
+        self._check()
+        for key in [key for key in self.data if key.startswith(prefix)]:
+            del self.data[key]
+
+
+def glob_match(pattern, key):
+    """Шаблон SCAN MATCH: * и ?, символ после обратной косой черты - буквально"""
+    regex = ''
+    chars = iter(pattern)
+    for char in chars:
+        if char == '\\':
+            regex += re.escape(next(chars))
+        elif char in '*?':
+            regex += '.*' if char == '*' else '.'
+        else:
+            assert char != '[', 'классов символов в шаблоне быть не должно'
+            regex += re.escape(char)
+    return re.fullmatch(regex, key, re.DOTALL) is not None
+
+
+class FakeRedis:
+    """Клиент redis: SCAN по glob-шаблону и DEL"""
+
+    def __init__(self, keys):
+        self.keys = dict.fromkeys(keys)
+
+    def scan_iter(self, match, count):
+        return [key for key in list(self.keys) if glob_match(match, key)]
+
+    def delete(self, *keys):
+        for key in keys:
+            self.keys.pop(key, None)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, 'time', clock)
+    return clock
+
+
+class SyncThread:
+    """Фоновое обновление выполняется сразу при start()"""
+
+    def __init__(self, target, name=None, daemon=None):
+        self.target = target
+
+    def start(self):
+        self.target()
+
+
+@pytest.fixture
+def sync_refresh(monkeypatch):
+    monkeypatch.setattr(cache.threading, 'Thread', SyncThread)
+
+
+class Compute:
+    """Функция для кеша: считает вызовы, может падать"""
+
+    def __init__(self, value='v'):
+        self.value = value
+        self.calls = 0
+        self.error = None
+
+    def __call__(self):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return f'{self.value}{self.calls}'
+
+
+# ============================================================================
+# TTL И STALE-WHILE-REVALIDATE
+# ============================================================================
+
+def test_fresh_hit(clock):
+    store = cache.Cache(default_ttl=60, default_stale_ttl=300)
+    compute = Compute()
+    entry = store.get_entry('k', compute)
+    assert entry['value'] == 'v1'
+    assert (entry['expires'], entry['stale_until']) == (1060, 1360)
+
+    clock.now += 59
+    assert store.get_entry('k', compute) is entry
+    assert compute.calls == 1
+    assert store.stats()['k'] | {'compute_time_total': 0} == {
+        'hits': 1, 'stale_hits': 0, 'misses': 1, 'refreshes': 0, 'errors': 0,
+        'compute_time_total': 0}
+
+
+def test_stale_while_revalidate(clock, sync_refresh):
+    store = cache.Cache(default_ttl=60, default_stale_ttl=300)
+    compute = Compute()
+    store.get_entry('k', compute)
+
+    # Просрочено: отдается старое значение, новое считается «в фоне»
+    clock.now += 60
+    assert store.get_entry('k', compute)['value'] == 'v1'
+    assert compute.calls == 2
+    assert store.get_entry('k', compute)['value'] == 'v2'
+    stats = store.stats()['k']
+    assert (stats['stale_hits'], stats['refreshes'], stats['hits']) == (1, 1, 1)
+
+
+def test_refresh_in_background_once(clock):
+    store = cache.Cache(default_ttl=60, default_stale_ttl=300)
+    gate = threading.Event()
+    started = []
+
+    def slow():
+        started.append(1)
+        gate.wait(5)
+        return 'new'
+
+    store.get_entry('k', lambda: 'old')
+    clock.now += 61
+    # Пока идет обновление, второй запрос не запускает еще одно
+    assert store.get_entry('k', slow)['value'] == 'old'
+    assert store.get_entry('k', slow)['value'] == 'old'
+    gate.set()
+    for thread in threading.enumerate():
+        if thread.name == 'cache-refresh:k':
+            thread.join(5)
+    assert started == [1]
+    assert store.get_entry('k', slow)['value'] == 'new'
+
+
+def test_failed_refresh_keeps_stale(clock, sync_refresh):
+    store = cache.Cache(default_ttl=60, default_stale_ttl=300)
+    compute = Compute()
+    store.get_entry('k', compute)
+    compute.error = RuntimeError('база недоступна')
+
+    clock.now += 100
+    assert store.get_entry('k', compute)['value'] == 'v1'
+    assert store.stats()['k']['errors'] == 1
+
+    # После stale_until ошибка доходит до вызывающего
+    clock.now += 300
+    with pytest.raises(RuntimeError):
+        store.get_entry('k', compute)
+
+
+def test_lru_eviction(clock):
+    store = cache.Cache(local=cache.LocalCache(maxsize=2))
+    for key in 'abc':
+        store.get_entry(key, lambda: key)
+    assert store.local.keys() == ['b', 'c']
+
+
+# ============================================================================
+# ДВА УРОВНЯ
+# ============================================================================
+
+def test_shared_entry_used_by_other_worker(clock):
+    shared = SharedCache()
+    first = cache.Cache(shared=shared, default_ttl=60)
+    second = cache.Cache(shared=shared, default_ttl=60)
+    compute = Compute()
+
+    entry = first.get_entry('k', compute)
+    assert second.get_entry('k', compute)['etag'] == entry['etag']
+    assert compute.calls == 1
+    assert second.local.get('k') is not None
+
+
+def test_newer_shared_entry_replaces_expired_local(clock):
+    shared = SharedCache()
+    first = cache.Cache(shared=shared, default_ttl=60)
+    second = cache.Cache(shared=shared, default_ttl=60)
+    first.get_entry('k', Compute('first'))
+    second.get_entry('k', Compute('second'))
+
+    # Первый воркер пересчитал значение; у второго локальная копия просрочена
+    clock.now += 30
+    first.invalidate('k')
+    first.get_entry('k', Compute('fresh'))
+    clock.now += 40
+    compute = Compute('second')
+    assert second.get_entry('k', compute)['value'] == 'fresh1'
+    assert compute.calls == 0
+
+
+def test_shared_down(clock):
+    shared = SharedCache()
+    shared.down = True
+    store = cache.Cache(shared=shared)
+    assert store.get_or_compute('k', Compute()) == 'v1'
+    assert store.get_or_compute('k', Compute()) == 'v1'
+    # Чтение и запись первого вызова; второй - из памяти процесса
+    assert store.stats()['k']['errors'] == 2
+
+
+def test_invalidate(clock):
+    shared = SharedCache()
+    store = cache.Cache(shared=shared)
+    compute = Compute()
+    store.get_entry('k', compute)
+    store.invalidate('k')
+    assert store.local.get('k') is None and 'k' not in shared.data
+    assert store.get_or_compute('k', compute) == 'v2'
+
+
+def test_invalidate_prefix_clears_shared():
+    shared = SharedCache()
+    lots = cache.Cache(shared=shared)
+    for key in ('lot:1', 'lot:2', 'stats:tenders'):
+        lots.get_entry(key, lambda: key)
+
+    # Другой воркер: в его памяти ничего нет, он читает общий бэкенд
+    other = cache.Cache(shared=shared)
+    lots.invalidate_prefix('lot:')
+    assert set(lots.local.keys()) == {'stats:tenders'}
+    assert set(shared.data) == {'stats:tenders'}
+    assert other.get_or_compute('lot:1', lambda: 'заново') == 'заново'
+
+
+def test_invalidate_prefix_shared_down():
+    shared = SharedCache()
+    lots = cache.Cache(shared=shared)
+    lots.get_entry('lot:1', lambda: 1)
+    shared.down = True
+    lots.invalidate_prefix('lot:')
+    assert lots.local.keys() == []
+    assert lots.stats()['lot:']['errors'] == 1
+
+
+@pytest.mark.parametrize('prefix, pattern_keys, kept', [
+    ('lot:', ['tf:lot:1', 'tf:lot:2'], ['tf:stats', 'other:lot:1']),
+    # Символы glob в префиксе - буквально
+    ('lot:[1]*', ['tf:lot:[1]*x'], ['tf:lot:1', 'tf:lot:[1]']),
+])
+def test_redis_delete_prefix(prefix, pattern_keys, kept):
+    backend = cache.RedisCache.__new__(cache.RedisCache)
+    backend.prefix = 'tf:'
+    backend._redis = FakeRedis(pattern_keys + kept)
+    backend.delete_prefix(prefix)
+    assert sorted(backend._redis.keys) == sorted(kept)
+
+
+# ============================================================================
+# СТРАНИЦА ЛОТА: ETAG НА ПОЛЬЗОВАТЕЛЯ И 304
+# ============================================================================
+
+@pytest.fixture
+def lot_page(client, monkeypatch):
+    lots = {'LOT-1': 'Бумага A4'}
+    loads = []
+
+    def load_lot(lot_number):
+        loads.append(lot_number)
+        if lot_number not in lots:
+            return None
+        return {'lot': {'lot_number': lot_number, 'simplified_name': lots[lot_number],
+                        'tender_price': Decimal('5000'), 'quantity': 10, 'unit': 'упак'},
+                'products_by_country': marketplaces.group_by_country([]),
+                'total_products': 0, 'analytics': None, 'version': None}
+
+    monkeypatch.setattr(app, 'load_lot', load_lot)
+    monkeypatch.setattr(app, 'listen_lot_changes', lambda: None)
+    return lots, loads
+
+
+def test_lot_detail_not_modified(client, lot_page):
+    _, loads = lot_page
+    response = client.get('/lot/LOT-1')
+    assert response.status_code == 200
+    assert 'Бумага A4' in response.get_data(as_text=True)
+    etag, weak = response.get_etag()
+    assert weak and etag.endswith('-1')
+    assert response.cache_control.private and response.cache_control.no_cache
+
+    response = client.get('/lot/LOT-1', headers={'If-None-Match': f'W/"{etag}"'})
+    assert response.status_code == 304
+    assert response.get_data() == b''
+    assert response.get_etag() == (etag, True)
+    assert loads == ['LOT-1']
+
+
+def test_lot_detail_etag_per_user(client, lot_page):
+    etag, _ = client.get('/lot/LOT-1').get_etag()
+    user_id = users.get_store().create('user@example.kz', 'hash', has_access=True)
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+
+    # Те же данные, но шапка страницы другого пользователя - страница заново
+    response = client.get('/lot/LOT-1', headers={'If-None-Match': f'W/"{etag}"'})
+    assert response.status_code == 200
+    other, _ = response.get_etag()
+    assert other == etag.rsplit('-', 1)[0] + f'-{user_id}'
+
+
+def test_lot_detail_changed_lot(client, lot_page):
+    lots, _ = lot_page
+    etag, _ = client.get('/lot/LOT-1').get_etag()
+    lots['LOT-1'] = 'Бумага A3'
+    app.on_lot_changed('LOT-1')
+
+    response = client.get('/lot/LOT-1', headers={'If-None-Match': f'W/"{etag}"'})
+    assert response.status_code == 200
+    assert 'Бумага A3' in response.get_data(as_text=True)
+    assert response.get_etag()[0] != etag
+
+
+def test_lot_detail_missing_not_cached(client, lot_page):
+    _, loads = lot_page
+    assert client.get('/lot/LOT-2').status_code == 302
+    assert client.get('/lot/LOT-2').status_code == 302
+    assert loads == ['LOT-2', 'LOT-2']
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+from werkzeug.datastructures import MultiDict
+
+import catalog_query
+from catalog_query import InvalidCursor, decode_cursor, encode_cursor, keyset_condition
+
+
+@pytest.mark.parametrize('sort, value', [
+    ('newest', datetime(2024, 3, 1, 12, 30, 15, 123456)),
+    ('margin', Decimal('125000.50')),
+    ('margin', Decimal('-300')),
+    ('relevance', Decimal('0.0607927')),
+    # Лот без created_at: раньше в токен попадала строка 'None'
+    ('newest', None),
+    ('margin', None),
+])
+def test_cursor_roundtrip(sort, value):
+    token = encode_cursor(sort, {'sort_key': value, 'id': 42})
+    assert '=' not in token
+    assert decode_cursor(sort, token) == (value, 42)
+
+
+def test_cursor_from_other_sort():
+    token = encode_cursor('newest', {'sort_key': datetime(2024, 1, 1), 'id': 1})
+    with pytest.raises(InvalidCursor):
+        decode_cursor('margin', token)
+
+
+@pytest.mark.parametrize('token', ['', 'garbage', 'WyJuZXdlc3QiXQ', 'bnVsbA'])
+def test_cursor_invalid(token):
+    with pytest.raises(InvalidCursor):
+        decode_cursor('newest', token)
+
+
+@pytest.mark.parametrize('value, forward, sql, params', [
+    (5, True, "(k, l.id) < (%s, %s)", [5, 7]),
+    (5, False, "((k, l.id) > (%s, %s) OR k IS NULL)", [5, 7]),
+    (None, True, "((k IS NULL AND l.id < %s) OR k IS NOT NULL)", [7]),
+    (None, False, "(k IS NULL AND l.id > %s)", [7]),
+])
+def test_keyset_condition(value, forward, sql, params):
+    assert keyset_condition('k', [], value, 7, forward) == (sql, params)
+
+
+def test_keyset_condition_sort_params():
+    # Параметры выражения сортировки - перед каждым его вхождением
+    sql, params = keyset_condition('rank(%s)', ['q'], Decimal('1'), 7, forward=False)
+    assert sql.count('rank(%s)') == 2
+    assert params == ['q', Decimal('1'), 7, 'q']
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.sql = self.params = None
+
+    def execute(self, sql, params):
+        self.sql, self.params = sql, params
+
+    def fetchall(self):
+        return [dict(row) for row in self.rows]
+
+
+def lot(lot_id, created_at):
+    return {'id': lot_id, 'lot_number': f'LOT-{lot_id}', 'created_at': created_at,
+            'sort_key': created_at}
+
+
+def test_fetch_page_through_null_created_at():
+    filters = catalog_query.parse_filters(MultiDict({'sort': 'newest'}))
+    rows = [lot(9, None), lot(8, None), lot(7, datetime(2024, 1, 1))]
+    cursor = FakeCursor(rows)
+
+    page = catalog_query.fetch_page(cursor, filters, per_page=2)
+    assert [row['id'] for row in page['lots']] == [9, 8]
+    assert 'sort_key' not in page['lots'][0]
+    assert decode_cursor('newest', page['next_cursor']) == (None, 8)
+
+    cursor.rows = rows[2:]
+    page = catalog_query.fetch_page(cursor, filters, after=page['next_cursor'], per_page=2)
+    assert 'l.created_at IS NULL AND l.id < %s' in cursor.sql
+    assert cursor.params == [8, 3]
+    assert page['next_cursor'] is None
+    assert decode_cursor('newest', page['prev_cursor']) == (datetime(2024, 1, 1), 7)
+
+    cursor.rows = rows[:2]
+    catalog_query.fetch_page(cursor, filters, before=page['prev_cursor'], per_page=2)
+    assert 'OR l.created_at IS NULL' in cursor.sql
+    assert 'ORDER BY sort_key ASC' in cursor.sql
+    assert cursor.params == [datetime(2024, 1, 1), 7, 3]
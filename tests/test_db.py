@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+import time
+
+import pytest
+
+import db
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=None):
+        if self.conn.broken:
+            raise db.psycopg2.OperationalError('server closed the connection unexpectedly')
+        self.conn.executed.append((sql, params))
+
+    def fetchone(self):
+        return (1,)
+
+    def close(self):
+        pass
+
+
+class FakeConn:
+    """Заглушка подключения psycopg2: запоминает команды, может «сломаться»"""
+
+    def __init__(self):
+        self.closed = 0
+        self.autocommit = False
+        self.broken = False
+        self.executed = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        if self.broken:
+            raise db.psycopg2.InterfaceError('connection already closed')
+
+    def close(self):
+        self.closed = 1
+
+
+class Connector:
+    """Фабрика подключений для пула: считает вызовы, может падать или ждать"""
+
+    def __init__(self):
+        self.made = []
+        self.fail = 0
+        self.gate = None
+
+    def __call__(self):
+        if self.gate is not None:
+            self.gate.wait(5)
+        if self.fail:
+            self.fail -= 1
+            raise db.psycopg2.OperationalError('could not connect to server')
+        conn = FakeConn()
+        self.made.append(conn)
+        return conn
+
+
+def make_pool(**kwargs):
+    connect = Connector()
+    kwargs.setdefault('minconn', 0)
+    kwargs.setdefault('maxconn', 2)
+    return db.ConnectionPool(connect=connect, **kwargs), connect
+
+
+@pytest.mark.parametrize('minconn, maxconn', [(-1, 2), (0, 0), (3, 2)])
+def test_pool_sizes(minconn, maxconn):
+    with pytest.raises(ValueError):
+        db.ConnectionPool(minconn=minconn, maxconn=maxconn, connect=Connector())
+
+
+def test_minconn_opened_upfront():
+    pool, connect = make_pool(minconn=2)
+    assert len(connect.made) == 2
+    assert pool.stats()['created'] == 2
+
+
+def test_connection_reused():
+    pool, connect = make_pool()
+    with pool.connection() as conn:
+        pass
+    with pool.connection() as again:
+        assert again is conn
+    assert len(connect.made) == 1
+    assert pool.stats()['acquired'] == 2
+
+
+def test_timeout_when_exhausted():
+    pool, _ = make_pool(maxconn=1)
+    held = pool.getconn()
+    with pytest.raises(db.PoolTimeout):
+        pool.getconn(timeout=0.05)
+    assert pool.stats()['timeouts'] == 1
+    pool.putconn(held)
+    assert pool.getconn(timeout=0.05) is held
+
+
+def test_waiter_gets_returned_connection():
+    pool, _ = make_pool(maxconn=1)
+    held = pool.getconn()
+    threading.Timer(0.05, pool.putconn, [held]).start()
+    assert pool.getconn(timeout=2) is held
+
+
+def test_failed_healthcheck_discards_connection():
+    pool, connect = make_pool(healthcheck_interval=0)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    conn.broken = True
+
+    fresh = pool.getconn()
+    assert fresh is not conn
+    assert conn.closed
+    stats = pool.stats()
+    assert stats['healthcheck_failures'] == 1
+    assert stats['discarded'] == 1
+    assert len(connect.made) == 2
+
+
+def test_healthcheck_skipped_for_recent_connection():
+    pool, _ = make_pool(healthcheck_interval=60)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+    assert conn.executed == []
+
+
+def test_expired_connection_replaced():
+    pool, _ = make_pool(max_lifetime=0.01)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    time.sleep(0.02)
+    assert pool.getconn() is not conn
+    assert conn.closed
+
+
+@pytest.mark.parametrize('breakage', ['closed', 'discard', 'rollback'])
+def test_putconn_discards_broken(breakage):
+    pool, _ = make_pool()
+    conn = pool.getconn()
+    if breakage == 'closed':
+        conn.closed = 1
+    elif breakage == 'rollback':
+        conn.broken = True
+    pool.putconn(conn, discard=breakage == 'discard')
+
+    assert pool.stats()['discarded'] == 1
+    assert pool.getconn() is not conn
+
+
+def test_connect_failure_releases_slot():
+    pool, connect = make_pool(maxconn=1)
+    connect.fail = 1
+    with pytest.raises(db.psycopg2.OperationalError):
+        pool.getconn(timeout=0.05)
+    # Слот не остался занятым: следующее подключение открывается сразу
+    assert pool.getconn(timeout=0.05) is connect.made[0]
+    assert pool.stats()['connecting'] == 0
+
+
+def test_slow_connect_does_not_block_pool():
+    pool, connect = make_pool(maxconn=2)
+    held = pool.getconn()
+    connect.gate = threading.Event()
+    connecting = threading.Thread(target=pool.getconn)
+    connecting.start()
+    try:
+        # Второй поток открывает подключение; вернувшееся выдается без ожидания
+        deadline = time.monotonic() + 2
+        while pool.stats()['connecting'] == 0 and time.monotonic() < deadline:
+            time.sleep(0.005)
+        pool.putconn(held)
+        started = time.monotonic()
+        assert pool.getconn(timeout=1) is held
+        assert time.monotonic() - started < 0.5
+    finally:
+        connect.gate.set()
+        connecting.join()
+
+
+def test_statement_timeout_set_once():
+    pool, _ = make_pool(maxconn=1)
+    conn = pool.getconn(statement_timeout=3000)
+    pool.putconn(conn)
+    pool.putconn(pool.getconn(statement_timeout=3000))
+    assert conn.executed == [('SET statement_timeout = %s', [3000])]
+
+    pool.getconn()
+    assert conn.executed[-1] == ('RESET statement_timeout', None)
+    assert conn.autocommit is False
+
+
+def test_closeall():
+    pool, _ = make_pool()
+    held = pool.getconn()
+    idle = pool.getconn()
+    pool.putconn(idle)
+
+    pool.closeall()
+    assert idle.closed
+    with pytest.raises(db.PoolTimeout):
+        pool.getconn(timeout=0.05)
+    # Выданное до закрытия подключение закрывается при возврате
+    pool.putconn(held)
+    assert held.closed
+
+
+def test_fork_forgets_inherited_connections(monkeypatch):
+    pool, connect = make_pool()
+    inherited = pool.getconn()
+    pool.putconn(inherited)
+
+    monkeypatch.setattr(os, 'getpid', lambda: pool._pid + 1)
+    conn = pool.getconn()
+    assert conn is not inherited
+    # Сокет родителя не закрывается и не возвращается в пул потомка
+    assert not inherited.closed
+    pool.putconn(inherited)
+    assert pool.stats()['idle'] == 0
+    assert len(connect.made) == 2
+
+
+# ============================================================================
+# ПРЕДОХРАНИТЕЛЬ
+# ============================================================================
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(db.time, 'monotonic', clock)
+    return clock
+
+
+def test_breaker_opens_after_threshold(clock):
+    breaker = db.CircuitBreaker(threshold=3, cooldown=30)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.failure()
+    assert breaker.stats()['state'] == 'closed'
+
+    breaker.failure()
+    stats = breaker.stats()
+    assert stats['state'] == 'open'
+    assert stats['opened'] == 1
+    assert not breaker.allow()
+    assert breaker.stats()['rejected'] == 1
+
+
+def test_breaker_success_resets_failures(clock):
+    breaker = db.CircuitBreaker(threshold=2, cooldown=30)
+    breaker.failure()
+    breaker.success()
+    breaker.failure()
+    stats = breaker.stats()
+    assert stats['state'] == 'closed'
+    assert stats['consecutive_failures'] == 1
+    assert stats['failures'] == 2
+
+
+def test_breaker_trial_success_closes(clock):
+    breaker = db.CircuitBreaker(threshold=1, cooldown=30)
+    breaker.failure()
+    clock.now += 29
+    assert not breaker.allow()
+
+    clock.now += 1
+    assert breaker.allow()
+    assert breaker.stats()['state'] == 'half_open'
+    # Пока идет пробный запрос, остальные получают отказ
+    assert not breaker.allow()
+
+    breaker.success()
+    assert breaker.stats()['state'] == 'closed'
+    assert breaker.allow()
+
+
+def test_breaker_trial_failure_reopens(clock):
+    breaker = db.CircuitBreaker(threshold=5, cooldown=30)
+    for _ in range(5):
+        breaker.failure()
+    clock.now += 30
+    assert breaker.allow()
+
+    # В полуоткрытом состоянии хватает одного сбоя
+    breaker.failure()
+    assert breaker.stats()['state'] == 'open'
+    assert breaker.stats()['opened'] == 2
+    clock.now += 29
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+
+
+def test_breaker_lost_trial_retried(clock):
+    breaker = db.CircuitBreaker(threshold=1, cooldown=30)
+    breaker.failure()
+    clock.now += 30
+    assert breaker.allow()
+    # Пробный запрос не отчитался - через cooldown пропускается следующий
+    clock.now += 29
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
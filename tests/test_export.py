@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+import csv
+import io
+import json
+import os
+import zipfile
+from contextlib import contextmanager
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+from werkzeug.datastructures import MultiDict
+
+import catalog_query
+import db
+import export
+
+
+def lot(number):
+    return (f'LOT-{number}', f'Товар {number}', None, 'Заказчик', 'Канцелярия', 10, 'шт',
+            Decimal('5000.50'), datetime(2024, 3, number))
+
+
+def product(lot_number, number, country='KZ'):
+    return (lot_number, 'kaspi.kz', country, f'Бумага {number}', '450 ₸', Decimal('450'), 'KZT',
+            f'https://example.kz/{number}')
+
+
+class NamedCursor:
+    """Серверный курсор лотов: отдает строки только через fetchmany"""
+
+    def __init__(self, conn, name):
+        self.conn = conn
+        self.name = name
+        self.rows = []
+        self.closed = False
+
+    def execute(self, sql, params):
+        self.conn.lots_query = (sql, params)
+        self.rows = list(self.conn.lots)
+
+    def fetchmany(self, size):
+        self.conn.fetches.append(size)
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+    def close(self):
+        self.closed = True
+
+
+class ProductsCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rows = []
+        self.closed = False
+
+    def execute(self, sql, params):
+        self.conn.products_queries.append((sql, params))
+        lot_numbers = params[0]
+        countries = params[1] if len(params) > 1 else None
+        self.rows = [row for row in self.conn.products
+                     if row[0] in lot_numbers and (countries is None or row[2] in countries)]
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConn:
+    def __init__(self, lots, products):
+        self.lots = lots
+        self.products = products
+        self.fetches = []
+        self.products_queries = []
+        self.lots_query = None
+        self.cursors = []
+        self.rollbacks = 0
+
+    def cursor(self, name=None):
+        cursor = NamedCursor(self, name) if name else ProductsCursor(self)
+        self.cursors.append(cursor)
+        return cursor
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def filters(**args):
+    return catalog_query.parse_filters(MultiDict(args))
+
+
+@pytest.fixture
+def conn():
+    lots = [lot(number) for number in range(1, 6)]
+    products = [product('LOT-1', 1), product('LOT-1', 2, 'CN'), product('LOT-3', 3, 'RU'),
+                product('LOT-5', 4)]
+    return FakeConn(lots, products)
+
+
+def test_iter_rows_batches(conn):
+    rows = list(export.iter_rows(conn, filters(), itersize=2))
+
+    # Лоты - одним именованным курсором пачками по itersize, товары -
+    # запросом на пачку
+    named = conn.cursors[0]
+    assert named.name.startswith('export_')
+    assert conn.fetches == [2, 2, 2, 2]
+    assert [params for _, params in conn.products_queries] == [
+        [['LOT-1', 'LOT-2']], [['LOT-3', 'LOT-4']], [['LOT-5']]]
+    assert 'sr.country = ANY' not in conn.products_queries[0][0]
+
+    assert [row[0] for row in rows] == ['LOT-1', 'LOT-1', 'LOT-2', 'LOT-3', 'LOT-4', 'LOT-5']
+    assert all(len(row) == len(export.COLUMNS) for row in rows)
+    assert rows[0] == lot(1) + product('LOT-1', 1)[1:]
+    # Лот без товаров - одна строка с пустыми полями товара
+    assert rows[2] == lot(2) + export.NO_PRODUCT
+
+    assert all(cursor.closed for cursor in conn.cursors)
+    assert conn.rollbacks == 1
+
+
+def test_iter_rows_filters(conn):
+    selected = filters(country_ru='0', search='бумага', sort='newest')
+    where_sql, params = catalog_query.build_where(selected)
+    rows = list(export.iter_rows(conn, selected, itersize=10))
+
+    assert conn.lots_query == (export.LOTS_SQL.format(where=where_sql), params)
+    assert ['KZ', 'CN'] in params
+    # Товары - только выбранных стран
+    sql, products_params = conn.products_queries[0]
+    assert 'AND sr.country = ANY(%s)' in sql
+    assert products_params[1] == ['KZ', 'CN']
+    assert [row[0] for row in rows if row[10] is not None] == ['LOT-1', 'LOT-1', 'LOT-5']
+    assert [row[0] for row in rows if row[10] is None] == ['LOT-2', 'LOT-3', 'LOT-4']
+
+
+def test_iter_rows_closed_when_abandoned(conn):
+    rows = export.iter_rows(conn, filters(), itersize=2)
+    next(rows)
+    # Клиент оборвал загрузку - генератор закрывается сервером
+    rows.close()
+    assert all(cursor.closed for cursor in conn.cursors)
+    assert conn.rollbacks == 1
+
+
+def test_csv_chunks(conn, monkeypatch):
+    monkeypatch.setattr(export, 'CHUNK_ROWS', 2)
+    chunks = list(export.csv_chunks(export.iter_rows(conn, filters(), itersize=2)))
+    assert len(chunks) == 4
+
+    text = b''.join(chunks).decode('utf-8')
+    assert text.startswith('\ufeff')
+    rows = list(csv.reader(io.StringIO(text[1:])))
+    assert rows[0] == [title for _, title in export.COLUMNS]
+    assert len(rows) == 7
+    assert rows[1][:9] == ['LOT-1', 'Товар 1', '', 'Заказчик', 'Канцелярия', '10', 'шт',
+                           '5000.5', '2024-03-01T00:00:00']
+    assert rows[1][13] == '450'
+
+
+def test_jsonl_chunks(conn, monkeypatch):
+    monkeypatch.setattr(export, 'CHUNK_ROWS', 4)
+    chunks = list(export.jsonl_chunks(export.iter_rows(conn, filters(), itersize=2)))
+    assert len(chunks) == 2
+
+    records = [json.loads(line) for line in b''.join(chunks).decode('utf-8').splitlines()]
+    assert len(records) == 6
+    assert list(records[0]) == [key for key, _ in export.COLUMNS]
+    assert records[0]['tender_price'] == 5000.5
+    assert records[0]['price'] == 450
+    assert records[2]['lot_number'] == 'LOT-2' and records[2]['product_url'] is None
+
+
+def test_xlsx_chunks(conn, monkeypatch):
+    pytest.importorskip('xlsxwriter')
+    monkeypatch.setattr(export, 'XLSX_MAX_ROWS', 3)
+    data = b''.join(export.xlsx_chunks(export.iter_rows(conn, filters(), itersize=2),
+                                       chunk_size=1024))
+    with zipfile.ZipFile(io.BytesIO(data)) as book:
+        sheet = book.read('xl/worksheets/sheet1.xml').decode('utf-8')
+        strings = book.read('xl/sharedStrings.xml').decode('utf-8') \
+            if 'xl/sharedStrings.xml' in book.namelist() else ''
+    assert 'Номер лота' in sheet + strings
+    # Ссылки - текстом, без гиперссылок листа
+    assert 'https://example.kz/1' in sheet + strings
+    assert '<hyperlink' not in sheet
+    # Заголовок и не больше XLSX_MAX_ROWS строк данных
+    assert sheet.count('<row ') == 4
+
+
+class Pool:
+    """Пул из одного подключения: запоминает, когда его взяли и вернули"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.taken = []
+        self._pid = os.getpid()
+
+    @contextmanager
+    def connection(self, timeout=None, statement_timeout=None):
+        self.taken.append(statement_timeout)
+        yield self.conn
+        self.taken.append('returned')
+
+
+def test_stream_holds_connection_for_export(conn):
+    pool = Pool(conn)
+    chunks = export.stream(pool, filters(), 'jsonl')
+    assert pool.taken == []
+    assert len(b''.join(chunks).splitlines()) == 6
+    assert pool.taken == [export.STATEMENT_TIMEOUT_MS, 'returned']
+
+
+def test_catalog_export_route(client, conn):
+    db.set_pool(Pool(conn))
+    response = client.get('/catalog/export?format=csv&country_cn=0&sort=newest')
+    assert response.status_code == 200
+    assert response.content_type == 'text/csv; charset=utf-8'
+    assert response.headers['Content-Disposition'].endswith('.csv"')
+    assert response.headers['X-Accel-Buffering'] == 'no'
+    assert response.is_streamed
+
+    lines = response.get_data(as_text=True).splitlines()
+    assert lines[0].lstrip('\ufeff').startswith('Номер лота,')
+    assert len(lines) == 6
+    assert conn.products_queries[0][1][1] == ['KZ', 'RU']
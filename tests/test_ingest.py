@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+import csv
+import io
+import os
+import re
+from decimal import Decimal
+
+import pytest
+
+import ingest
+from ingest import IngestError
+
+D = Decimal
+
+
+class FakeCursor:
+    """
+    Заглушка курсора загрузки: COPY кладет строки во временную таблицу,
+    upsert применяет их к table по ключу, как ON CONFLICT в базе
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.result = None
+
+    def execute(self, sql, params=None):
+        self.conn.executed.append(sql)
+        if sql.startswith('TRUNCATE'):
+            self.conn.staging = []
+        elif 'INSERT INTO' in sql and 'WITH source' in sql:
+            self.result = self.conn.upsert()
+
+    def copy_expert(self, sql, buffer):
+        self.conn.columns = re.search(r'\((.*?)\)', sql).group(1).split(', ')
+        self.conn.staging = list(csv.reader(buffer))
+
+    def fetchone(self):
+        return self.result
+
+    def close(self):
+        pass
+
+
+class FakeConn:
+    def __init__(self, key):
+        self.key = key
+        self.table = {}
+        self.staging = []
+        self.columns = []
+        self.executed = []
+        self.commits = 0
+        self.closed = 0
+        self.autocommit = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def upsert(self):
+        source = {}
+        for row in self.staging:
+            record = dict(zip(self.columns, row))
+            record.pop('price_normalized_at', None)
+            source[tuple(record[column] for column in self.key)] = record
+        inserted = updated = 0
+        for key, record in source.items():
+            if key not in self.table:
+                inserted += 1
+            elif self.table[key] != record:
+                updated += 1
+            self.table[key] = record
+        return len(source), inserted, updated
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+
+def test_ingest_rejects_record_with_other_columns():
+    conn = FakeConn(['lot_number'])
+    records = [{'lot_number': 'LOT-1', 'customer': 'А', 'quantity': '2'},
+               {'lot_number': 'LOT-2', 'quantity': '3', 'unit': 'шт'}]
+    # Без customer вторая запись обнулила бы его у существующего лота
+    with pytest.raises(IngestError, match=r'Запись 2: .*нет: customer; лишние: unit'):
+        ingest.ingest(conn, 'lots', records)
+    assert conn.table == {}
+
+
+def test_ingest_unknown_keys_ignored():
+    conn = FakeConn(['lot_number'])
+    records = [{'lot_number': 'LOT-1', 'quantity': '2'},
+               {'lot_number': 'LOT-2', 'quantity': '3', 'comment': 'не колонка'}]
+    assert ingest.ingest(conn, 'lots', records)['inserted'] == 2
+
+
+# ============================================================================
+# ЧТЕНИЕ
+# ============================================================================
+
+# Поле длиннее csv.field_size_limit() - csv.Error
+LONG_FIELD = b'lot_number\n"' + b'x' * 200000 + b'"\n'
+
+
+def read(data, fmt):
+    return list(ingest.read_records(io.BytesIO(data), fmt))
+
+
+@pytest.mark.parametrize('data, fmt, message', [
+    (b'lot_number\nLOT-1\n\xff\xfe\n', 'csv', 'Строка 3: текст не в кодировке UTF-8'),
+    (b'lot_number,quantity\nLOT-1,2\nLOT-2\n', 'csv', 'Строка 3: число полей'),
+    (b'lot_number\nLOT-1,2\n', 'csv', 'Строка 2: число полей'),
+    (LONG_FIELD, 'csv', 'Строка 2: field larger'),
+    (b'{"lot_number": "LOT-1"}\n\n{"lot_number": \n', 'jsonl', 'Строка 3: некорректный JSON'),
+    (b'{"lot_number": "LOT-1"}\n["LOT-2"]\n', 'jsonl', 'Строка 2: ожидался объект JSON'),
+    (b'"LOT-1"\n', 'jsonl', 'Строка 1: ожидался объект JSON'),
+    (b'{}', 'xml', 'Неизвестный формат'),
+])
+def test_read_records_errors(data, fmt, message):
+    with pytest.raises(IngestError, match=message):
+        read(data, fmt)
+
+
+@pytest.mark.parametrize('filename, fmt', [
+    ('results.jsonl', 'jsonl'), ('RESULTS.NDJSON', 'jsonl'), ('results.json', 'jsonl'),
+    ('results.csv', 'csv'), ('results', 'csv'), (None, 'csv'),
+])
+def test_detect_format(filename, fmt):
+    assert ingest.detect_format(filename) == fmt
+
+
+def test_read_records_csv():
+    data = 'lot_number,product_title\nLOT-1,"Бумага, A4\n500 листов"\nLOT-2,\n'
+    # BOM в начале файла не попадает в имя первой колонки
+    assert read(b'\xef\xbb\xbf' + data.encode(), 'csv') == [
+        {'lot_number': 'LOT-1', 'product_title': 'Бумага, A4\n500 листов'},
+        {'lot_number': 'LOT-2', 'product_title': ''},
+    ]
+
+
+def test_read_records_jsonl():
+    data = '{"lot_number": "LOT-1", "quantity": 2}\n\n  \n{"lot_number": "ЛОТ-2"}'
+    assert read(data.encode(), 'jsonl') == [{'lot_number': 'LOT-1', 'quantity': 2},
+                                            {'lot_number': 'ЛОТ-2'}]
+
+
+# ============================================================================
+# /api/import
+# ============================================================================
+
+class DownPool:
+    """Пул, который не выдает подключений"""
+
+    def __init__(self, error):
+        self.error = error
+        self._pid = os.getpid()
+
+    def connection(self, timeout=None, statement_timeout=None):
+        raise self.error
+
+
+XHR = {'X-Requested-With': 'XMLHttpRequest'}
+
+
+def fake_pool(key):
+    return ingest.db.ConnectionPool(minconn=0, maxconn=1, connect=lambda: FakeConn(key))
+
+
+@pytest.mark.parametrize('data, filename, message', [
+    (b'lot_number\n\xd0\n', 'lots.csv', 'Строка 2'),
+    (LONG_FIELD, 'lots.csv', 'Строка 2'),
+    (b'[1, 2]\n', 'lots.jsonl', 'Строка 1'),
+])
+def test_api_import_bad_file(client, data, filename, message):
+    ingest.db.set_pool(fake_pool(['lot_number']))
+    response = client.post('/api/import/lots', headers=XHR,
+                           data={'file': (io.BytesIO(data), filename)})
+    assert response.status_code == 400
+    assert response.get_json()['error'].startswith(message)
+
+
+@pytest.mark.parametrize('error', [
+    ingest.db.PoolTimeout('нет свободных подключений'),
+    ingest.psycopg2.OperationalError('could not connect to server'),
+])
+def test_api_import_database_down(client, error):
+    ingest.db.set_pool(DownPool(error))
+    response = client.post('/api/import/lots', headers=XHR,
+                           data={'file': (io.BytesIO(b'lot_number\nLOT-1\n'), 'lots.csv')})
+    assert response.status_code == 503
+    assert response.headers['Retry-After']
+    assert ingest.db.get_breaker().stats()['failures'] == 1
+
+
+def test_api_import_requires_header(client):
+    # Так выглядит отправка формы с чужого сайта: cookie есть, заголовка нет
+    ingest.db.set_pool(fake_pool(['lot_number']))
+    response = client.post('/api/import/lots',
+                           data={'file': (io.BytesIO(b'lot_number\nLOT-1\n'), 'lots.csv')})
+    assert response.status_code == 403
+
+
+def test_api_import_foreign_origin_not_allowed(client):
+    response = client.options('/api/import/lots', headers={
+        'Origin': 'https://evil.example',
+        'Access-Control-Request-Method': 'POST',
+        'Access-Control-Request-Headers': 'X-Requested-With',
+    })
+    assert 'Access-Control-Allow-Origin' not in response.headers
+
+
+def test_api_import(client):
+    ingest.db.set_pool(fake_pool(['lot_number']))
+    data = b'lot_number,quantity\nLOT-1,2\n'
+    response = client.post('/api/import/lots', headers=XHR,
+                           data={'file': (io.BytesIO(data), 'lots.csv')})
+    assert response.status_code == 200
+    assert response.get_json()['inserted'] == 1
+
+
+# ============================================================================
+# ПОДГОТОВКА СТРОК И СЧЕТЧИКИ
+# ============================================================================
+
+LOT_COLUMNS = ['lot_number', 'customer', 'quantity']
+RESULT_COLUMNS = ['lot_number', 'marketplace', 'product_price', 'product_url']
+
+
+def test_prepare_lot():
+    record = {'lot_number': ' LOT-1 ', 'customer': '', 'quantity': 3}
+    assert ingest.prepare('lots', record, LOT_COLUMNS, [0], 'T') == ['LOT-1', None, '3']
+
+
+@pytest.mark.parametrize('record', [{'lot_number': ''}, {'lot_number': '  '},
+                                    {'lot_number': None}, {}])
+def test_prepare_without_key(record):
+    assert ingest.prepare('lots', record, LOT_COLUMNS, [0], 'T') is None
+
+
+@pytest.mark.parametrize('marketplace, price, expected', [
+    ('kaspi.kz', '1 299,90 ₸', (D('1299.90'), 'KZT')),
+    # Валюта без обозначения - по стране маркетплейса
+    ('ozon.ru', '500', (D('500.00'), 'RUB')),
+    ('shop.example', '500', (D('500.00'), None)),
+    ('kaspi.kz', 'по запросу', (None, None)),
+])
+def test_prepare_result_parses_price(marketplace, price, expected):
+    record = {'lot_number': 'LOT-1', 'marketplace': marketplace, 'product_price': price,
+              'product_url': 'https://example.kz/1'}
+    row = ingest.prepare('results', record, RESULT_COLUMNS, [0, 3], 'T')
+    assert row == ['LOT-1', marketplace, price, 'https://example.kz/1', *expected, 'T']
+
+
+def test_prepare_result_without_url():
+    record = {'lot_number': 'LOT-1', 'marketplace': 'kaspi.kz', 'product_price': '100'}
+    assert ingest.prepare('results', record, RESULT_COLUMNS, [0, 3], 'T') is None
+
+
+def product(number, price, lot='LOT-1'):
+    return {'lot_number': lot, 'marketplace': 'kaspi.kz', 'product_price': price,
+            'product_url': f'https://example.kz/{number}'}
+
+
+def test_ingest_counters():
+    conn = FakeConn(['lot_number', 'product_url'])
+    records = [product(1, '100 ₸'), product(2, '200 ₸'), product(1, '110 ₸'),
+               product(3, '300 ₸', lot=''), product(4, '400 ₸')]
+    stats = ingest.ingest(conn, 'results', records, batch_size=10)
+    assert {key: value for key, value in stats.items() if key != 'elapsed'} == {
+        'rows': 4, 'inserted': 3, 'updated': 0, 'unchanged': 0, 'duplicates': 1, 'skipped': 1}
+    # Из повторов ключа загружена последняя строка
+    assert conn.table['LOT-1', 'https://example.kz/1']['price'] == '110.00'
+
+    # Повторная загрузка: новая цена - обновление, остальное без изменений
+    records = [product(1, '110 ₸'), product(2, '250 ₸'), product(4, '400 ₸')]
+    stats = ingest.ingest(conn, 'results', records, batch_size=10)
+    assert (stats['inserted'], stats['updated'], stats['unchanged']) == (0, 1, 2)
+
+
+def test_ingest_batches():
+    conn = FakeConn(['lot_number'])
+    messages = []
+    records = [{'lot_number': f'LOT-{number % 4}'} for number in range(10)]
+    stats = ingest.ingest(conn, 'lots', records, batch_size=3, progress=messages.append)
+    # Повторы ключа в разных пачках - не duplicates: строка уже загружена
+    # предыдущей пачкой и не изменилась
+    assert stats['rows'] == 10
+    assert (stats['inserted'], stats['unchanged'], stats['duplicates']) == (4, 6, 0)
+    assert len(messages) == 4
+    assert sum(sql.startswith('TRUNCATE') for sql in conn.executed) == 4
+
+
+def test_ingest_empty():
+    conn = FakeConn(['lot_number'])
+    assert ingest.ingest(conn, 'lots', [])['rows'] == 0
+    assert conn.executed == []
+
+
+def test_ingest_requires_key():
+    with pytest.raises(IngestError, match='Нет обязательных колонок: product_url'):
+        ingest.ingest(FakeConn([]), 'results', [{'lot_number': 'LOT-1', 'marketplace': 'kaspi.kz'}])
+
+
+def test_upsert_ignores_normalization_time():
+    sql = ingest._upsert_sql('search_results', 'ingest_search_results',
+                             RESULT_COLUMNS + ingest.PRICE_COLUMNS, ['lot_number', 'product_url'])
+    assert 'price_normalized_at = EXCLUDED.price_normalized_at' in sql
+    assert 't.price_normalized_at' not in sql
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import db
+import instrumentation
+
+
+@pytest.fixture
+def client(client):
+    # Метрики пула без настоящих подключений
+    db.set_pool(db.ConnectionPool(minconn=0, maxconn=1, connect=None))
+    return client
+
+
+def get_metrics(client, address='127.0.0.1', headers=None):
+    return client.get('/metrics', headers=headers or {}, environ_base={'REMOTE_ADDR': address})
+
+
+@pytest.mark.parametrize('address, headers, status', [
+    ('127.0.0.1', {}, 200),
+    ('::1', {}, 200),
+    ('10.0.0.5', {}, 403),
+    # Через nginx на той же машине запрос приходит с 127.0.0.1
+    ('127.0.0.1', {'X-Forwarded-For': '203.0.113.7'}, 403),
+    ('127.0.0.1', {'Forwarded': 'for=203.0.113.7'}, 403),
+])
+def test_metrics_without_token_local_only(client, monkeypatch, address, headers, status):
+    monkeypatch.setattr(instrumentation, 'METRICS_TOKEN', None)
+    response = get_metrics(client, address, headers)
+    assert response.status_code == status
+    if status == 200:
+        text = response.get_data(as_text=True)
+        assert 'tenderfinder_db_circuit_open' in text
+        assert 'tenderfinder_db_pool_size 0' in text
+
+
+@pytest.mark.parametrize('headers, status', [
+    ({'Authorization': 'Bearer secret'}, 200),
+    ({'Authorization': 'Bearer wrong'}, 403),
+    ({}, 403),
+])
+def test_metrics_token(client, monkeypatch, headers, status):
+    monkeypatch.setattr(instrumentation, 'METRICS_TOKEN', 'secret')
+    # С токеном адрес не важен: сбор метрик с другой машины
+    assert get_metrics(client, '10.0.0.5', headers).status_code == status
+    assert get_metrics(client, '127.0.0.1').status_code == 403
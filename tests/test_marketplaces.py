@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+
+import pytest
+
+import marketplaces
+from marketplaces import Classifier, domain_pattern, hostname
+
+MIGRATION = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                         'migrations', '013_marketplace_domains.sql')
+
+
+@pytest.fixture
+def classifier():
+    return Classifier()
+
+
+@pytest.mark.parametrize('marketplace, country', [
+    # Маркеры - подстроки названия
+    ('Taobao', 'CN'),
+    ('AliExpress Россия', 'CN'),
+    ('Kaspi.kz', 'KZ'),
+    ('kaspi магазин', 'KZ'),
+    ('Wildberries', 'RU'),
+    ('chipdip.ru', 'RU'),
+    # Порядок стран: ozon.kz - Казахстан раньше, чем ozon - Россия
+    ('ozon.kz', 'KZ'),
+    ('Ozon', 'RU'),
+    ('1688.com', 'CN'),
+])
+def test_markers(classifier, marketplace, country):
+    assert classifier.classify(marketplace) == country
+
+
+@pytest.mark.parametrize('marketplace, country', [
+    ('tmall.com', 'CN'),
+    ('detail.tmall.com', 'CN'),
+    ('https://www.tmall.com/item?id=1', 'CN'),
+    ('JD.com', 'CN'),
+    ('wb.kz', 'KZ'),
+    ('https://wildberries.kz/catalog', 'KZ'),
+    ('halykmarket.kz', 'KZ'),
+    ('market.yandex.ru', 'RU'),
+    ('megamarket.ru:443', 'RU'),
+])
+def test_domains(classifier, marketplace, country):
+    assert classifier.classify(marketplace) == country
+
+
+@pytest.mark.parametrize('marketplace', ['nottmall.com', 'tmall.com.evil.org', 'yandex.ru', 'tmall com'])
+def test_domains_match_whole_labels(classifier, marketplace):
+    assert classifier.classify(marketplace) is None
+
+
+@pytest.mark.parametrize('marketplace, country', [
+    ('ВБ', 'RU'),
+    (' wb ', 'RU'),
+    ('Озон', 'RU'),
+    ('Каспи', 'KZ'),
+    ('Halyk Market', 'KZ'),
+    ('Таобао', 'CN'),
+    ('tmall', 'CN'),
+])
+def test_aliases(classifier, marketplace, country):
+    assert classifier.classify(marketplace) == country
+
+
+@pytest.mark.parametrize('marketplace', ['wbx', 'вб маркет', 'alibi'])
+def test_aliases_match_whole_name(classifier, marketplace):
+    assert classifier.classify(marketplace) is None
+
+
+@pytest.mark.parametrize('marketplace', [None, '', 'Неизвестный магазин'])
+def test_unknown(classifier, marketplace):
+    assert classifier.classify(marketplace) is None
+
+
+def test_custom_rules_with_two_elements():
+    classifier = Classifier([('KZ', ['flip']), ('RU', ['flip', 'lamoda'])])
+    assert classifier.classify('Flip.kz') == 'KZ'
+    assert classifier.classify('Lamoda') == 'RU'
+    assert classifier.classify('tmall.com') is None
+
+
+def test_group(classifier):
+    rows = [{'marketplace': 'Taobao'}, {'marketplace': 'wb.kz'}, {'marketplace': 'x'}]
+    groups = classifier.group(rows)
+    assert [len(groups[key]) for key in ('CN', 'KZ', 'RU', marketplaces.OTHER)] == [1, 1, 0, 1]
+
+
+@pytest.mark.parametrize('marketplace', [
+    'tmall.com', 'Detail.Tmall.com', 'https://www.tmall.com/item?id=1', '//tmall.com',
+    'user@tmall.com', 'tmall.com:8080/x', 'nottmall.com', 'tmall.com.evil.org',
+    'tmall com', 'tmall', 'http://jd.com#top', 'evil.org/tmall.com',
+])
+def test_sql_domain_pattern_matches_hostname(marketplace):
+    # SQL-выражение колонки и Python должны решать одинаково
+    domains = ['tmall.com', 'jd.com']
+    host = hostname(marketplace)
+    expected = bool(host) and any(host == d or host.endswith('.' + d) for d in domains)
+    assert bool(re.search(domain_pattern(domains), marketplace.strip(' ').lower())) == expected
+
+
+def test_migration_uses_default_rules():
+    with open(MIGRATION, encoding='utf-8') as f:
+        sql = f.read()
+    for line in Classifier().sql_case().splitlines():
+        assert line.strip() in sql
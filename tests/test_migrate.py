@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import migrate
+from migrate import split_sql
+
+
+@pytest.mark.parametrize('sql, expected', [
+    ('SELECT 1; SELECT 2;', ['SELECT 1', 'SELECT 2']),
+    # Последняя команда без точки с запятой
+    ('SELECT 1;\nSELECT 2', ['SELECT 1', 'SELECT 2']),
+    # ';' в строке, в том числе после удвоенной кавычки
+    ("INSERT INTO t VALUES ('a;b', 'it''s; ok'); SELECT 2",
+     ["INSERT INTO t VALUES ('a;b', 'it''s; ok')", 'SELECT 2']),
+    # ';' в комментарии
+    ('-- шаг 1; шаг 2\nSELECT 1;', ['-- шаг 1; шаг 2\nSELECT 1']),
+    # Пустые команды и одни комментарии пропускаются
+    (';;\n-- только комментарий;\n', []),
+    ('SELECT 1;\n-- хвост\n', ['SELECT 1']),
+])
+def test_split_sql(sql, expected):
+    assert split_sql(sql) == expected
+
+
+def test_split_sql_dollar_quoted():
+    sql = """
+        CREATE FUNCTION f() RETURNS trigger AS $$
+        BEGIN
+            PERFORM 1; RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+        DO $body$ BEGIN PERFORM 'x;$$'; END $body$;
+        SELECT 3
+    """
+    statements = split_sql(sql)
+    assert len(statements) == 3
+    assert statements[0].startswith('CREATE FUNCTION') and statements[0].endswith('plpgsql')
+    assert statements[1] == "DO $body$ BEGIN PERFORM 'x;$$'; END $body$"
+    assert statements[2] == 'SELECT 3'
+
+
+def test_split_sql_unterminated_dollar_quote():
+    assert split_sql('SELECT $$a; b') == ['SELECT $$a; b']
+
+
+def test_migrations_discovered_in_order():
+    migrations = migrate.discover()
+    versions = [m['version'] for m in migrations]
+    assert versions == sorted(versions)
+    assert versions[0] == 0
+    assert all(len(m['checksum']) == 64 for m in migrations)
+
+
+def test_migrations_split():
+    for migration in migrate.discover():
+        with open(migration['path'], encoding='utf-8') as f:
+            statements = split_sql(f.read())
+        assert statements, migration['name']
+        # Ни одна команда не обрывается внутри тела функции
+        for statement in statements:
+            assert statement.count('$$') % 2 == 0, migration['name']
+
+
+def test_no_transaction_detection():
+    def runs_outside_transaction(name):
+        path = next(m['path'] for m in migrate.discover() if m['name'] == name)
+        with open(path, encoding='utf-8') as f:
+            statements = split_sql(f.read())
+        return any(migrate.NO_TRANSACTION_RE.search(migrate._code(s)) for s in statements)
+
+    assert runs_outside_transaction('008_ingest.sql')
+    assert runs_outside_transaction('014_search_results_country_index.sql')
+    assert not runs_outside_transaction('012_currency_rates.sql')
+    assert not runs_outside_transaction('013_marketplace_domains.sql')
+
+
+def test_follow_up_deduplicated():
+    migrations = [{'version': version} for version in (4, 5, 11, 12, 13)]
+    # Каждая команда - один раз, на месте последнего упоминания: аналитика
+    # считается после последнего пересчета агрегатов
+    assert migrate.follow_up(migrations) == [
+        'python prices.py backfill',
+        'python summaries.py rebuild',
+        'python analytics.py run',
+    ]
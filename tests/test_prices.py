@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+from decimal import Decimal
+
+import pytest
+
+from prices import parse_number, parse_price
+
+
+@pytest.mark.parametrize('raw, expected', [
+    ('1 234,56', '1234.56'),
+    ('1,234.56', '1234.56'),
+    ('1.234,56', '1234.56'),
+    ('12,5', '12.5'),
+    ('12.50', '12.50'),
+    # Один разделитель и ровно три цифры - тысячи, для точки и запятой одинаково
+    ('1.234', '1234'),
+    ('1,234', '1234'),
+    ('0.125', '0.125'),
+    ('1.234.567', '1234567'),
+    ('1,234,567', '1234567'),
+    ('1299', '1299'),
+])
+def test_parse_number(raw, expected):
+    assert parse_number(raw) == Decimal(expected)
+
+
+def test_parse_number_empty():
+    assert parse_number(' ., ') is None
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('1 299,90 ₸', ('1299.90', 'KZT')),
+    ('Цена: 1.299 тг', ('1299.00', 'KZT')),
+    ('¥12.5-15', ('12.50', 'CNY')),
+    ('от 500 руб.', ('500.00', 'RUB')),
+    ('$1,234.56', ('1234.56', 'USD')),
+    ('1.234,56 €', ('1234.56', 'EUR')),
+])
+def test_parse_price(text, expected):
+    price, currency = expected
+    assert parse_price(text) == (Decimal(price), currency)
+
+
+def test_number_next_to_currency_wins():
+    assert parse_price('2 шт по 100 ₽') == (Decimal('100.00'), 'RUB')
+
+
+@pytest.mark.parametrize('text', ['100-200 ₽', 'от 100 до 200 ₽', '100 – 200 ₽'])
+def test_range_takes_lower_bound(text):
+    assert parse_price(text) == (Decimal('100.00'), 'RUB')
+
+
+def test_default_currency():
+    assert parse_price('1 500', 'KZT') == (Decimal('1500.00'), 'KZT')
+    assert parse_price('1 500 руб', 'KZT') == (Decimal('1500.00'), 'RUB')
+
+
+@pytest.mark.parametrize('text', [None, '', 'договорная', '9' * 20])
+def test_unparseable(text):
+    assert parse_price(text) == (None, None)
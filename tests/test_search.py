@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import search as lot_search
+
+
+@pytest.mark.parametrize('search, expected', [
+    ('ноутбук', 'ноутбук:*'),
+    ('Ноутбук HP 15', 'ноутбук:* & hp:* & 15:*'),
+    # Однобуквенные слова - без префикса
+    ('бумага а 4', 'бумага:* & а & 4'),
+    # Знаки tsquery не попадают в запрос
+    ("принтер & (canon | hp)! 'x'", 'принтер:* & canon:* & hp:* & x'),
+    ('  ,.;-  ', None),
+    ('', None),
+])
+def test_tsquery_text(search, expected):
+    assert lot_search.tsquery_text(search) == expected
+
+
+def test_build_search_params_match_placeholders():
+    where_sql, where_params, rank_sql, rank_params = lot_search.build_search('Монитр Dell')
+    # %% - литеральный % для psycopg2, не параметр
+    assert where_sql.replace('%%', '').count('%s') == len(where_params)
+    assert rank_sql.replace('%%', '').count('%s') == len(rank_params)
+    assert where_params == ['монитр:* & dell:*', 'монитр:* & dell:*', 'монитр dell', 'монитр dell']
+    assert rank_params == where_params
+
+
+def test_build_search_without_words():
+    assert lot_search.build_search(' - ') is None
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+import users
+
+
+@pytest.fixture
+def store(tmp_path):
+    return users.SqliteUserStore(str(tmp_path / 'users.db'))
+
+
+def test_default_admin(store):
+    admin = store.find_by_email(users.DEFAULT_ADMIN_EMAIL)
+    assert admin['id'] == 1
+    assert admin['is_admin'] is True and admin['has_access'] is True
+    assert isinstance(admin['created_at'], datetime)
+    # Администратор не входит в счетчики и список пользователей
+    assert store.count_users() == (0, 0)
+    assert store.list_users() == []
+
+
+def test_create_and_get(store):
+    user_id = store.create('user@example.kz', 'hash')
+    user = store.get(user_id)
+    assert user['email'] == 'user@example.kz'
+    assert user['password_hash'] == 'hash'
+    assert user['is_admin'] is False and user['has_access'] is False
+    assert user['access_until'] is None
+    assert store.find_by_email('user@example.kz') == user
+    assert store.get(user_id + 1) is None
+
+
+def test_create_duplicate_email(store):
+    user_id = store.create('user@example.kz', 'hash')
+    assert store.create('user@example.kz', 'other', has_access=True) is None
+    assert store.get(user_id)['password_hash'] == 'hash'
+    assert store.count_users() == (1, 0)
+
+
+def test_grant_and_revoke_access(store):
+    user_id = store.create('user@example.kz', 'hash')
+    until = datetime(2030, 1, 31, 23, 59)
+    store.grant_access(user_id, until)
+    user = store.get(user_id)
+    assert user['has_access'] is True
+    assert user['access_until'] == until
+    assert store.count_users() == (1, 1)
+
+    store.revoke_access(user_id)
+    user = store.get(user_id)
+    assert (user['has_access'], user['access_until']) == (False, None)
+    assert store.count_users() == (1, 0)
+
+
+def test_list_users(store):
+    first = store.create('first@example.kz', 'hash')
+    second = store.create('second@example.kz', 'hash')
+    conn = store.connection()
+    conn.execute("UPDATE users SET created_at = '2024-01-01 00:00:00' WHERE id = ?", (first,))
+    conn.commit()
+    listed = store.list_users()
+    assert [user['id'] for user in listed] == [second, first]
+    assert set(listed[0]) == {'id', 'email', 'has_access', 'access_until', 'created_at'}
+
+
+def test_release_rolls_back(store):
+    conn = store.connection()
+    conn.execute("UPDATE users SET email = 'changed' WHERE id = 1")
+    assert conn.in_transaction
+    store.release()
+    assert store.get(1)['email'] == users.DEFAULT_ADMIN_EMAIL
+
+
+# ============================================================================
+# ПЕРЕНОС (python users.py copy) - приемник тоже SQLite
+# ============================================================================
+
+class Target:
+    """
+    Подключение в стиле psycopg2 к файлу SQLite: параметры %s и функции
+    PostgreSQL, которые вызывает copy_users
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.create_function('greatest', -1, max)
+        self.conn.create_function('pg_get_serial_sequence', 2, lambda table, column: table)
+        self.sequences = {}
+        self.conn.create_function('setval', 2, self.sequences.__setitem__)
+
+    def cursor(self):
+        return TargetCursor(self.conn.cursor())
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def close(self):
+        self.conn.close()
+
+
+class TargetCursor:
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, sql, params=()):
+        self.cursor.execute(sql.replace('%s', '?'), params)
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def close(self):
+        self.cursor.close()
+
+
+@pytest.fixture
+def target_path(tmp_path):
+    path = str(tmp_path / 'target.db')
+    # Таблица и администратор с id 1 - как после migrations/010
+    users.SqliteUserStore(path).connection().close()
+    return path
+
+
+def test_copy_users(store, target_path):
+    user_id = store.create('user@example.kz', 'hash')
+    store.grant_access(user_id, datetime(2030, 1, 1))
+    target = Target(target_path)
+
+    assert users.copy_users(store.all(), target) == []
+    copied = users.SqliteUserStore(target_path)
+    assert copied.all() == store.all()
+    assert target.sequences == {'users': user_id}
+
+    # Повторный запуск обновляет записи
+    store.revoke_access(user_id)
+    assert users.copy_users(store.all(), target) == []
+    assert copied.get(user_id)['has_access'] is False
+
+
+@pytest.mark.parametrize('shift, email, reason', [
+    (0, 'other@example.kz', 'id занят user@example.kz'),
+    (1, 'user@example.kz', 'email уже у id {target_id}'),
+])
+def test_copy_users_conflicts(store, target_path, shift, email, reason):
+    target_store = users.SqliteUserStore(target_path)
+    target_id = target_store.create('user@example.kz', 'hash')
+    user_id = target_id + shift
+    rows = store.all() + [dict(store.all()[0], id=user_id, email=email, is_admin=False)]
+
+    conflicts = users.copy_users(rows, Target(target_path))
+    assert conflicts == [(user_id, email, reason.format(target_id=target_id))]
+    # Ничего не записано
+    assert [user['email'] for user in target_store.all()] == [users.DEFAULT_ADMIN_EMAIL,
+                                                             'user@example.kz']
+
+
+def test_copy_command(store, target_path, monkeypatch, capsys):
+    store.create('user@example.kz', 'hash')
+    monkeypatch.setattr(users.psycopg2, 'connect', lambda dsn: Target(target_path))
+    monkeypatch.setattr('sys.argv', ['users.py', '--dsn', 'postgresql://test', 'copy',
+                                     '--sqlite', store.path])
+    assert users.main() == 0
+    assert 'Перенесено пользователей: 2' in capsys.readouterr().out
+    # id сохраняются - сессии остаются действительными
+    copied = users.SqliteUserStore(target_path).find_by_email('user@example.kz')
+    assert copied['id'] == store.find_by_email('user@example.kz')['id']
@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TenderFinder Commercial - Хранилище пользователей
+
+USERS_BACKEND=sqlite (по умолчанию) - файл USERS_DB, для разработки и
+одного инстанса. USERS_BACKEND=postgres - таблица users в PostgreSQL
+тендеров (migrations/010_users.sql) через тот же пул: все воркеры и
+инстансы видят одних пользователей, вход не ждет блокировку файла.
+
+Оба хранилища отдают пользователя dict с is_admin / has_access (bool) и
+access_until / created_at (datetime). Администратор по умолчанию
+создается при первом обращении, если его нет.
+
+Перенос пользователей из SQLite в PostgreSQL (id сохраняются, поэтому
+сессии остаются действительными; можно запускать повторно):
+
+    python users.py copy [--sqlite users.db]
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from werkzeug.security import generate_password_hash
+
+import db
+import instrumentation
+
+DEFAULT_ADMIN_EMAIL = 'admin@tenderfinder.com'
+DEFAULT_ADMIN_PASSWORD = 'admin123'
+
+COLUMNS = ['id', 'email', 'password_hash', 'is_admin', 'has_access', 'access_until', 'created_at']
+
+
+def _user(row):
+    """Строка базы -> dict с bool и datetime независимо от хранилища"""
+    if row is None:
+        return None
+    user = dict(row)
+    for key in ('is_admin', 'has_access'):
+        if key in user:
+            user[key] = bool(user[key])
+    for key in ('access_until', 'created_at'):
+        if isinstance(user.get(key), str):
+            user[key] = datetime.fromisoformat(user[key])
+    return user
+
+
+class UserStore:
+    """
+    Общие запросы к таблице users. Хранилище реализует _fetch (SELECT) и
+    _execute (запись с фиксацией); параметры в SQL - %s.
+    """
+
+    def get(self, user_id):
+        return _user(self._fetch('SELECT * FROM users WHERE id = %s', (user_id,), one=True))
+
+    def find_by_email(self, email):
+        return _user(self._fetch('SELECT * FROM users WHERE email = %s', (email,), one=True))
+
+    def count_users(self):
+        """(пользователей, с доступом) без администраторов"""
+        row = self._fetch("""
+            SELECT COUNT(*) as total,
+                   COALESCE(SUM(CASE WHEN has_access THEN 1 ELSE 0 END), 0) as active
+            FROM users WHERE is_admin = %s
+        """, (False,), one=True)
+        return row['total'], row['active']
+
+    def list_users(self):
+        """Пользователи (без администраторов), новые сверху"""
+        rows = self._fetch("""
+            SELECT id, email, has_access, access_until, created_at
+            FROM users
+            WHERE is_admin = %s
+            ORDER BY created_at DESC
+        """, (False,))
+        return [_user(row) for row in rows]
+
+    def grant_access(self, user_id, until):
+        self._execute('UPDATE users SET has_access = %s, access_until = %s WHERE id = %s',
+                      (True, until, user_id))
+
+    def revoke_access(self, user_id):
+        self._execute('UPDATE users SET has_access = %s, access_until = NULL WHERE id = %s',
+                      (False, user_id))
+
+    def all(self):
+        """Все пользователи по id (для переноса)"""
+        return [_user(row) for row in self._fetch(f"SELECT {', '.join(COLUMNS)} FROM users ORDER BY id")]
+
+    def release(self):
+        """Конец запроса"""
+
+
+class SqliteUserStore(UserStore):
+    """Пользователи в файле SQLite (режим WAL)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = db.thread_local()
+        self._initialized = None    # pid, в котором созданы таблица и администратор
+        self._init_lock = threading.Lock()
+
+    def connection(self):
+        """
+        Постоянное подключение - одно на поток воркера (под gevent - общее
+        для гринлетов потока: вызовы sqlite3 не уступают управление, и
+        транзакции пользователей не ждут PostgreSQL).
+
+        После fork (gunicorn --preload) открывается заново.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, factory=instrumentation.sqlite_factory())
+            conn.row_factory = sqlite3.Row
+            # WAL сохраняется в файле базы: читатели не ждут писателей
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            self._init(conn)
+        return conn
+
+    def _init(self, conn):
+        with self._init_lock:
+            if self._initialized == os.getpid():
+                return
+            conn.execute('''CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                email TEXT UNIQUE NOT NULL,
+                password_hash TEXT NOT NULL,
+                is_admin INTEGER DEFAULT 0,
+                has_access INTEGER DEFAULT 0,
+                access_until TEXT,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )''')
+            conn.execute('INSERT OR IGNORE INTO users (email, password_hash, is_admin, has_access) '
+                         'VALUES (?, ?, 1, 1)',
+                         (DEFAULT_ADMIN_EMAIL, generate_password_hash(DEFAULT_ADMIN_PASSWORD)))
+            conn.commit()
+            self._initialized = os.getpid()
+
+    @staticmethod
+    def _params(params):
+        return tuple(value.isoformat() if isinstance(value, datetime) else value for value in params)
+
+    def _fetch(self, sql, params=(), one=False):
+        cursor = self.connection().execute(sql.replace('%s', '?'), self._params(params))
+        return cursor.fetchone() if one else cursor.fetchall()
+
+    def _execute(self, sql, params=()):
+        conn = self.connection()
+        conn.execute(sql.replace('%s', '?'), self._params(params))
+        conn.commit()
+
+    def create(self, email, password_hash, is_admin=False, has_access=False):
+        """id нового пользователя (None, если email занят)"""
+        conn = self.connection()
+        cursor = conn.execute(
+            'INSERT OR IGNORE INTO users (email, password_hash, is_admin, has_access) VALUES (?, ?, ?, ?)',
+            (email, password_hash, int(is_admin), int(has_access)))
+        conn.commit()
+        return cursor.lastrowid if cursor.rowcount else None
+
+    def release(self):
+        """Не оставлять незавершенную транзакцию на постоянном подключении"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and conn.in_transaction:
+            conn.rollback()
+
+
+class PostgresUserStore(UserStore):
+    """
+    Пользователи в PostgreSQL. connection - функция, возвращающая
+    контекстный менеджер с подключением (по умолчанию - из пула db.py;
+    приложение передает подключение текущего запроса).
+    """
+
+    def __init__(self, connection=None):
+        self._connection = connection or (lambda: db.get_pool().connection())
+        self._initialized = None
+        self._init_lock = threading.Lock()
+
+    @contextmanager
+    def _conn(self):
+        with self._connection() as conn:
+            if self._initialized != os.getpid():
+                with self._init_lock:
+                    if self._initialized != os.getpid():
+                        self._init(conn)
+                        self._initialized = os.getpid()
+            yield conn
+
+    def _init(self, conn):
+        """Администратор по умолчанию (таблицу создает migrations/010_users.sql)"""
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO users (email, password_hash, is_admin, has_access)
+            VALUES (%s, %s, true, true)
+            ON CONFLICT (email) DO NOTHING
+        """, (DEFAULT_ADMIN_EMAIL, generate_password_hash(DEFAULT_ADMIN_PASSWORD)))
+        conn.commit()
+        cursor.close()
+
+    def _fetch(self, sql, params=(), one=False):
+        with self._conn() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute(sql, params)
+            result = cursor.fetchone() if one else cursor.fetchall()
+            cursor.close()
+            return result
+
+    def _execute(self, sql, params=()):
+        with self._conn() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(sql, params)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+
+    def create(self, email, password_hash, is_admin=False, has_access=False):
+        """id нового пользователя (None, если email занят)"""
+        with self._conn() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("""
+                    INSERT INTO users (email, password_hash, is_admin, has_access)
+                    VALUES (%s, %s, %s, %s)
+                    ON CONFLICT (email) DO NOTHING
+                    RETURNING id
+                """, (email, password_hash, is_admin, has_access))
+                row = cursor.fetchone()
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+            return row[0] if row else None
+
+
+# ============================================================================
+# ХРАНИЛИЩЕ ПРОЦЕССА
+# ============================================================================
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def create_store(backend=None, connection=None):
+    """Хранилище по USERS_BACKEND (sqlite / postgres)"""
+    backend = backend or os.getenv('USERS_BACKEND', 'sqlite')
+    if backend == 'sqlite':
+        return SqliteUserStore(os.getenv('USERS_DB', 'users.db'))
+    if backend == 'postgres':
+        if not os.getenv('DATABASE_URL'):
+            raise RuntimeError('USERS_BACKEND=postgres требует DATABASE_URL')
+        return PostgresUserStore(connection)
+    raise ValueError(f'Неизвестное хранилище пользователей: {backend}')
+
+
+def get_store():
+    """Хранилище пользователей текущего процесса"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = create_store()
+    return _store
+
+
+def set_store(store):
+    """Подменить хранилище процесса (приложение, тесты)"""
+    global _store
+    _store = store
+
+
+# ============================================================================
+# ПЕРЕНОС SQLITE -> POSTGRESQL
+# ============================================================================
+
+def copy_users(rows, conn):
+    """
+    Записать пользователей rows (dict из UserStore.all()) в users PostgreSQL
+    с теми же id. Одна транзакция; повторный запуск обновляет записи.
+
+    Если в PostgreSQL под тем же id другой email (или тот же email под
+    другим id) - ничего не пишет и возвращает эти конфликты. Иначе
+    возвращает пустой список.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, email FROM users")
+    existing = dict(cursor.fetchall())
+    by_email = {email: user_id for user_id, email in existing.items()}
+
+    conflicts = []
+    for row in rows:
+        if row['id'] in existing and existing[row['id']] != row['email']:
+            conflicts.append((row['id'], row['email'], f"id занят {existing[row['id']]}"))
+        elif row['email'] in by_email and by_email[row['email']] != row['id']:
+            conflicts.append((row['id'], row['email'], f"email уже у id {by_email[row['email']]}"))
+    if conflicts:
+        cursor.close()
+        conn.rollback()
+        return conflicts
+
+    for row in rows:
+        cursor.execute(f"""
+            INSERT INTO users ({', '.join(COLUMNS)})
+            VALUES ({', '.join(['%s'] * len(COLUMNS))})
+            ON CONFLICT (id) DO UPDATE SET
+                password_hash = EXCLUDED.password_hash,
+                is_admin = EXCLUDED.is_admin,
+                has_access = EXCLUDED.has_access,
+                access_until = EXCLUDED.access_until,
+                created_at = EXCLUDED.created_at
+        """, [row[column] for column in COLUMNS])
+    # Новые пользователи получат id после перенесенных
+    cursor.execute("SELECT setval(pg_get_serial_sequence('users', 'id'), GREATEST(MAX(id), 1)) FROM users")
+    conn.commit()
+    cursor.close()
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Хранилище пользователей')
+    parser.add_argument('--dsn', default=os.getenv('DATABASE_URL'))
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_copy = sub.add_parser('copy', help='перенести пользователей из SQLite в PostgreSQL')
+    p_copy.add_argument('--sqlite', default=os.getenv('USERS_DB', 'users.db'))
+
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error('укажите --dsn или DATABASE_URL')
+    if not os.path.exists(args.sqlite):
+        parser.error(f'нет файла {args.sqlite}')
+
+    rows = SqliteUserStore(args.sqlite).all()
+    conn = psycopg2.connect(args.dsn)
+    try:
+        conflicts = copy_users(rows, conn)
+        for user_id, email, reason in conflicts:
+            print(f'{user_id}\t{email}\t{reason}')
+        if conflicts:
+            print('Ничего не перенесено: устраните конфликты', file=sys.stderr)
+            return 1
+        print(f'Перенесено пользователей: {len(rows)}. Теперь USERS_BACKEND=postgres')
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())